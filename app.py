@@ -1,13 +1,33 @@
 # app.py
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from src.routes import register_routes
+from src.scheduler import request_context
+from src.profiling import profile_requests
+from src.jobs import worker as job_worker
+from src.sessions import manager as session_manager
 import src.core as core
 
 print("Starting Gemma-3n")
 
-app = FastAPI(title="Gemma-3n Multimodal")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the job worker submits to the scheduler on this event loop
+    job_worker.start(asyncio.get_running_loop())
+    sweeper = asyncio.create_task(session_manager.sweep())
+    yield
+    sweeper.cancel()
+    job_worker.stop()
+
+
+app = FastAPI(title="Gemma-3n Multimodal", lifespan=lifespan)
 
 # initialize model and processor
 core.initialize_model()
+core.warmup_static_caches()
 
-register_routes(app)
+app.middleware("http")(request_context)
+app.middleware("http")(profile_requests)
+register_routes(app, core.SERVE_MODE)
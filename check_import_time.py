@@ -0,0 +1,61 @@
+# check_import_time.py
+# fails when importing a CLI entry point pulls in a heavy dependency or
+# exceeds the import-time budget; run from the repo root:
+#   python check_import_time.py [--budget-ms 300]
+import argparse
+import os
+import subprocess
+import sys
+
+ENTRY_POINTS = ["gemma3n", "cli", "waggle_cli"]
+HEAVY_MODULES = ["torch", "transformers", "fastapi", "uvicorn", "av", "librosa",
+                 "waggle", "numpy", "PIL", "requests", "yaml", "schedule"]
+
+
+def measure(module: str):
+    # returns (cumulative import time in ms, set of top-level packages imported)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+
+    cumulative_us = 0
+    packages = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        packages.add(name.strip().split(".")[0])
+        if name.strip() == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget check for the CLI entry points")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "300")),
+                        help="Maximum cumulative import time per entry point")
+    args = parser.parse_args()
+
+    failed = False
+    for module in ENTRY_POINTS:
+        ms, packages = measure(module)
+        heavy = sorted(set(HEAVY_MODULES) & packages)
+        status = "ok"
+        if heavy:
+            status = f"FAIL: imports {', '.join(heavy)} at startup"
+            failed = True
+        elif ms > args.budget_ms:
+            status = f"FAIL: over budget ({args.budget_ms:.0f} ms)"
+            failed = True
+        print(f"{module:<12} {ms:8.1f} ms  {status}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
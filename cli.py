@@ -7,13 +7,11 @@ import sys
 import tempfile
 import time
 from typing import List, Optional, Dict, Any
-import requests
-import yaml
-import schedule
 import logging
 from datetime import datetime
 
-from src.core import generate_response, build_raw_messages
+from src.core import generate_response, generate_shared_media, build_raw_messages, prefill_prefix
+from src.prompts import render
 from src.utils import extract_frames_to_tempdir, TARGET_FPS, MAX_FRAMES, TEMP_DIR
 from src.utils import IMAGE_FILE_TYPES, AUDIO_FILE_TYPES, VIDEO_FILE_TYPES
 
@@ -51,7 +49,7 @@ class GemmaCliProcessor:
                 pass
 
     def process_image_captioning(self, image_path: str, user_text: str = "", max_tokens: int = 100) -> str:
-        system_prompt = "You are an expert image analyst. Provide detailed, accurate captions describing the image content including objects, scenes, people, actions, and any notable features."
+        system_prompt = render("image_caption")
         
         content = []
         if user_text:
@@ -66,7 +64,7 @@ class GemmaCliProcessor:
         return generate_response(raw_msgs, max_tokens)
     
     def process_image_detection(self, image_path: str, event_description: str, max_tokens: int = 50) -> str:
-        system_prompt = f"You are an expert image event detector. Analyze the image and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if the event is detected, 'NO' if it's not detected, followed by a brief explanation of what you see."
+        system_prompt = render("image_event", event_description=event_description)
         
         content = [{"type": "image", "image": image_path}]
         
@@ -78,7 +76,7 @@ class GemmaCliProcessor:
         return generate_response(raw_msgs, max_tokens)
     
     def process_audio_captioning(self, audio_path: str, user_text: str = "", max_tokens: int = 100) -> str:
-        system_prompt = "You are an expert audio analyst. Provide detailed, accurate captions describing the audio content including sounds, speech, music, environment, and any notable events or patterns you detect."
+        system_prompt = render("audio_caption")
         
         content = []
         if user_text:
@@ -93,7 +91,7 @@ class GemmaCliProcessor:
         return generate_response(raw_msgs, max_tokens)
     
     def process_audio_detection(self, audio_path: str, event_description: str, max_tokens: int = 50) -> str:
-        system_prompt = f"You are an expert audio event detector. Analyze the audio and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if the event is detected, 'NO' if it's not detected, followed by a brief explanation of what you hear."
+        system_prompt = render("audio_event", event_description=event_description)
         
         content = [{"type": "audio", "audio": audio_path}]
         
@@ -105,7 +103,7 @@ class GemmaCliProcessor:
         return generate_response(raw_msgs, max_tokens)
     
     def process_video_captioning(self, video_path: str, user_text: str = "", max_tokens: int = 150) -> str:
-        system_prompt = "You are an expert video analyst. Provide detailed, accurate captions describing the video content including actions, scenes, objects, people, and any notable events or patterns. Describe the temporal progression of events."
+        system_prompt = render("video_caption")
         
         frame_dir = extract_frames_to_tempdir(
             video_path,
@@ -129,7 +127,7 @@ class GemmaCliProcessor:
         return generate_response(raw_msgs, max_tokens)
     
     def process_video_detection(self, video_path: str, event_description: str, max_tokens: int = 50) -> str:
-        system_prompt = f"You are an expert video event detector. Analyze the video and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if the event is detected, 'NO' if it's not detected, followed by a brief explanation of what you see."
+        system_prompt = render("video_event", event_description=event_description)
         
         frame_dir = extract_frames_to_tempdir(
             video_path,
@@ -149,7 +147,11 @@ class GemmaCliProcessor:
         
         return generate_response(raw_msgs, max_tokens)
     
-    def process_multimodal(self, files: List[str], system_prompt: str, user_text: str = "", max_tokens: int = 200) -> str:
+    def process_multimodal(self, files: List[str], system_prompt: str, user_text: str = "", max_tokens: int = 200, prefix: Optional[dict] = None) -> str:
+        raw_msgs = self.multimodal_messages(files, system_prompt, user_text)
+        return generate_response(raw_msgs, max_tokens, prefix=prefix)
+    
+    def multimodal_messages(self, files: List[str], system_prompt: str, user_text: str = "") -> List[dict]:
         content = []
         if user_text:
             content.append({"type": "text", "text": user_text})
@@ -176,6 +178,63 @@ class GemmaCliProcessor:
                 elif ext in VIDEO_FILE_TYPES:
                     content.append({"type": "video", "video": file_path})
         
+        return [
+            {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
+            {"role": "user", "content": content},
+        ]
+    
+    def media_items(self, files: List[str]) -> List[dict]:
+        # content items for dynamic-prompting jobs; every video is expanded
+        # into its sampled frames
+        media = []
+        for file_path in files:
+            ext = pathlib.Path(file_path).suffix.lower()
+            if ext in VIDEO_FILE_TYPES:
+                frame_dir = extract_frames_to_tempdir(
+                    file_path,
+                    target_fps=TARGET_FPS,
+                    max_frames=MAX_FRAMES,
+                    parent_dir=TEMP_DIR,
+                )
+                for frame in sorted(pathlib.Path(frame_dir).glob("*.jpg")):
+                    media.append({"type": "image", "image": frame.as_posix()})
+            elif ext in IMAGE_FILE_TYPES:
+                media.append({"type": "image", "image": file_path})
+            elif ext in AUDIO_FILE_TYPES:
+                media.append({"type": "audio", "audio": file_path})
+        return media
+    
+    def job_messages(self, media: List[dict], system_prompt: str, user_prompt: str = "") -> List[dict]:
+        # the one layout for a dynamic-prompting job, whether it runs alone
+        # or grouped: the system prompt first (its KV cache is reused across
+        # runs), then the media, then the user prompt. Jobs with the same
+        # system prompt therefore share everything up to the end of the media
+        content = list(media)
+        if user_prompt:
+            content.append({"type": "text", "text": user_prompt})
+        return [
+            {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
+            {"role": "user", "content": content},
+        ]
+    
+    def process_shared_media(self, files: List[str], prompts: List[tuple], max_tokens: List[int]) -> List[str]:
+        # several (system_prompt, user_prompt) jobs over the same media, built
+        # exactly as a lone job would be; generate_shared_media encodes the
+        # media once when the jobs share their system prompt and otherwise
+        # runs them as one batch
+        media = self.media_items(files)
+        conversations = [self.job_messages(media, system_prompt, user_prompt) for system_prompt, user_prompt in prompts]
+        return generate_shared_media(conversations, max_tokens)
+    
+    def process_media_items(self, items: List[tuple], system_prompt: str, user_text: str = "", max_tokens: int = 200) -> str:
+        # items are (mode, data) pairs where data is already in memory
+        # (PIL image, audio array) or a path the processor can load
+        content = []
+        if user_text:
+            content.append({"type": "text", "text": user_text})
+        for mode, data in items:
+            content.append({"type": mode, mode: data})
+        
         raw_msgs = [
             {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
             {"role": "user", "content": content},
@@ -184,83 +243,282 @@ class GemmaCliProcessor:
         return generate_response(raw_msgs, max_tokens)
 
 
+class ConfigWatcher:
+    # polls a YAML config cheaply: remote URLs through a pooled session with
+    # ETag / If-Modified-Since revalidation, local paths (or file:// URLs) by
+    # stat() so the file is only read and parsed after it changed
+    
+    def __init__(self, source: str):
+        self.source = source
+        self.is_remote = source.startswith(("http://", "https://"))
+        self.path = source[len("file://"):] if source.startswith("file://") else source
+        self.session = None
+        self.etag = None
+        self.last_modified = None
+        self.stamp = None
+        self.config = None
+        self.version = 0
+    
+    def poll(self):
+        # returns (config, changed); config is the last good config when the
+        # source is unchanged or temporarily unreachable
+        try:
+            text = self._fetch_remote() if self.is_remote else self._read_local()
+        except Exception as e:
+            logger.error(f"Failed to fetch config from {self.source}: {e}")
+            return self.config, False
+        if text is None:
+            return self.config, False
+        
+        import yaml
+        config = yaml.safe_load(text)
+        if config == self.config:
+            return self.config, False
+        self.config = config
+        self.version += 1
+        return self.config, True
+    
+    def _fetch_remote(self) -> Optional[str]:
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        response = self.session.get(self.source, headers=headers, timeout=30)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        return response.text
+    
+    def _read_local(self) -> Optional[str]:
+        st = os.stat(self.path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self.stamp:
+            return None
+        self.stamp = stamp
+        with open(self.path) as f:
+            return f.read()
+
+
+def media_fingerprint(files: List[str]) -> tuple:
+    fingerprint = []
+    for file_path in files:
+        st = os.stat(file_path)
+        fingerprint.append((os.path.abspath(file_path), st.st_mtime_ns, st.st_size))
+    return tuple(fingerprint)
+
+
+def parse_jobs(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # a config is either a single job (the original flat schema) or a `jobs`
+    # list; top-level keys act as defaults for every job
+    raw_jobs = config.get('jobs') or [config]
+    jobs = []
+    for i, job in enumerate(raw_jobs):
+        jobs.append({
+            'name': str(job.get('name', f"job{i}" if 'jobs' in config else "default")),
+            'system_prompt': job.get('system_prompt', config.get('system_prompt', '')),
+            'user_prompt': job.get('user_prompt', config.get('user_prompt', '')),
+            'modes': list(job.get('modes', config.get('modes', []))),
+            'max_tokens': job.get('max_tokens', config.get('max_tokens', 200)),
+            'every_minutes': job.get('every_minutes', config.get('every_minutes', 5)),
+        })
+    return jobs
+
+
 class DynamicPromptProcessor:
     
     def __init__(self, yaml_url: str):
         self.yaml_url = yaml_url
+        self.watcher = ConfigWatcher(yaml_url)
         self.last_config = None
         self.processor = GemmaCliProcessor()
+        self.jobs = []
+        self.state = {}
     
     def fetch_config(self) -> Optional[Dict[str, Any]]:
-        # fetch config from remote yaml
-        try:
-            response = requests.get(self.yaml_url, timeout=30)
-            response.raise_for_status()
-            config = yaml.safe_load(response.text)
-            return config
-        except Exception as e:
-            logger.error(f"Failed to fetch config from {self.yaml_url}: {e}")
-            return None
+        config, _ = self.watcher.poll()
+        return config
+    
+    def tick(self):
+        # called often; revalidates the config cheaply and runs whichever
+        # jobs are due (all of them after a config change)
+        config, changed = self.watcher.poll()
+        self._run(config, changed, force=False)
     
     def process_dynamic_prompt(self):
-        config = self.fetch_config()
+        config, changed = self.watcher.poll()
+        self._run(config, changed, force=True)
+    
+    def _run(self, config, config_changed, force):
         if not config:
             logger.warning("No configuration available, skipping...")
             return
         
-        config_changed = config != self.last_config
-        if config_changed:
+        if config_changed or not self.jobs:
             logger.info("Configuration changed, processing new configuration...")
             self.last_config = config
-        else:
-            logger.info("Configuration unchanged, but processing anyway (scheduled run)...")
+            self.jobs = parse_jobs(config)
+            # per-job state (prefix cache, last result) survives only for
+            # jobs whose definition did not change
+            self.state = {
+                job['name']: self.state[job['name']]
+                for job in self.jobs
+                if job['name'] in self.state and self.state[job['name']]['job'] == job
+            }
+        
+        now = time.monotonic()
+        due = []
+        for job in self.jobs:
+            state = self.state.setdefault(job['name'], {'job': job, 'last_run': None, 'prefix': None,
+                                                         'last_key': None, 'last_result': None})
+            if force or state['last_run'] is None or now - state['last_run'] >= job['every_minutes'] * 60:
+                state['last_run'] = now
+                due.append(job)
+        if not due:
+            return
         
-        try:
-            system_prompt = config.get('system_prompt', '')
-            user_prompt = config.get('user_prompt', '')
-            modes = config.get('modes', [])
-            max_tokens = config.get('max_tokens', 200)
-            
-            files = []
-            for mode in modes:
-                if mode in DEFAULT_FILES:
-                    file_path = get_file_path(DEFAULT_FILES[mode])
-                    if os.path.exists(file_path):
-                        files.append(file_path)
-                        logger.info(f"Using {mode} file: {file_path}")
-                    else:
-                        logger.warning(f"File not found: {file_path}")
-            
+        # jobs that look at the same media run together so it is encoded once
+        groups = {}
+        for job in due:
+            files = self._collect_files(job['modes'])
             if not files:
-                logger.warning("No valid files found for processing")
-                return
-            
-            result = self.processor.process_multimodal(files, system_prompt, user_prompt, max_tokens)
-            
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            config_status = "NEW CONFIG" if config_changed else "SCHEDULED RUN"
-            print(f"\n[{timestamp}] Dynamic Prompt Result ({config_status}):")
+                logger.warning(f"No valid files found for job '{job['name']}'")
+                continue
+            groups.setdefault(tuple(files), []).append(job)
+        
+        for files, jobs in groups.items():
+            try:
+                self._run_group(list(files), jobs, config_changed)
+            except Exception as e:
+                logger.error(f"Error processing dynamic prompt jobs {[j['name'] for j in jobs]}: {e}")
+    
+    def _collect_files(self, modes):
+        files = []
+        for mode in modes:
+            if mode in DEFAULT_FILES:
+                file_path = get_file_path(DEFAULT_FILES[mode])
+                if os.path.exists(file_path):
+                    files.append(file_path)
+                else:
+                    logger.warning(f"File not found: {file_path}")
+        return files
+    
+    def _run_group(self, files, jobs, config_changed):
+        fingerprint = media_fingerprint(files)
+        results = {}
+        pending = []
+        for job in jobs:
+            state = self.state[job['name']]
+            if state['last_key'] == fingerprint:
+                logger.info(f"Job '{job['name']}': configuration and media unchanged, reusing previous result")
+                results[job['name']] = (state['last_result'], "REUSED")
+            else:
+                pending.append(job)
+        
+        if len(pending) == 1:
+            job = pending[0]
+            state = self.state[job['name']]
+            raw_msgs = self.processor.job_messages(self.processor.media_items(files), job['system_prompt'], job['user_prompt'])
+            if state['prefix'] is None and job['system_prompt']:
+                # the system prompt only changes with the job definition, so
+                # its KV cache is built once and reused by every later run
+                state['prefix'] = prefill_prefix(raw_msgs)
+            replies = [generate_response(raw_msgs, job['max_tokens'], prefix=state['prefix'])]
+        elif pending:
+            logger.info(f"Running {len(pending)} jobs over shared media: {[j['name'] for j in pending]}")
+            replies = self.processor.process_shared_media(
+                files,
+                [(job['system_prompt'], job['user_prompt']) for job in pending],
+                [job['max_tokens'] for job in pending],
+            )
+        else:
+            replies = []
+        
+        for job, reply in zip(pending, replies):
+            state = self.state[job['name']]
+            state['last_key'] = fingerprint
+            state['last_result'] = reply
+            results[job['name']] = (reply, "NEW CONFIG" if config_changed else "SCHEDULED RUN")
+        
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for job in jobs:
+            if job['name'] not in results:
+                continue
+            result, config_status = results[job['name']]
+            print(f"\n[{timestamp}] Dynamic Prompt Result - {job['name']} ({config_status}):")
             print("="*60)
-            print(f"System: {system_prompt}")
-            print(f"User: {user_prompt}")
-            print(f"Modes: {modes}")
+            print(f"System: {job['system_prompt']}")
+            print(f"User: {job['user_prompt']}")
+            print(f"Modes: {job['modes']}")
             print(f"Files: {files}")
             print("-"*60)
             print(result)
             print("="*60)
+
+
+def run_inference(processor: GemmaCliProcessor, args, files: List[str]) -> Optional[str]:
+    if args.task == 'caption':
+        if len(files) == 1:
+            file_path = files[0]
+            ext = pathlib.Path(file_path).suffix.lower()
             
-        except Exception as e:
-            logger.error(f"Error processing dynamic prompt: {e}")
+            if ext in IMAGE_FILE_TYPES:
+                result = processor.process_image_captioning(file_path, args.user_text, args.max_tokens)
+            elif ext in AUDIO_FILE_TYPES:
+                result = processor.process_audio_captioning(file_path, args.user_text, args.max_tokens)
+            elif ext in VIDEO_FILE_TYPES:
+                result = processor.process_video_captioning(file_path, args.user_text, args.max_tokens)
+            else:
+                logger.error(f"Unsupported file type: {ext}")
+                return
+        else:
+            system_prompt = render("multimodal_caption")
+            result = processor.process_multimodal(files, system_prompt, args.user_text, args.max_tokens)
+    
+    elif args.task == 'detect':
+        if not args.event_description:
+            logger.error("Event description is required for detection task")
+            return
+        
+        if len(files) == 1:
+            file_path = files[0]
+            ext = pathlib.Path(file_path).suffix.lower()
+            
+            if ext in IMAGE_FILE_TYPES:
+                result = processor.process_image_detection(file_path, args.event_description, args.max_tokens)
+            elif ext in AUDIO_FILE_TYPES:
+                result = processor.process_audio_detection(file_path, args.event_description, args.max_tokens)
+            elif ext in VIDEO_FILE_TYPES:
+                result = processor.process_video_detection(file_path, args.event_description, args.max_tokens)
+            else:
+                logger.error(f"Unsupported file type: {ext}")
+                return
+        else:
+            system_prompt = render("multimodal_event", event_description=args.event_description)
+            result = processor.process_multimodal(files, system_prompt, args.user_text, args.max_tokens)
+    
+    else:
+        logger.error(f"Unknown task: {args.task}")
+        return
+    
+    return result
 
 
-def run_task(processor: GemmaCliProcessor, args):
+def run_task(processor: GemmaCliProcessor, args, gate=None):
     try:
         files = []
+        items = []
         for mode in args.modes:
             if mode in DEFAULT_FILES:
                 file_path = get_file_path(DEFAULT_FILES[mode])
                 if os.path.exists(file_path):
                     files.append(file_path)
+                    items.append((mode, file_path))
                     logger.info(f"Using {mode} file: {file_path}")
                 else:
                     logger.error(f"File not found: {file_path}")
@@ -270,52 +528,26 @@ def run_task(processor: GemmaCliProcessor, args):
             logger.error("No valid files found for processing")
             return
         
-        if args.task == 'caption':
-            if len(files) == 1:
-                file_path = files[0]
-                ext = pathlib.Path(file_path).suffix.lower()
-                
-                if ext in IMAGE_FILE_TYPES:
-                    result = processor.process_image_captioning(file_path, args.user_text, args.max_tokens)
-                elif ext in AUDIO_FILE_TYPES:
-                    result = processor.process_audio_captioning(file_path, args.user_text, args.max_tokens)
-                elif ext in VIDEO_FILE_TYPES:
-                    result = processor.process_video_captioning(file_path, args.user_text, args.max_tokens)
-                else:
-                    logger.error(f"Unsupported file type: {ext}")
+        reused = False
+        if gate is not None:
+            changed, signatures, scores = gate.check(items)
+            if not changed:
+                if args.on_unchanged == 'suppress':
+                    logger.info(f"No significant change (scores: {scores}), skipping inference")
                     return
-            else:
-                system_prompt = "You are an expert multimodal analyst. Provide detailed, accurate captions describing the content across all provided media types."
-                result = processor.process_multimodal(files, system_prompt, args.user_text, args.max_tokens)
+                logger.info(f"No significant change (scores: {scores}), reusing previous result")
+                result = gate.last_result
+                reused = True
         
-        elif args.task == 'detect':
-            if not args.event_description:
-                logger.error("Event description is required for detection task")
+        if not reused:
+            result = run_inference(processor, args, files)
+            if result is None:
                 return
-            
-            if len(files) == 1:
-                file_path = files[0]
-                ext = pathlib.Path(file_path).suffix.lower()
-                
-                if ext in IMAGE_FILE_TYPES:
-                    result = processor.process_image_detection(file_path, args.event_description, args.max_tokens)
-                elif ext in AUDIO_FILE_TYPES:
-                    result = processor.process_audio_detection(file_path, args.event_description, args.max_tokens)
-                elif ext in VIDEO_FILE_TYPES:
-                    result = processor.process_video_detection(file_path, args.event_description, args.max_tokens)
-                else:
-                    logger.error(f"Unsupported file type: {ext}")
-                    return
-            else:
-                system_prompt = f"You are an expert multimodal event detector. Analyze all provided media and determine if the following event is occurring: '{args.event_description}'. Respond with 'YES' if detected, 'NO' if not, followed by explanation."
-                result = processor.process_multimodal(files, system_prompt, args.user_text, args.max_tokens)
-        
-        else:
-            logger.error(f"Unknown task: {args.task}")
-            return
+            if gate is not None:
+                gate.commit(signatures, result)
         
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"\n[{timestamp}] Task: {args.task.upper()}")
+        print(f"\n[{timestamp}] Task: {args.task.upper()}{' (UNCHANGED)' if reused else ''}")
         print("="*60)
         print(f"Modes: {args.modes}")
         print(f"Files: {files}")
@@ -329,9 +561,9 @@ def run_task(processor: GemmaCliProcessor, args):
         logger.error(f"Error running task: {e}")
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Gemma3n CLI Tool')
-    parser.add_argument('task', choices=['caption', 'detect', 'dynamic-prompting'], 
+    parser.add_argument('task', choices=['caption', 'detect', 'dynamic-prompting', 'batch'], 
                        help='Task to perform')
     parser.add_argument('--modes', nargs='+', choices=['image', 'audio', 'video'], 
                        default=['image'], help='Media modes to process')
@@ -345,34 +577,71 @@ def main():
                        help='Run periodically every N minutes (0 = run once)')
     parser.add_argument('--yaml-url', type=str, 
                        help='URL to YAML configuration file (required for dynamic-prompting)')
+    parser.add_argument('--gate', action='store_true',
+                       help='With --period, skip inference when the media has not changed since the last run')
+    parser.add_argument('--image-change-threshold', type=float, default=None,
+                       help='Image change score (0-1) needed to run inference when --gate is set')
+    parser.add_argument('--audio-change-threshold', type=float, default=None,
+                       help='Audio change score (0-1) needed to run inference when --gate is set')
+    parser.add_argument('--on-unchanged', choices=['republish', 'suppress'], default='republish',
+                       help='Print the previous result or nothing when the media is unchanged')
+    parser.add_argument('--watch-interval', type=int, default=None,
+                       help='Seconds between config revalidations in dynamic-prompting mode (default: 5 for local files, 60 for URLs)')
+    parser.add_argument('--input', type=str,
+                       help='Directory or manifest (.jsonl or one path per line) to process (required for batch)')
+    parser.add_argument('--output', type=str,
+                       help='Results file for batch: .jsonl, or a .parquet directory of part files; reruns resume from it')
+    parser.add_argument('--batch-size', type=int, default=8,
+                       help='Files of the same kind per generate call in batch mode')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Decode threads preparing media ahead of the model in batch mode')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     processor = GemmaCliProcessor()
     
+    if args.task == 'dynamic-prompting' or args.period > 0:
+        import schedule
+    
+    if args.task == 'batch':
+        if not args.input or not args.output:
+            logger.error("--input and --output are required for batch mode")
+            sys.exit(1)
+        from src.batch import run_batch
+        summary = run_batch(args.input, args.output, args.max_tokens, args.batch_size, args.workers,
+                            args.event_description or "", args.user_text)
+        logger.info(f"Batch finished: {summary}")
+        if summary['failed']:
+            sys.exit(2)
+        return
+    
     if args.task == 'dynamic-prompting':
         if not args.yaml_url:
             logger.error("--yaml-url is required for dynamic-prompting mode")
             sys.exit(1)
         
         dynamic_processor = DynamicPromptProcessor(args.yaml_url)
+        watch_interval = args.watch_interval or (60 if dynamic_processor.watcher.is_remote else 5)
         
         dynamic_processor.process_dynamic_prompt()
         
-        schedule.every(5).minutes.do(dynamic_processor.process_dynamic_prompt)
+        schedule.every(watch_interval).seconds.do(dynamic_processor.tick)
         
-        logger.info("Dynamic prompting mode started (5 minute intervals)")
+        logger.info(f"Dynamic prompting mode started (config checked every {watch_interval}s, jobs run on their own schedules)")
         while True:
             schedule.run_pending()
-            time.sleep(60)  
+            time.sleep(min(60, watch_interval))  
     
     else:
         if args.period > 0:
             logger.info(f"Starting periodic execution every {args.period} minutes")
             
-            run_task(processor, args)
+            from src.gating import build_gate
+            gate = build_gate(args)
+            
+            run_task(processor, args, gate)
             
-            schedule.every(args.period).minutes.do(run_task, processor, args)
+            schedule.every(args.period).minutes.do(run_task, processor, args, gate)
             
             while True:
                 schedule.run_pending()
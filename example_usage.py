@@ -1,156 +1,112 @@
 
-import requests
+import asyncio
 import json
 import os
 from pathlib import Path
 
+from gemma3n_client import AsyncClient, Client
 
-BASE_URL = "http://localhost:8080"  
 
+BASE_URL = "http://localhost:8080"
 
-def test_audio_captioning(audio_file_path: str):
-    url = f"{BASE_URL}/audio/captioning"
-    
-    with open(audio_file_path, 'rb') as f:
-        files = {'file': f}
-        data = {'user_text': 'Describe this audio in detail', 'max_new_tokens': 100}
-        
-        response = requests.post(url, files=files, data=data)
-        
-    print("Audio Captioning Result:")
-    print(json.dumps(response.json(), indent=2))
+# one pooled client for every example; retries 429/503 with backoff
+client = Client(BASE_URL, max_concurrency=4)
+
+
+def show(title: str, result):
+    print(title)
+    print(json.dumps(result, indent=2))
     print("-" * 50)
 
 
+def test_audio_captioning(audio_file_path: str):
+    result = client.audio_captioning(audio_file_path, user_text='Describe this audio in detail', max_new_tokens=100)
+    show("Audio Captioning Result:", result)
+
+
 def test_audio_event_detection(audio_file_path: str, event: str):
-    url = f"{BASE_URL}/audio/event_detection"
-    
-    with open(audio_file_path, 'rb') as f:
-        files = {'file': f}
-        data = {'event_description': event, 'max_new_tokens': 50}
-        
-        response = requests.post(url, files=files, data=data)
-        
-    print(f"Audio Event Detection Result (Event: {event}):")
-    print(json.dumps(response.json(), indent=2))
-    print("-" * 50)
+    result = client.audio_event_detection(audio_file_path, event, max_new_tokens=50)
+    show(f"Audio Event Detection Result (Event: {event}):", result)
 
 
 def test_image_classification(image_file_path: str, categories: str = ""):
-    url = f"{BASE_URL}/vision/image_classification"
-    
-    with open(image_file_path, 'rb') as f:
-        files = {'file': f}
-        data = {'categories': categories, 'max_new_tokens': 50}
-        
-        response = requests.post(url, files=files, data=data)
-        
-    print("Image Classification Result:")
-    print(json.dumps(response.json(), indent=2))
-    print("-" * 50)
+    result = client.image_classification(image_file_path, categories, max_new_tokens=50)
+    show("Image Classification Result:", result)
 
 
 def test_image_event_detection(image_file_path: str, event: str):
-    url = f"{BASE_URL}/vision/image_event_detection"
-    
-    with open(image_file_path, 'rb') as f:
-        files = {'file': f}
-        data = {'event_description': event, 'max_new_tokens': 50}
-        
-        response = requests.post(url, files=files, data=data)
-        
-    print(f"Image Event Detection Result (Event: {event}):")
-    print(json.dumps(response.json(), indent=2))
-    print("-" * 50)
+    result = client.image_event_detection(image_file_path, event, max_new_tokens=50)
+    show(f"Image Event Detection Result (Event: {event}):", result)
 
 
 def test_image_change_detection(image1_path: str, image2_path: str):
-    url = f"{BASE_URL}/vision/image_change_detection"
-    
-    with open(image1_path, 'rb') as f1, open(image2_path, 'rb') as f2:
-        files = {'file1': f1, 'file2': f2}
-        data = {'max_new_tokens': 100}
-        
-        response = requests.post(url, files=files, data=data)
-        
-    print("Image Change Detection Result:")
-    print(json.dumps(response.json(), indent=2))
+    result = client.image_change_detection(image2_path, file1=image1_path, max_new_tokens=100)
+    show("Image Change Detection Result:", result)
+
+def test_bounding_box_detection(image_file_path: str, object_name: str, draw_boxes: bool = False):
+    result = client.bounding_box_detection(image_file_path, object_name, max_new_tokens=150, draw_boxes=draw_boxes)
+    print("Bounding Box Detection Result:")
+    print(json.dumps(result, indent=2))
+
+    if draw_boxes and result.get("image_with_boxes"):
+        out_path = Path(image_file_path).with_suffix(".boxes.jpg")
+        client.download(result['image_with_boxes'], out_path)
+        print(f"Overlay saved to {out_path}")
     print("-" * 50)
 
-def test_bounding_box_detection(image_file_path: str, categories: str, draw_boxes: bool = False, save_to_beehive: bool = False):
-    pass
-
 def test_video_captioning(video_file_path: str):
-    url = f"{BASE_URL}/video/captioning"
-    
-    with open(video_file_path, 'rb') as f:
-        files = {'file': f}
-        data = {'user_text': 'Describe what happens in this video', 'max_new_tokens': 150}
-        
-        response = requests.post(url, files=files, data=data)
-        
-    print("Video Captioning Result:")
-    print(json.dumps(response.json(), indent=2))
-    print("-" * 50)
+    result = client.video_captioning(video_file_path, user_text='Describe what happens in this video', max_new_tokens=150)
+    show("Video Captioning Result:", result)
 
 
 def test_video_event_detection(video_file_path: str, event: str):
-    url = f"{BASE_URL}/video/event_detection"
-    
-    with open(video_file_path, 'rb') as f:
-        files = {'file': f}
-        data = {'event_description': event, 'max_new_tokens': 100}
-        
-        response = requests.post(url, files=files, data=data)
-        
-    print(f"Video Event Detection Result (Event: {event}):")
-    print(json.dumps(response.json(), indent=2))
-    print("-" * 50)
+    result = client.video_event_detection(video_file_path, event, max_new_tokens=100)
+    show(f"Video Event Detection Result (Event: {event}):", result)
 
 
 def test_multimodal_audio_vision(audio_file_path: str, image_file_path: str):
-    url = f"{BASE_URL}/multimodal/audio_vision"
-    
-    with open(audio_file_path, 'rb') as af, open(image_file_path, 'rb') as if_:
-        files = {'audio_file': af, 'image_file': if_}
-        data = {'user_text': 'Analyze the relationship between the audio and image', 'max_new_tokens': 150}
-        
-        response = requests.post(url, files=files, data=data)
-        
-    print("Multimodal Audio-Vision Result:")
-    print(json.dumps(response.json(), indent=2))
-    print("-" * 50)
+    result = client.audio_vision(audio_file_path, image_file_path,
+                                 user_text='Analyze the relationship between the audio and image', max_new_tokens=150)
+    show("Multimodal Audio-Vision Result:", result)
 
 
 def test_multimodal_audio_video(audio_file_path: str, video_file_path: str):
-    url = f"{BASE_URL}/multimodal/audio_video"
-    
-    with open(audio_file_path, 'rb') as af, open(video_file_path, 'rb') as vf:
-        files = {'audio_file': af, 'video_file': vf}
-        data = {'user_text': 'Analyze the relationship between the audio and video', 'max_new_tokens': 200}
-        
-        response = requests.post(url, files=files, data=data)
-        
-    print("Multimodal Audio-Video Result:")
-    print(json.dumps(response.json(), indent=2))
+    result = client.audio_video(audio_file_path, video_file_path,
+                                user_text='Analyze the relationship between the audio and video', max_new_tokens=200)
+    show("Multimodal Audio-Video Result:", result)
+
+
+def test_many_events(image_file_path: str, events: list):
+    # several questions about one image, sent concurrently; results are
+    # printed as they arrive
+    items = [{"file": image_file_path, "event_description": event} for event in events]
+    for i, result in client.map("image_event_detection", items):
+        if isinstance(result, Exception):
+            print(f"{events[i]}: failed: {result}")
+        else:
+            print(f"{events[i]}: {result['reply']}")
     print("-" * 50)
 
 
-def list_available_endpoints():
-    url = f"{BASE_URL}/endpoints"
-    response = requests.get(url)
-    
-    print("Available Endpoints:")
-    print(json.dumps(response.json(), indent=2))
+async def test_async_classification(image_files: list):
+    # the async client bounds in-flight requests to max_concurrency
+    async with AsyncClient(BASE_URL, max_concurrency=8) as aclient:
+        results = await aclient.gather("image_classification", image_files, categories="nature, urban, indoor, outdoor")
+    for path, result in zip(image_files, results):
+        print(f"{path}: {result if isinstance(result, Exception) else result['reply']}")
     print("-" * 50)
 
 
+def list_available_endpoints():
+    show("Available Endpoints:", client.endpoints())
+
+
 def main():
     print("Gemma-3n mm API Examples")
     print("=" * 50)
-    
+
     list_available_endpoints()
-    
+
     audio_file = "assets/audio.mp3"
     image_file = "assets/image.jpg"
     image_file_2 = "assets/image_2.jpg"
@@ -160,24 +116,31 @@ def main():
     if os.path.exists(audio_file):
         test_audio_captioning(audio_file)
         test_audio_event_detection(audio_file, "music playing")
-    
+
     if os.path.exists(image_file):
         test_image_classification(image_file, "nature, urban, indoor, outdoor")
         test_image_event_detection(image_file, "people walking")
-    
+        test_many_events(image_file, ["people walking", "a vehicle", "rain", "an animal"])
+
     if os.path.exists(image_file_2) and os.path.exists(image_file):
         test_image_change_detection(image_file, image_file_2)
-    
+        asyncio.run(test_async_classification([image_file, image_file_2]))
+
+    if os.path.exists(person_file):
+        test_bounding_box_detection(person_file, "person", draw_boxes=True)
+
     if os.path.exists(video_file):
         test_video_captioning(video_file)
         test_video_event_detection(video_file, "person speaking")
-    
+
     if os.path.exists(audio_file) and os.path.exists(image_file):
         test_multimodal_audio_vision(audio_file, image_file)
-    
+
     if os.path.exists(audio_file) and os.path.exists(video_file):
         test_multimodal_audio_video(audio_file, video_file)
-    
+
+    client.close()
+
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
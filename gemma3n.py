@@ -3,18 +3,23 @@
 import argparse
 import sys
 import os
-import subprocess
 from pathlib import Path
 
+from src.daemon import SOCKET_PATH
+
 def serve_command(args):
     import uvicorn
     
     print(f"Starting Gemma3n server on {args.host}:{args.port}")
     print(f"Mode: {args.mode}")
+    os.environ["GEMMA3N_MODE"] = args.mode
     
     if args.model:
         os.environ["IMG_MODEL"] = args.model
     
+    if args.replicas > 1:
+        return serve_replicas(args)
+    
     uvicorn.run(
         "app:app",
         host=args.host,
@@ -24,73 +29,159 @@ def serve_command(args):
         reload=args.reload,
     )
 
-def cli_command(args):
-    cmd = [sys.executable, "cli.py"]
+def serve_replicas(args):
+    # N pinned inference servers on local ports behind a dispatcher that
+    # listens on --host/--port
+    import uvicorn
+    from src.replicas import launch_replicas, create_dispatcher
     
-    cmd.append(args.task)
+    base_port = args.replica_base_port or args.port + 1
+    replicas = launch_replicas(args.replicas, "127.0.0.1", base_port)
+    try:
+        uvicorn.run(
+            create_dispatcher([r["url"] for r in replicas]),
+            host=args.host,
+            port=args.port,
+            log_level="info",
+        )
+    finally:
+        for r in replicas:
+            r["process"].terminate()
+        for r in replicas:
+            r["process"].wait()
+
+def daemon_command(args):
+    from src.daemon import serve
+    
+    if args.model:
+        os.environ["IMG_MODEL"] = args.model
+    
+    serve(args.socket)
+
+def run_job(entry, argv, one_shot, socket_path, label=None):
+    # one-shot jobs go to a running daemon when there is one; everything
+    # else (or no daemon) runs in this process instead of a fresh interpreter
+    from src.daemon import submit, run_entry
+    
+    if one_shot:
+        code = submit(entry, argv, socket_path)
+        if code is not None:
+            return code
+    if label:
+        print(f"Running {label} in-process: {' '.join(argv)}")
+    return run_entry(entry, argv)
+
+def cli_command(args):
+    argv = [args.task]
     
     if hasattr(args, 'modes') and args.modes:
-        cmd.extend(["--modes"] + args.modes)
+        argv.extend(["--modes"] + args.modes)
     
     if hasattr(args, 'event_description') and args.event_description:
-        cmd.extend(["--event-description", args.event_description])
+        argv.extend(["--event-description", args.event_description])
     
     if hasattr(args, 'user_text') and args.user_text:
-        cmd.extend(["--user-text", args.user_text])
+        argv.extend(["--user-text", args.user_text])
     
     if hasattr(args, 'max_tokens') and args.max_tokens:
-        cmd.extend(["--max-tokens", str(args.max_tokens)])
+        argv.extend(["--max-tokens", str(args.max_tokens)])
     
     if hasattr(args, 'period') and args.period:
-        cmd.extend(["--period", str(args.period)])
+        argv.extend(["--period", str(args.period)])
     
     if hasattr(args, 'yaml_url') and args.yaml_url:
-        cmd.extend(["--yaml-url", args.yaml_url])
+        argv.extend(["--yaml-url", args.yaml_url])
     
-    try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"CLI command failed: {e}")
+    if hasattr(args, 'watch_interval') and args.watch_interval:
+        argv.extend(["--watch-interval", str(args.watch_interval)])
+    
+    if hasattr(args, 'gate') and args.gate:
+        argv.append("--gate")
+    
+    if hasattr(args, 'image_change_threshold') and args.image_change_threshold is not None:
+        argv.extend(["--image-change-threshold", str(args.image_change_threshold)])
+    
+    if hasattr(args, 'audio_change_threshold') and args.audio_change_threshold is not None:
+        argv.extend(["--audio-change-threshold", str(args.audio_change_threshold)])
+    
+    if hasattr(args, 'on_unchanged') and args.on_unchanged:
+        argv.extend(["--on-unchanged", args.on_unchanged])
+    
+    if hasattr(args, 'input') and args.input:
+        argv.extend(["--input", args.input])
+    
+    if hasattr(args, 'output') and args.output:
+        argv.extend(["--output", args.output])
+    
+    if hasattr(args, 'batch_size') and args.batch_size:
+        argv.extend(["--batch-size", str(args.batch_size)])
+    
+    if hasattr(args, 'workers') and args.workers:
+        argv.extend(["--workers", str(args.workers)])
+    
+    one_shot = not args.period and args.task != 'dynamic-prompting'
+    code = run_job("cli", argv, one_shot, args.socket)
+    if code:
+        print(f"CLI command failed with exit code {code}")
         sys.exit(1)
 
 def waggle_command(args):
-    cmd = [sys.executable, "waggle_cli.py"]
-    
-    cmd.append(args.task)
+    argv = [args.task]
     
     if hasattr(args, 'modes') and args.modes:
-        cmd.extend(["--modes"] + args.modes)
+        argv.extend(["--modes"] + args.modes)
     
     if hasattr(args, 'event_description') and args.event_description:
-        cmd.extend(["--event-description", args.event_description])
+        argv.extend(["--event-description", args.event_description])
     
     if hasattr(args, 'user_text') and args.user_text:
-        cmd.extend(["--user-text", args.user_text])
+        argv.extend(["--user-text", args.user_text])
     
     if hasattr(args, 'max_tokens') and args.max_tokens:
-        cmd.extend(["--max-tokens", str(args.max_tokens)])
+        argv.extend(["--max-tokens", str(args.max_tokens)])
     
     if hasattr(args, 'period') and args.period:
-        cmd.extend(["--period", str(args.period)])
+        argv.extend(["--period", str(args.period)])
     
     if hasattr(args, 'live_capture') and args.live_capture:
-        cmd.append("--live-capture")
+        argv.append("--live-capture")
     
     if hasattr(args, 'audio_duration') and args.audio_duration:
-        cmd.extend(["--audio-duration", str(args.audio_duration)])
+        argv.extend(["--audio-duration", str(args.audio_duration)])
     
     if hasattr(args, 'camera_device') and args.camera_device:
-        cmd.extend(["--camera-device", args.camera_device])
+        argv.extend(["--camera-device", args.camera_device])
     
     if hasattr(args, 'log_dir') and args.log_dir:
-        cmd.extend(["--log-dir", args.log_dir])
+        argv.extend(["--log-dir", args.log_dir])
     
-    print(f"Running Waggle CLI command: {' '.join(cmd)}")
+    if hasattr(args, 'no_pipeline') and args.no_pipeline:
+        argv.append("--no-pipeline")
     
-    try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Waggle CLI command failed: {e}")
+    if hasattr(args, 'queue_size') and args.queue_size:
+        argv.extend(["--queue-size", str(args.queue_size)])
+    
+    if hasattr(args, 'gate') and args.gate:
+        argv.append("--gate")
+    
+    if hasattr(args, 'image_change_threshold') and args.image_change_threshold is not None:
+        argv.extend(["--image-change-threshold", str(args.image_change_threshold)])
+    
+    if hasattr(args, 'audio_change_threshold') and args.audio_change_threshold is not None:
+        argv.extend(["--audio-change-threshold", str(args.audio_change_threshold)])
+    
+    if hasattr(args, 'on_unchanged') and args.on_unchanged:
+        argv.extend(["--on-unchanged", args.on_unchanged])
+    
+    if hasattr(args, 'spool_dir') and args.spool_dir:
+        argv.extend(["--spool-dir", args.spool_dir])
+    
+    if hasattr(args, 'no_spool') and args.no_spool:
+        argv.append("--no-spool")
+    
+    code = run_job("waggle", argv, not args.period, args.socket, label="Waggle CLI")
+    if code:
+        print(f"Waggle CLI command failed with exit code {code}")
         sys.exit(1)
 
 def main():
@@ -109,16 +200,28 @@ def main():
                              help='Port to bind to')
     serve_parser.add_argument('--mode', type=str, default='multimodal',
                              choices=['audio', 'video', 'image', 'multimodal'],
-                             help='Server mode')
+                             help='Modalities to serve; unused encoder towers are not kept in memory')
     serve_parser.add_argument('--model', type=str,
                              help='Model ID to use (overrides IMG_MODEL env var)')
     serve_parser.add_argument('--reload', action='store_true',
                              help='Enable auto-reload during development')
+    serve_parser.add_argument('--replicas', type=int, default=1,
+                             help='Run N inference replicas, each pinned to its own cores, behind a least-loaded dispatcher')
+    serve_parser.add_argument('--replica-base-port', type=int,
+                             help='First local port for replicas (default: --port + 1)')
     serve_parser.set_defaults(func=serve_command)
     
+    # daemon command
+    daemon_parser = subparsers.add_parser('daemon', help='Keep the model loaded and run cli/waggle jobs sent over a Unix socket')
+    daemon_parser.add_argument('--socket', type=str, default=SOCKET_PATH,
+                              help='Unix domain socket to listen on')
+    daemon_parser.add_argument('--model', type=str,
+                              help='Model ID to use (overrides IMG_MODEL env var)')
+    daemon_parser.set_defaults(func=daemon_command)
+    
     # cli command  
     cli_parser = subparsers.add_parser('cli', help='Run CLI operations')
-    cli_parser.add_argument('task', choices=['caption', 'detect', 'dynamic-prompting'],
+    cli_parser.add_argument('task', choices=['caption', 'detect', 'dynamic-prompting', 'batch'],
                            help='Task to perform')
     cli_parser.add_argument('--modes', nargs='+', choices=['image', 'audio', 'video'],
                            default=['image'], help='Media modes to process')
@@ -132,6 +235,26 @@ def main():
                            help='Run periodically every N minutes (0 = run once)')
     cli_parser.add_argument('--yaml-url', type=str,
                            help='URL to YAML configuration file (required for dynamic-prompting)')
+    cli_parser.add_argument('--watch-interval', type=int,
+                           help='Seconds between config revalidations in dynamic-prompting mode')
+    cli_parser.add_argument('--gate', action='store_true',
+                           help='Skip inference when the media has not changed since the last processed sample')
+    cli_parser.add_argument('--image-change-threshold', type=float,
+                           help='Image change score (0-1) needed to run inference when --gate is set')
+    cli_parser.add_argument('--audio-change-threshold', type=float,
+                           help='Audio change score (0-1) needed to run inference when --gate is set')
+    cli_parser.add_argument('--on-unchanged', choices=['republish', 'suppress'], default='republish',
+                           help='Print the previous result or nothing when the media is unchanged')
+    cli_parser.add_argument('--input', type=str,
+                           help='Directory or manifest to process (batch)')
+    cli_parser.add_argument('--output', type=str,
+                           help='Results .jsonl file or .parquet directory (batch); reruns resume from it')
+    cli_parser.add_argument('--batch-size', type=int,
+                           help='Files of the same kind per generate call (batch)')
+    cli_parser.add_argument('--workers', type=int,
+                           help='Decode threads (batch)')
+    cli_parser.add_argument('--socket', type=str, default=SOCKET_PATH,
+                           help='Daemon socket to submit one-shot jobs to')
     cli_parser.set_defaults(func=cli_command)
     
     # waggle command
@@ -156,6 +279,24 @@ def main():
                               help='Camera device ID or URL for live capture')
     waggle_parser.add_argument('--log-dir', type=str,
                               help='Directory for pywaggle run logs')
+    waggle_parser.add_argument('--no-pipeline', action='store_true',
+                              help='Run periodic live capture sequentially instead of pipelined')
+    waggle_parser.add_argument('--queue-size', type=int, default=2,
+                              help='Bounded queue size between pipeline stages')
+    waggle_parser.add_argument('--gate', action='store_true',
+                              help='Skip inference when the media has not changed since the last processed sample')
+    waggle_parser.add_argument('--image-change-threshold', type=float,
+                              help='Image change score (0-1) needed to run inference when --gate is set')
+    waggle_parser.add_argument('--audio-change-threshold', type=float,
+                              help='Audio change score (0-1) needed to run inference when --gate is set')
+    waggle_parser.add_argument('--on-unchanged', choices=['republish', 'suppress'], default='republish',
+                              help='Republish the previous result or nothing when the media is unchanged')
+    waggle_parser.add_argument('--spool-dir', type=str,
+                              help='Directory of the on-disk spool that buffers results until the broker accepts them')
+    waggle_parser.add_argument('--no-spool', action='store_true',
+                              help='Publish and upload inline instead of through the spool')
+    waggle_parser.add_argument('--socket', type=str, default=SOCKET_PATH,
+                              help='Daemon socket to submit one-shot jobs to')
     waggle_parser.set_defaults(func=waggle_command)
     
     args = parser.parse_args()
@@ -0,0 +1,4 @@
+# gemma3n_client/__init__.py
+from gemma3n_client.client import AsyncClient, Client, Gemma3nError
+
+__all__ = ["AsyncClient", "Client", "Gemma3nError"]
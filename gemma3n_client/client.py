@@ -0,0 +1,419 @@
+# gemma3n_client/client.py
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import httpx
+
+DEFAULT_BASE_URL = os.getenv("GEMMA3N_URL", "http://localhost:8080")
+# generation can wait behind other requests in the server's scheduler
+DEFAULT_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+# 429: the priority class is at its limit; 503: the deadline cannot be met
+# or no replica is ready. Both are returned before any work is done, so any
+# request is worth another try after a pause
+RETRY_STATUSES = (429, 503)
+# a 502 or a dropped connection may come after the server accepted the
+# request; only idempotent methods are retried on them unless retry_unsafe,
+# so a retry cannot submit a job or append session media twice
+IDEMPOTENT_METHODS = ("GET", "DELETE")
+UNSAFE_RETRY_STATUSES = (502,)
+
+Media = Union[str, os.PathLike, bytes]
+
+
+class Gemma3nError(Exception):
+    # a non-2xx response that was not (or no longer) retried
+
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class _Routes:
+    # one method per server route; each returns whatever _request returns,
+    # the decoded JSON body for Client and an awaitable of it for AsyncClient
+
+    def audio_captioning(self, file: Media, user_text: str = "", max_new_tokens: int = 100, decoding: str = ""):
+        return self._request("POST", "/audio/captioning", {"file": file},
+                             {"user_text": user_text, "max_new_tokens": max_new_tokens, "decoding": decoding})
+
+    def audio_event_detection(self, file: Media, event_description: str, max_new_tokens: int = 50):
+        return self._request("POST", "/audio/event_detection", {"file": file},
+                             {"event_description": event_description, "max_new_tokens": max_new_tokens})
+
+    def image_classification(self, file: Media, categories: str = "", max_new_tokens: int = 50):
+        return self._request("POST", "/vision/image_classification", {"file": file},
+                             {"categories": categories, "max_new_tokens": max_new_tokens})
+
+    def image_event_detection(self, file: Media, event_description: str, max_new_tokens: int = 50):
+        return self._request("POST", "/vision/image_event_detection", {"file": file},
+                             {"event_description": event_description, "max_new_tokens": max_new_tokens})
+
+    def image_change_detection(self, file2: Media, file1: Optional[Media] = None, reference_id: str = "",
+                               change_threshold: Optional[float] = None, max_new_tokens: int = 100):
+        data = {"reference_id": reference_id, "max_new_tokens": max_new_tokens}
+        if change_threshold is not None:
+            data["change_threshold"] = change_threshold
+        files = {"file2": file2}
+        if file1 is not None:
+            files["file1"] = file1
+        return self._request("POST", "/vision/image_change_detection", files, data)
+
+    def add_reference(self, file: Media, name: str = ""):
+        return self._request("POST", "/vision/references", {"file": file}, {"name": name})
+
+    def list_references(self):
+        return self._request("GET", "/vision/references")
+
+    def delete_reference(self, reference_id: str):
+        return self._request("DELETE", f"/vision/references/{reference_id}")
+
+    def bounding_box_detection(self, file: Media, object_name: str, max_new_tokens: int = 150,
+                               draw_boxes: bool = False):
+        return self._request("POST", "/vision/bounding_box_detection", {"file": file},
+                             {"object_name": object_name, "max_new_tokens": max_new_tokens,
+                              "draw_boxes": str(draw_boxes).lower()})
+
+    def video_captioning(self, file: Media, user_text: str = "", max_new_tokens: int = 150, decoding: str = ""):
+        return self._request("POST", "/video/captioning", {"file": file},
+                             {"user_text": user_text, "max_new_tokens": max_new_tokens, "decoding": decoding})
+
+    def video_event_detection(self, file: Media, event_description: str, max_new_tokens: int = 100):
+        return self._request("POST", "/video/event_detection", {"file": file},
+                             {"event_description": event_description, "max_new_tokens": max_new_tokens})
+
+    def video_long_analysis(self, file: Media, user_text: str = "", max_new_tokens: int = 150):
+        return self._request("POST", "/video/long_analysis", {"file": file},
+                             {"user_text": user_text, "max_new_tokens": max_new_tokens})
+
+    def video_event_localization(self, file: Media, event_description: str, fps: Optional[float] = None,
+                                 window_frames: int = 1, threshold: float = 0.5, max_gap: float = 1.0,
+                                 min_duration: float = 0.0):
+        data = {"event_description": event_description, "window_frames": window_frames, "threshold": threshold,
+                "max_gap": max_gap, "min_duration": min_duration}
+        if fps is not None:
+            data["fps"] = fps
+        return self._request("POST", "/video/event_localization", {"file": file}, data)
+
+    def multimodal(self, system_prompt: str, files: Iterable[Media] = (), user_text: str = "",
+                   max_new_tokens: int = 50, decoding: str = ""):
+        return self._request("POST", "/multimodal/", {"files": list(files)},
+                             {"system_prompt": system_prompt, "user_text": user_text,
+                              "max_new_tokens": max_new_tokens, "decoding": decoding})
+
+    def audio_vision(self, audio_file: Media, image_file: Media, user_text: str = "", max_new_tokens: int = 150,
+                     decoding: str = ""):
+        return self._request("POST", "/multimodal/audio_vision", {"audio_file": audio_file, "image_file": image_file},
+                             {"user_text": user_text, "max_new_tokens": max_new_tokens, "decoding": decoding})
+
+    def audio_video(self, audio_file: Media, video_file: Media, user_text: str = "", max_new_tokens: int = 200,
+                    decoding: str = ""):
+        return self._request("POST", "/multimodal/audio_video", {"audio_file": audio_file, "video_file": video_file},
+                             {"user_text": user_text, "max_new_tokens": max_new_tokens, "decoding": decoding})
+
+    def create_session(self, system_prompt: str = ""):
+        return self._request("POST", "/video/sessions", data={"system_prompt": system_prompt})
+
+    def push_media(self, session_id: str, files: Iterable[Media], timestamp: float = -1.0):
+        return self._request("POST", f"/video/sessions/{session_id}/media", {"files": list(files)},
+                             {"timestamp": timestamp})
+
+    def query_session(self, session_id: str, question: str, max_new_tokens: int = 100):
+        return self._request("POST", f"/video/sessions/{session_id}/query",
+                             data={"question": question, "max_new_tokens": max_new_tokens})
+
+    def close_session(self, session_id: str):
+        return self._request("DELETE", f"/video/sessions/{session_id}")
+
+    def submit_job(self, kind: str, file: Media, user_text: str = "", max_new_tokens: int = 150,
+                   callback_url: str = "", max_attempts: int = 3):
+        # kind is "video/long_analysis", "video/captioning" or "audio/captioning"
+        return self._request("POST", f"/jobs/{kind}", {"file": file},
+                             {"user_text": user_text, "max_new_tokens": max_new_tokens,
+                              "callback_url": callback_url, "max_attempts": max_attempts})
+
+    def job(self, job_id: str):
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def delete_job(self, job_id: str):
+        return self._request("DELETE", f"/jobs/{job_id}")
+
+    def embeddings(self, file: Media, index: str = "", label: str = "", return_vectors: bool = True):
+        return self._request("POST", "/embeddings", {"file": file},
+                             {"index": index, "label": label, "return_vectors": str(return_vectors).lower()})
+
+    def search_embeddings(self, file: Media, index: str, k: int = 10, min_score: float = 0.0):
+        return self._request("POST", "/embeddings/search", {"file": file},
+                             {"index": index, "k": k, "min_score": min_score})
+
+    def list_indexes(self):
+        return self._request("GET", "/embeddings/indexes")
+
+    def delete_index(self, name: str):
+        return self._request("DELETE", f"/embeddings/indexes/{name}")
+
+    def endpoints(self):
+        return self._request("GET", "/endpoints")
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    def metrics(self):
+        return self._request("GET", "/metrics")
+
+
+class _Base(_Routes):
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, max_concurrency: int = 8, max_retries: int = 5,
+                 backoff: float = 0.5, max_backoff: float = 30.0, priority: str = "",
+                 deadline_ms: Optional[int] = None, timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+                 retry_unsafe: bool = False):
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_unsafe = retry_unsafe
+        self.max_backoff = max_backoff
+        self.headers = {}
+        if priority:
+            self.headers["X-Priority"] = priority
+        if deadline_ms is not None:
+            self.headers["X-Deadline-Ms"] = str(deadline_ms)
+        self.timeout = timeout
+        # keep-alive connections for every request that may be in flight
+        self.limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+
+    def _delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        # Retry-After when the server sends one, otherwise exponential
+        # backoff with full jitter
+        if response is not None and response.headers.get("retry-after", "").isdigit():
+            return float(response.headers["retry-after"])
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _retry(self, attempt: int, method: str, response: Optional[httpx.Response],
+               error: Optional[httpx.TransportError] = None) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if response is not None and response.status_code in RETRY_STATUSES:
+            return True
+        # a failed connect never reached the server
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+            return True
+        if not (self.retry_unsafe or method.upper() in IDEMPOTENT_METHODS):
+            return False
+        return response is None or response.status_code in UNSAFE_RETRY_STATUSES
+
+
+def _open_files(stack: ExitStack, files: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    # paths are opened per attempt so a retry re-sends the whole file;
+    # httpx streams open files instead of reading them into memory
+    opened = []
+    for field, value in files.items():
+        for media in value if isinstance(value, list) else [value]:
+            if isinstance(media, bytes):
+                opened.append((field, (f"{field}.bin", media)))
+            else:
+                path = os.fspath(media)
+                opened.append((field, (os.path.basename(path), stack.enter_context(open(path, "rb")))))
+    return opened
+
+
+def _result(response: httpx.Response):
+    if response.is_success:
+        return response.json()
+    try:
+        detail = response.json().get("detail", response.text)
+    except ValueError:
+        detail = response.text
+    raise Gemma3nError(response.status_code, detail)
+
+
+def _kwargs(item) -> Dict[str, Any]:
+    # batch items are a media path/bytes for the route's first argument or
+    # a dict of keyword arguments
+    return item if isinstance(item, dict) else {"file": item}
+
+
+class AsyncClient(_Base):
+    # async with AsyncClient() as client:
+    #     reply = await client.image_classification("image.jpg", categories="indoor, outdoor")
+    #     async for i, result in client.map("image_classification", paths):
+    #         ...
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, max_concurrency: int = 8, **kwargs):
+        super().__init__(base_url, max_concurrency, **kwargs)
+        self.http = httpx.AsyncClient(base_url=self.base_url, headers=self.headers, timeout=self.timeout,
+                                      limits=self.limits)
+        # created lazily so the client can be built outside an event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def _request(self, method: str, path: str, files: Optional[Dict[str, Any]] = None,
+                       data: Optional[Dict[str, Any]] = None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        attempt = 0
+        while True:
+            response = None
+            async with self._semaphore:
+                try:
+                    with ExitStack() as stack:
+                        response = await self.http.request(method, path, data=data,
+                                                           files=_open_files(stack, files) if files else None)
+                except httpx.TransportError as e:
+                    if not self._retry(attempt, method, None, e):
+                        raise
+            if response is not None and not self._retry(attempt, method, response):
+                return _result(response)
+            # sleeping outside the semaphore frees the slot for others
+            await asyncio.sleep(self._delay(attempt, response))
+            attempt += 1
+
+    async def map(self, route: str, items: Iterable, **common) -> AsyncIterator[Tuple[int, Any]]:
+        # yields (index, result) as requests finish; at most max_concurrency
+        # are in flight. A failed request yields its exception as the result
+        call = getattr(self, route)
+
+        async def run(i, item):
+            try:
+                return i, await call(**{**common, **_kwargs(item)})
+            except Exception as e:
+                return i, e
+
+        tasks = [asyncio.ensure_future(run(i, item)) for i, item in enumerate(items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def gather(self, route: str, items: Iterable, **common) -> List[Any]:
+        # results (or exceptions) in input order
+        items = list(items)
+        results = [None] * len(items)
+        async for i, result in self.map(route, items, **common):
+            results[i] = result
+        return results
+
+    async def query_many(self, session_id: str, questions: Iterable[str], max_new_tokens: int = 100) -> List[Any]:
+        return await self.gather("query_session", [{"question": q} for q in questions],
+                                 session_id=session_id, max_new_tokens=max_new_tokens)
+
+    async def wait_for_job(self, job_id: str, poll_interval: float = 2.0) -> dict:
+        while True:
+            job = await self.job(job_id)
+            if job["status"] in ("done", "failed"):
+                return job
+            await asyncio.sleep(poll_interval)
+
+    async def download(self, path: str, destination: Union[str, os.PathLike]) -> str:
+        # streams a server file (overlay image, trace) to disk
+        async with self.http.stream("GET", path) as response:
+            if not response.is_success:
+                await response.aread()
+                _result(response)
+            with open(destination, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    f.write(chunk)
+        return os.fspath(destination)
+
+
+class Client(_Base):
+    # with Client() as client:
+    #     reply = client.image_classification("image.jpg", categories="indoor, outdoor")
+    #     for i, result in client.map("image_classification", paths):
+    #         ...
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, max_concurrency: int = 8, **kwargs):
+        super().__init__(base_url, max_concurrency, **kwargs)
+        # httpx.Client is thread-safe; the batch helpers share it across
+        # max_concurrency threads
+        self.http = httpx.Client(base_url=self.base_url, headers=self.headers, timeout=self.timeout,
+                                 limits=self.limits)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.http.close()
+
+    def _request(self, method: str, path: str, files: Optional[Dict[str, Any]] = None,
+                 data: Optional[Dict[str, Any]] = None):
+        attempt = 0
+        while True:
+            response = None
+            with self._slots:
+                try:
+                    with ExitStack() as stack:
+                        response = self.http.request(method, path, data=data,
+                                                     files=_open_files(stack, files) if files else None)
+                except httpx.TransportError as e:
+                    if not self._retry(attempt, method, None, e):
+                        raise
+            if response is not None and not self._retry(attempt, method, response):
+                return _result(response)
+            time.sleep(self._delay(attempt, response))
+            attempt += 1
+
+    def map(self, route: str, items: Iterable, **common) -> Iterator[Tuple[int, Any]]:
+        # yields (index, result) as requests finish, from max_concurrency
+        # threads; a failed request yields its exception as the result
+        call = getattr(self, route)
+
+        def run(item):
+            try:
+                return call(**{**common, **_kwargs(item)})
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="gemma3n") as pool:
+            futures = {pool.submit(run, item): i for i, item in enumerate(items)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def gather(self, route: str, items: Iterable, **common) -> List[Any]:
+        items = list(items)
+        results = [None] * len(items)
+        for i, result in self.map(route, items, **common):
+            results[i] = result
+        return results
+
+    def query_many(self, session_id: str, questions: Iterable[str], max_new_tokens: int = 100) -> List[Any]:
+        return self.gather("query_session", [{"question": q} for q in questions],
+                           session_id=session_id, max_new_tokens=max_new_tokens)
+
+    def wait_for_job(self, job_id: str, poll_interval: float = 2.0) -> dict:
+        while True:
+            job = self.job(job_id)
+            if job["status"] in ("done", "failed"):
+                return job
+            time.sleep(poll_interval)
+
+    def download(self, path: str, destination: Union[str, os.PathLike]) -> str:
+        with self.http.stream("GET", path) as response:
+            if not response.is_success:
+                response.read()
+                _result(response)
+            with open(destination, "wb") as f:
+                for chunk in response.iter_bytes():
+                    f.write(chunk)
+        return os.fspath(destination)
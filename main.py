@@ -6,11 +6,12 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Gemma-3n")
     parser.add_argument("--host", type=str, default="0.0.0.0")
     parser.add_argument("--port", type=int, default=8080)
-    parser.add_argument("--mode", type=str, default="image", choices=["audio", "video", "image", "multimodal"])
+    parser.add_argument("--mode", type=str, default="multimodal", choices=["audio", "video", "image", "multimodal"])
     return parser.parse_args()
     
 if __name__ == "__main__":
     args = parse_args()
+    os.environ["GEMMA3N_MODE"] = args.mode
     import uvicorn
     uvicorn.run(
         "app:app",           
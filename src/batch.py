@@ -0,0 +1,296 @@
+# src/batch.py
+import json
+import logging
+import os
+import pathlib
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set
+
+from src.core import generate_batch
+from src.prompts import render
+from src.utils import decode_frames, TARGET_FPS, MAX_FRAMES, AUDIO_SAMPLE_RATE
+from src.utils import IMAGE_FILE_TYPES, AUDIO_FILE_TYPES, VIDEO_FILE_TYPES
+
+logger = logging.getLogger(__name__)
+
+PARQUET_ROWS_PER_PART = int(os.getenv("PARQUET_ROWS_PER_PART", "256"))
+PROGRESS_INTERVAL = 10.0
+
+
+def media_kind(path: str) -> Optional[str]:
+    ext = pathlib.Path(path).suffix.lower()
+    if ext in IMAGE_FILE_TYPES:
+        return "image"
+    if ext in AUDIO_FILE_TYPES:
+        return "audio"
+    if ext in VIDEO_FILE_TYPES:
+        return "video"
+    return None
+
+
+def collect_inputs(source: str) -> List[dict]:
+    # a directory (walked recursively), a .jsonl manifest of {"path": ...,
+    # "user_text": ...} lines or a text manifest with one path per line;
+    # manifest paths are relative to the manifest's directory
+    items = []
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                items.append({"path": os.path.join(root, name)})
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                entry = json.loads(line) if source.endswith(".jsonl") else {"path": line}
+                entry["path"] = os.path.join(base, entry["path"])
+                items.append(entry)
+
+    inputs = []
+    for entry in items:
+        kind = media_kind(entry["path"])
+        if kind is None:
+            continue
+        inputs.append({**entry, "path": os.path.abspath(entry["path"]), "kind": kind})
+    return inputs
+
+
+class JsonlSink:
+    # one result per line, flushed and fsynced per batch; the file itself is
+    # the checkpoint. completed() is the files whose last row has no error,
+    # so failed files are tried again on resume and their new row appended
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def completed(self) -> Set[str]:
+        if not os.path.exists(self.path):
+            return set()
+        ok, good = {}, 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    ok[row["path"]] = not row.get("error")
+                except (ValueError, KeyError):
+                    break
+                good += len(line)
+        # a run killed mid-write leaves a partial last line behind
+        with open(self.path, "r+b") as f:
+            f.truncate(good)
+        return {path for path, success in ok.items() if success}
+
+    def write(self, rows: List[dict]):
+        with open(self.path, "a") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        pass
+
+
+class ParquetSink:
+    # a directory of part files, each written atomically once
+    # PARQUET_ROWS_PER_PART rows are buffered; rows still buffered when a
+    # run is killed are processed again on resume
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)")
+        self.path = path
+        self.buffer: List[dict] = []
+        os.makedirs(path, exist_ok=True)
+        self.parts = len([f for f in os.listdir(path) if f.endswith(".parquet")])
+
+    def completed(self) -> Set[str]:
+        # as for JsonlSink, the last row of a file decides; part files are
+        # numbered in write order
+        import pyarrow.parquet as pq
+        ok = {}
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(".parquet"):
+                table = pq.read_table(os.path.join(self.path, name), columns=["path", "error"])
+                for path, error in zip(table.column("path").to_pylist(), table.column("error").to_pylist()):
+                    ok[path] = not error
+        return {path for path, success in ok.items() if success}
+
+    def write(self, rows: List[dict]):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= PARQUET_ROWS_PER_PART:
+            self._flush()
+
+    def close(self):
+        if self.buffer:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        part = os.path.join(self.path, f"part-{self.parts:05d}.parquet")
+        pq.write_table(pa.Table.from_pylist(self.buffer), part + ".tmp")
+        os.replace(part + ".tmp", part)
+        self.parts += 1
+        self.buffer = []
+
+
+def open_sink(path: str):
+    return ParquetSink(path) if path.endswith(".parquet") else JsonlSink(path)
+
+
+def decode(item: dict) -> dict:
+    # runs in the decode pool; media is loaded into memory so the model
+    # thread only tokenizes and generates
+    try:
+        if item["kind"] == "image":
+            from PIL import Image
+            with Image.open(item["path"]) as image:
+                media = [{"type": "image", "image": image.convert("RGB")}]
+        elif item["kind"] == "audio":
+            import librosa
+            audio, _ = librosa.load(item["path"], sr=AUDIO_SAMPLE_RATE, mono=True)
+            media = [{"type": "audio", "audio": audio}]
+        else:
+            media = [{"type": "image", "image": frame}
+                     for frame in decode_frames(item["path"], TARGET_FPS, MAX_FRAMES)]
+            if not media:
+                raise ValueError("no frames decoded")
+        return {**item, "media": media}
+    except Exception as e:
+        return {**item, "error": f"decode failed: {e}"}
+
+
+def build_messages(item: dict, event_description: str = "", user_text: str = "") -> List[dict]:
+    if event_description:
+        system_prompt = render(f"{item['kind']}_event", event_description=event_description)
+    else:
+        system_prompt = render(f"{item['kind']}_caption")
+    content = []
+    text = item.get("user_text", user_text)
+    if text:
+        content.append({"type": "text", "text": text})
+    content.extend(item["media"])
+    return [
+        {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
+        {"role": "user", "content": content},
+    ]
+
+
+def _result(item: dict, reply: Optional[str] = None, error: Optional[str] = None) -> dict:
+    return {"path": item["path"], "kind": item["kind"], "reply": reply, "error": error,
+            "finished": time.time()}
+
+
+def run_batch_generation(items: List[dict], max_new_tokens: int, event_description: str = "",
+                         user_text: str = "") -> List[dict]:
+    # one batched generate call; when it fails, the items run one by one so
+    # a single bad file does not fail its neighbours. Single items also go
+    # through generate_batch so every row holds only the reply
+    conversations = [build_messages(item, event_description, user_text) for item in items]
+    try:
+        replies = generate_batch(conversations, max_new_tokens)
+        return [_result(item, reply.strip()) for item, reply in zip(items, replies)]
+    except Exception as e:
+        if len(items) == 1:
+            return [_result(items[0], error=str(e))]
+        logger.warning(f"Batch of {len(items)} failed ({e}), retrying items one by one")
+        return [row for item in items for row in run_batch_generation([item], max_new_tokens, event_description, user_text)]
+
+
+def _decoded(pending: List[dict], workers: int, prefetch: int) -> Iterator[dict]:
+    # decodes ahead of the model in a thread pool (PIL, PyAV and librosa
+    # release the GIL while decoding), keeping at most `prefetch` items
+    # decoded or in flight
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as pool:
+        queue = deque()
+        remaining = iter(pending)
+        for item in remaining:
+            queue.append(pool.submit(decode, item))
+            if len(queue) >= prefetch:
+                break
+        while queue:
+            yield queue.popleft().result()
+            item = next(remaining, None)
+            if item is not None:
+                queue.append(pool.submit(decode, item))
+
+
+class Progress:
+
+    def __init__(self, total: int, skipped: int):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self.last = 0.0
+
+    def update(self, rows: List[dict], force: bool = False):
+        self.done += len(rows)
+        self.failed += sum(1 for row in rows if row["error"])
+        now = time.monotonic()
+        if not force and now - self.last < PROGRESS_INTERVAL:
+            return
+        self.last = now
+        elapsed = max(now - self.start, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate else float("inf")
+        logger.info(
+            f"{self.skipped + self.done}/{self.skipped + self.total} files "
+            f"({self.failed} failed) | {rate:.2f} files/s | ETA {_format_eta(eta)}"
+        )
+
+
+def _format_eta(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "--"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def run_batch(source: str, output: str, max_new_tokens: int = 100, batch_size: int = 8, workers: int = 4,
+              event_description: str = "", user_text: str = "") -> Dict[str, int]:
+    # files already in the output without an error are skipped, so rerunning
+    # the same command after an interruption resumes the run and retries the
+    # files that failed
+    inputs = collect_inputs(source)
+    sink = open_sink(output)
+    done = sink.completed()
+    pending = [item for item in inputs if item["path"] not in done]
+    logger.info(f"{len(inputs)} media files, {len(inputs) - len(pending)} already done in {output}, "
+                f"{len(pending)} to process")
+
+    progress = Progress(len(pending), len(inputs) - len(pending))
+    # one buffer per kind so a batch only pads against similar inputs
+    buffers: Dict[str, List[dict]] = {}
+    try:
+        for item in _decoded(pending, workers, prefetch=max(2 * batch_size, workers)):
+            if "error" in item:
+                rows = [_result(item, error=item["error"])]
+            else:
+                buffer = buffers.setdefault(item["kind"], [])
+                buffer.append(item)
+                if len(buffer) < batch_size:
+                    continue
+                rows = run_batch_generation(buffer, max_new_tokens, event_description, user_text)
+                buffers[item["kind"]] = []
+            sink.write(rows)
+            progress.update(rows)
+        for buffer in buffers.values():
+            if buffer:
+                rows = run_batch_generation(buffer, max_new_tokens, event_description, user_text)
+                sink.write(rows)
+                progress.update(rows)
+    finally:
+        sink.close()
+    progress.update([], force=True)
+    return {"total": len(inputs), "processed": progress.done, "failed": progress.failed,
+            "skipped": progress.skipped}
@@ -0,0 +1,171 @@
+# src/change_detection.py
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+REFERENCE_DIR = os.getenv("REFERENCE_DIR", "references")
+CHANGE_THRESHOLD = float(os.getenv("CHANGE_THRESHOLD", "0.01"))
+PIXEL_DIFF_THRESHOLD = float(os.getenv("PIXEL_DIFF_THRESHOLD", "0.5"))
+ALIGN_MAX_SHIFT = int(os.getenv("ALIGN_MAX_SHIFT", "4"))
+ANALYSIS_WIDTH = 256
+BLOCK = 8
+BLOCK_FRACTION = 0.3
+MAX_REGIONS = 3
+
+
+def image_features(image: Image.Image, size: Optional[tuple] = None) -> np.ndarray:
+    # grayscale at analysis resolution, box-blurred against sensor noise and
+    # normalized to zero mean / unit variance against exposure changes
+    gray = image.convert("L")
+    if size is None:
+        w, h = gray.size
+        size = (ANALYSIS_WIDTH, max(BLOCK, round(ANALYSIS_WIDTH * h / w)))
+    arr = np.asarray(gray.resize(size, Image.BILINEAR), dtype=np.float32)
+    padded = np.pad(arr, 1, mode="edge")
+    h, w = arr.shape
+    arr = sum(padded[dy:dy + h, dx:dx + w] for dy in range(3) for dx in range(3)) / 9.0
+    return (arr - arr.mean()) / (arr.std() + 1e-6)
+
+
+def diff_features(ref: np.ndarray, cur: np.ndarray, max_shift: int = ALIGN_MAX_SHIFT) -> dict:
+    # searches small translations for the best alignment (camera jitter),
+    # then scores the share of BLOCKxBLOCK cells that changed; regions are
+    # (x0, y0, x1, y1) boxes in 0-1 coordinates of the reference image
+    h, w = ref.shape
+    best = None
+    for dy in range(-max_shift, max_shift + 1):
+        for dx in range(-max_shift, max_shift + 1):
+            r = ref[max(0, dy):h + min(0, dy), max(0, dx):w + min(0, dx)]
+            c = cur[max(0, -dy):h + min(0, -dy), max(0, -dx):w + min(0, -dx)]
+            err = float(np.abs(r - c).mean())
+            if best is None or err < best[0]:
+                best = (err, dy, dx, r, c)
+    _, dy, dx, r, c = best
+
+    changed = np.abs(r - c) > PIXEL_DIFF_THRESHOLD
+    bh, bw = changed.shape[0] // BLOCK, changed.shape[1] // BLOCK
+    blocks = changed[:bh * BLOCK, :bw * BLOCK].reshape(bh, BLOCK, bw, BLOCK).mean(axis=(1, 3)) > BLOCK_FRACTION
+
+    oy, ox = max(0, dy), max(0, dx)
+    regions = []
+    for y0, x0, y1, x1 in _block_regions(blocks)[:MAX_REGIONS]:
+        regions.append((
+            round((x0 * BLOCK + ox) / w, 4), round((y0 * BLOCK + oy) / h, 4),
+            round(min(w, x1 * BLOCK + ox) / w, 4), round(min(h, y1 * BLOCK + oy) / h, 4),
+        ))
+    return {
+        "score": round(float(blocks.mean()) if blocks.size else 0.0, 4),
+        "shift": (dx, dy),
+        "regions": regions,
+    }
+
+
+def _block_regions(blocks: np.ndarray) -> List[tuple]:
+    # 8-connected components of changed cells, largest first, as
+    # (y0, x0, y1, x1) in cell units with exclusive upper bounds
+    seen = np.zeros_like(blocks, dtype=bool)
+    regions = []
+    for y, x in zip(*np.nonzero(blocks)):
+        if seen[y, x]:
+            continue
+        stack = [(y, x)]
+        seen[y, x] = True
+        cells = []
+        while stack:
+            cy, cx = stack.pop()
+            cells.append((cy, cx))
+            for ny in range(max(0, cy - 1), min(blocks.shape[0], cy + 2)):
+                for nx in range(max(0, cx - 1), min(blocks.shape[1], cx + 2)):
+                    if blocks[ny, nx] and not seen[ny, nx]:
+                        seen[ny, nx] = True
+                        stack.append((ny, nx))
+        ys, xs = zip(*cells)
+        regions.append((len(cells), (min(ys), min(xs), max(ys) + 1, max(xs) + 1)))
+    regions.sort(key=lambda r: r[0], reverse=True)
+    return [box for _, box in regions]
+
+
+def crop_region(image: Image.Image, region: tuple, margin: float = 0.1) -> Image.Image:
+    x0, y0, x1, y1 = region
+    mx, my = (x1 - x0) * margin, (y1 - y0) * margin
+    w, h = image.size
+    return image.crop((
+        int(max(0.0, x0 - mx) * w), int(max(0.0, y0 - my) * h),
+        int(min(1.0, x1 + mx) * w), int(min(1.0, y1 + my) * h),
+    ))
+
+
+class ReferenceRegistry:
+    # baseline images stored once under REFERENCE_DIR with their pixel-diff
+    # features, kept in memory after first use. Only the diff is spared:
+    # comparisons that reach the model encode the reference image again
+
+    def __init__(self, directory: str = REFERENCE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.entries: Dict[str, dict] = {}
+
+    def _paths(self, ref_id: str) -> dict:
+        base = os.path.join(self.directory, ref_id)
+        return {"meta": base + ".json", "features": base + ".npy"}
+
+    def add(self, image_path: str, name: str = "") -> dict:
+        with open(image_path, "rb") as f:
+            ref_id = hashlib.sha256(f.read()).hexdigest()[:16]
+        os.makedirs(self.directory, exist_ok=True)
+        paths = self._paths(ref_id)
+        stored = os.path.join(self.directory, ref_id + os.path.splitext(image_path)[1].lower())
+        shutil.copyfile(image_path, stored)
+
+        image = Image.open(stored).convert("RGB")
+        features = image_features(image)
+        np.save(paths["features"], features)
+        meta = {"reference_id": ref_id, "name": name, "image": stored,
+                "size": list(image.size), "created": time.time()}
+        with open(paths["meta"], "w") as f:
+            json.dump(meta, f)
+        with self.lock:
+            self.entries[ref_id] = {**meta, "features": features}
+        return meta
+
+    def get(self, ref_id: str) -> dict:
+        with self.lock:
+            if ref_id in self.entries:
+                return self.entries[ref_id]
+        paths = self._paths(os.path.basename(ref_id))
+        if not os.path.exists(paths["meta"]):
+            raise KeyError(ref_id)
+        with open(paths["meta"]) as f:
+            meta = json.load(f)
+        entry = {**meta, "features": np.load(paths["features"])}
+        with self.lock:
+            self.entries[ref_id] = entry
+        return entry
+
+    def list(self) -> List[dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        refs = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name)) as f:
+                    refs.append(json.load(f))
+        return refs
+
+    def delete(self, ref_id: str):
+        entry = self.get(ref_id)
+        with self.lock:
+            self.entries.pop(ref_id, None)
+        for path in [entry["image"], *self._paths(ref_id).values()]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+registry = ReferenceRegistry()
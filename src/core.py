@@ -1,20 +1,108 @@
 # src/core.py
-from typing import List
+from __future__ import annotations
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from typing import TYPE_CHECKING, Dict, List, Optional
+import asyncio
+import copy
+import hashlib
+import json
 import os
-import torch
-from transformers import AutoProcessor, Gemma3nForConditionalGeneration
+import threading
+import time
+
+from src import metrics, profiling, prompts
+from src.scheduler import scheduler, estimate_cost
+
+# torch and transformers take seconds to import; they are only pulled in
+# once a model is actually needed so CLI startup and --help stay fast
+if TYPE_CHECKING:
+    import torch
+    from transformers import AutoProcessor, Gemma3nForConditionalGeneration
 
 model: Gemma3nForConditionalGeneration = None
 processor: AutoProcessor = None
 DEVICE: str = None
 
+MIN_PREFIX_TOKENS = int(os.getenv("MIN_PREFIX_TOKENS", "16"))
+# stands in for the first user turn's content when the prefix is rendered
+_PREFIX_END = "<<prefix-end>>"
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "16"))
+_answer_ids = None
+
+# serving mode; towers for modalities a mode does not need are dropped
+# after loading. Set by `gemma3n.py serve --mode` / `main.py --mode`
+SERVE_MODE = os.getenv("GEMMA3N_MODE", "multimodal")
+MODE_MODALITIES = {
+    "audio": ("audio",),
+    "image": ("image",),
+    "video": ("image",),
+    "multimodal": ("audio", "image"),
+}
+# encoder per modality. Only the tower is dropped: the small embed_audio /
+# embed_vision projections stay because the forward pass reads their
+# vocab_offset on every call with input_ids
+TOWER_MODULES = {
+    "audio": "audio_tower",
+    "image": "vision_tower",
+}
+
+# assisted generation: "draft" verifies tokens proposed by DRAFT_MODEL,
+# "prompt_lookup" proposes n-grams copied from the prompt, "auto" uses the
+# draft model when one is configured and prompt lookup otherwise
+DECODING_MODES = ("off", "auto", "draft", "prompt_lookup")
+ASSISTED_DECODING = os.getenv("ASSISTED_DECODING", "off")
+DRAFT_MODEL = os.getenv("DRAFT_MODEL", "")
+PROMPT_LOOKUP_TOKENS = int(os.getenv("PROMPT_LOOKUP_TOKENS", "10"))
+ASSISTANT_TOKENS = int(os.getenv("ASSISTANT_TOKENS", "5"))
+draft_model = None
+
+# preallocated static KV caches, one per (batch size, length bucket), reset
+# and reused across requests; prompts longer than the largest bucket fall
+# back to a per-request static cache. At most STATIC_CACHE_POOL caches are
+# kept, least recently used first out, so batched routes with varying batch
+# sizes do not each pin a full cache. TORCH_COMPILE=1 compiles the decode
+# step (on CPU and CUDA), which the fixed cache shapes keep to one graph per
+# cache
+STATIC_CACHE_BUCKETS = sorted(int(b) for b in os.getenv("STATIC_CACHE_BUCKETS", "1024,2048,4096").split(","))
+STATIC_CACHE_POOL = int(os.getenv("STATIC_CACHE_POOL", str(len(STATIC_CACHE_BUCKETS))))
+TORCH_COMPILE = os.getenv("TORCH_COMPILE", "0") == "1"
+STATIC_CACHE_WARMUP = os.getenv("STATIC_CACHE_WARMUP", "1" if TORCH_COMPILE else "0") == "1"
+_cache_pool: "OrderedDict[tuple, object]" = OrderedDict()
+
+# the model is not safe to drive from several threads at once; every entry
+# point that runs it holds this lock (re-entrant for nested helpers)
+model_lock = threading.RLock()
+# content key -> future of the generation currently computing it
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _serialized(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with profiling.span("model_lock.wait"):
+            model_lock.acquire()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            model_lock.release()
+    return wrapper
+
+
 def initialize_model():
     global model, processor, DEVICE
     
     if model is None or processor is None:
+        import torch
+        from transformers import AutoProcessor, Gemma3nForConditionalGeneration
+        
         print("Loading Gemma-3n model...")
         MODEL_ID = os.getenv("IMG_MODEL", "google/gemma-3n-e2b-it")
         DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+        if os.getenv("TORCH_NUM_THREADS"):
+            # set per replica by `serve --replicas` to match its pinned cores
+            torch.set_num_threads(int(os.getenv("TORCH_NUM_THREADS")))
         
         # Check if we have a local cache directory
         local_model_path = f"/hf_cache/google/gemma-3n-e2b-it"
@@ -41,10 +129,164 @@ def initialize_model():
             local_files_only=local_files_only
         )
         print(f"Model loaded on {DEVICE}")
+        _prune_towers(SERVE_MODE)
+        from src.ple import PLE_OFFLOAD, offload_per_layer_embeddings
+        if PLE_OFFLOAD:
+            offload_per_layer_embeddings(model, model_path)
+        metrics.set_gauge("model.loaded_rss_mb", round(metrics.rss_mb(), 1))
+        prompts.preload(processor)
+        if TORCH_COMPILE:
+            _enable_compile()
     
     return model, processor
 
 
+def _prune_towers(mode: str):
+    import gc
+    import torch
+    
+    if mode not in MODE_MODALITIES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {list(MODE_MODALITIES)}")
+    # newer transformers nest the towers under model.model
+    owner = model.model if hasattr(model.model, "audio_tower") else model
+    for modality, name in TOWER_MODULES.items():
+        if modality in MODE_MODALITIES[mode]:
+            continue
+        module = getattr(owner, name, None)
+        if module is None:
+            continue
+        freed = sum(p.numel() * p.element_size() for p in module.parameters())
+        setattr(owner, name, None)
+        del module
+        print(f"Mode {mode}: dropped the {modality} tower ({freed / 2**20:.0f} MB)")
+        metrics.set_gauge(f"model.pruned_{modality}_mb", round(freed / 2**20, 1))
+    gc.collect()
+    if DEVICE == "cuda":
+        torch.cuda.empty_cache()
+
+
+def _check_modalities(raw_messages_list: List[List[dict]]):
+    available = MODE_MODALITIES.get(SERVE_MODE, ())
+    for raw_messages in raw_messages_list:
+        for msg in raw_messages:
+            for item in msg["content"]:
+                if item["type"] in TOWER_MODULES and item["type"] not in available:
+                    raise ValueError(f"{item['type']} input is not supported in {SERVE_MODE} mode")
+
+
+def initialize_draft_model():
+    global draft_model
+    
+    if draft_model is None and DRAFT_MODEL:
+        import torch
+        from transformers import AutoModelForCausalLM
+        
+        initialize_model()
+        print(f"Loading draft model {DRAFT_MODEL}...")
+        draft_model = AutoModelForCausalLM.from_pretrained(
+            DRAFT_MODEL,
+            torch_dtype=(torch.bfloat16 if DEVICE == "cuda" else torch.float32),
+            device_map=0 if DEVICE == "cuda" else None,
+        )
+        draft_model.generation_config.num_assistant_tokens = ASSISTANT_TOKENS
+    
+    return draft_model
+
+
+def _enable_compile():
+    # generate compiles only the single-token decode step, and only when the
+    # cache is static; on CUDA that is switched on through CompileConfig.
+    # transformers offers no public switch for CPU, so there the model's
+    # forward is wrapped: decode steps against a static cache go through
+    # torch.compile (fixed shapes, one graph per batch size and bucket),
+    # everything else, prefill included, stays eager
+    import torch
+    
+    if DEVICE == "cuda":
+        try:
+            from transformers import CompileConfig
+        except ImportError:
+            print("torch.compile of the decode step needs a newer transformers; running eager")
+            return
+        model.generation_config.compile_config = CompileConfig(fullgraph=False, dynamic=False)
+        print("Decode step will be compiled with torch.compile")
+        return
+    
+    from transformers import StaticCache
+    eager = model.forward
+    compiled = torch.compile(eager, dynamic=False, fullgraph=False)
+    state = {"failed": False}
+    # one graph per pooled (batch size, bucket) cache, plus the warmup batch
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 2 * STATIC_CACHE_POOL + 1)
+    
+    @wraps(eager)
+    def forward(*args, **kwargs):
+        input_ids = kwargs.get("input_ids")
+        if (state["failed"] or input_ids is None or input_ids.shape[1] != 1
+                or not isinstance(kwargs.get("past_key_values"), StaticCache)):
+            return eager(*args, **kwargs)
+        try:
+            with profiling.span("decode_step.compiled"):
+                return compiled(*args, **kwargs)
+        except Exception as e:
+            # reported once; the rest of this and every later decode is eager
+            state["failed"] = True
+            metrics.incr("compile.failed")
+            print(f"torch.compile of the decode step failed on CPU, running eager: {e}")
+            return eager(*args, **kwargs)
+    
+    model.forward = forward
+    print("Decode step will be compiled with torch.compile (CPU, static-cache decode steps)")
+
+
+def _static_cache_kwargs(batch_size: int, total_len: int) -> dict:
+    # generate kwargs for a pooled static cache that fits total_len tokens
+    bucket = next((b for b in STATIC_CACHE_BUCKETS if b >= total_len), None)
+    if bucket is None:
+        metrics.incr("static_cache.oversize")
+        return {"cache_implementation": "static"}
+    key = (batch_size, bucket)
+    cache = _cache_pool.get(key)
+    if cache is None:
+        from transformers import StaticCache
+        config = model.config.get_text_config()
+        try:
+            # recent transformers: allocated on first use, sliding-window
+            # layers handled by the cache itself
+            cache = StaticCache(config=config, max_cache_len=bucket)
+        except TypeError:
+            try:
+                cache = StaticCache(config=config, max_batch_size=batch_size, max_cache_len=bucket,
+                                    device=model.device, dtype=model.dtype)
+            except Exception as e:
+                print(f"Static cache pool unavailable, allocating per request: {e}")
+                return {"cache_implementation": "static"}
+        _cache_pool[key] = cache
+        metrics.incr("static_cache.allocated")
+        while len(_cache_pool) > max(1, STATIC_CACHE_POOL):
+            _cache_pool.popitem(last=False)
+            metrics.incr("static_cache.evicted")
+    else:
+        _cache_pool.move_to_end(key)
+        cache.reset()
+        metrics.incr("static_cache.reused")
+    return {"past_key_values": cache}
+
+
+@_serialized
+def warmup_static_caches():
+    # one short generation per bucket so each cache is allocated, and with
+    # TORCH_COMPILE each decode graph compiled, before the first request
+    if not STATIC_CACHE_WARMUP:
+        return
+    initialize_model()
+    inputs = _to_device(processor(text=["Warm up."], return_tensors="pt"))
+    for bucket in STATIC_CACHE_BUCKETS:
+        start = time.perf_counter()
+        model.generate(**inputs, max_new_tokens=2, **_static_cache_kwargs(1, bucket))
+        print(f"Warmed up static cache bucket {bucket} in {time.perf_counter() - start:.1f}s")
+
+
 def build_raw_messages(msg_dicts: List[dict]) -> List[dict]:
     raw = []
     for m in msg_dicts:
@@ -65,24 +307,456 @@ def build_raw_messages(msg_dicts: List[dict]) -> List[dict]:
     return raw
 
 
-def generate_response(raw_messages: List[dict], max_new_tokens: int) -> str:
+@_serialized
+def generate_response(raw_messages: List[dict], max_new_tokens: int, prefix: Optional[dict] = None,
+                      decoding: Optional[str] = None) -> str:
     initialize_model()
+    _check_modalities([raw_messages])
     
-    inputs = processor.apply_chat_template(
-        raw_messages,
-        tokenize=True,
-        return_dict=True,
-        return_tensors='pt',
-        add_generation_prompt=True
-    )
-    if DEVICE == "cuda":
-        inputs = inputs.to(device="cuda", dtype=torch.bfloat16)
+    with profiling.span("preprocess"):
+        start = time.perf_counter()
+        inputs = prompts.encode_messages(processor, raw_messages)
+        if inputs is not None:
+            metrics.observe("prompt.pretokenized_seconds", time.perf_counter() - start)
+        else:
+            inputs = processor.apply_chat_template(
+                raw_messages,
+                tokenize=True,
+                return_dict=True,
+                return_tensors='pt',
+                add_generation_prompt=True
+            )
+            metrics.observe("prompt.chat_template_seconds", time.perf_counter() - start)
+        inputs = _to_device(inputs)
+    
+    gen_kwargs = {}
+    cache = _reusable_prefix_cache(prefix, inputs['input_ids']) if prefix is not None else None
+    if cache is not None:
+        gen_kwargs["past_key_values"] = cache
+    assisted, proposal_len = _assisted_kwargs(decoding)
+    gen_kwargs.update(assisted)
+    if not gen_kwargs:
+        gen_kwargs.update(_static_cache_kwargs(1, inputs['input_ids'].shape[1] + max_new_tokens))
+    
+    start = time.perf_counter()
+    with profiling.span("generate"), profiling.torch_profile(), profiling.module_spans(model), \
+            _count_forward_calls(model if assisted else None) as steps:
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            **gen_kwargs
+        )
+    new_tokens = outputs.shape[1] - inputs['input_ids'].shape[1]
+    _record_decode(new_tokens, time.perf_counter() - start, steps[0] if assisted else None, proposal_len)
+    return processor.decode(outputs[0], skip_special_tokens=True)
+
+
+class _LeaderLost(Exception):
+    # set on a coalesced generation whose leader was cancelled; its
+    # followers run the generation themselves instead
+    pass
+
+
+async def generate_response_async(raw_messages: List[dict], max_new_tokens: int,
+                                  decoding: Optional[str] = None) -> str:
+    # single-flight front for generate_response: identical requests (same
+    # media content, prompts and generation parameters) that arrive while one
+    # is generating wait for its result instead of generating again. Only a
+    # leader that has been admitted by the priority scheduler can be joined,
+    # so a follower never inherits another request's priority class,
+    # deadline or admission error; each request queues under its own until
+    # an identical one is running. The leader generates in a worker thread
+    # so the event loop keeps accepting requests
+    key = request_key(raw_messages, max_new_tokens, decoding)
+    while True:
+        pending = _inflight.get(key)
+        if pending is not None:
+            try:
+                reply = await asyncio.shield(pending)
+            except _LeaderLost:
+                metrics.incr("coalesce.promoted")
+                continue
+            metrics.incr("coalesce.joined")
+            return reply
+        async with scheduler.admit(estimate_cost(raw_messages, max_new_tokens)):
+            if key in _inflight:
+                # an identical request was admitted while this one queued;
+                # give the slot back and join it
+                continue
+            return await _lead(key, raw_messages, max_new_tokens, decoding)
+
+
+async def _lead(key: str, raw_messages: List[dict], max_new_tokens: int, decoding: Optional[str]) -> str:
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    metrics.incr("coalesce.generations")
+    try:
+        reply = await asyncio.to_thread(generate_response, raw_messages, max_new_tokens, decoding=decoding)
+    except asyncio.CancelledError:
+        future.set_exception(_LeaderLost())
+        future.exception()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # mark retrieved so a failure nobody joined is not logged twice
+        future.exception()
+        raise
     else:
-        inputs = inputs.to(device="cpu")
-    outputs = model.generate(
-        **inputs,
-        max_new_tokens=max_new_tokens,
-        cache_implementation='static'
+        future.set_result(reply)
+        return reply
+    finally:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+
+def request_key(raw_messages: List[dict], max_new_tokens: int, decoding: Optional[str] = None) -> str:
+    # uploads land in fresh temp files, so media is keyed by content rather
+    # than by path
+    h = hashlib.sha256()
+    for msg in raw_messages:
+        h.update(msg["role"].encode())
+        for item in msg["content"]:
+            h.update(item["type"].encode())
+            value = item.get(item["type"])
+            if isinstance(value, str) and item["type"] != "text" and os.path.isfile(value):
+                with open(value, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        h.update(block)
+            elif hasattr(value, "tobytes"):
+                h.update(value.tobytes())
+            else:
+                h.update(str(value).encode())
+    h.update(json.dumps([max_new_tokens, decoding or ASSISTED_DECODING]).encode())
+    return h.hexdigest()
+
+
+def _assisted_kwargs(decoding: Optional[str]):
+    # returns (generate kwargs, max tokens proposed per verification step)
+    mode = decoding or ASSISTED_DECODING
+    if mode not in DECODING_MODES:
+        raise ValueError(f"Unknown decoding mode '{mode}', expected one of {DECODING_MODES}")
+    if mode == "off":
+        return {}, 0
+    if mode in ("auto", "draft") and DRAFT_MODEL:
+        return {"assistant_model": initialize_draft_model()}, ASSISTANT_TOKENS
+    return {"prompt_lookup_num_tokens": PROMPT_LOOKUP_TOKENS}, PROMPT_LOOKUP_TOKENS
+
+
+@contextmanager
+def _count_forward_calls(module):
+    calls = [0]
+    handle = None
+    if module is not None:
+        handle = module.register_forward_hook(lambda *_: calls.__setitem__(0, calls[0] + 1))
+    try:
+        yield calls
+    finally:
+        if handle is not None:
+            handle.remove()
+
+
+def _record_decode(new_tokens: int, elapsed: float, steps: Optional[int], proposal_len: int):
+    if new_tokens <= 0 or elapsed <= 0:
+        return
+    kind = "plain" if steps is None else "assisted"
+    metrics.observe(f"decode.{kind}.tokens_per_sec", new_tokens / elapsed)
+    if steps is None:
+        return
+    
+    # every target-model forward pass yields one token of its own; anything
+    # beyond that was a draft token it accepted
+    steps = max(1, steps)
+    metrics.incr("assisted.generated_tokens", new_tokens)
+    metrics.incr("assisted.target_forward_passes", steps)
+    metrics.incr("assisted.accepted_draft_tokens", max(0, new_tokens - steps))
+    metrics.incr("assisted.max_proposed_tokens", steps * proposal_len)
+    counters = metrics.snapshot()["counters"]
+    if counters["assisted.max_proposed_tokens"]:
+        metrics.set_gauge("assisted.acceptance_rate",
+                          round(counters["assisted.accepted_draft_tokens"] / counters["assisted.max_proposed_tokens"], 4))
+    metrics.set_gauge("assisted.tokens_per_forward_pass",
+                      round(counters["assisted.generated_tokens"] / counters["assisted.target_forward_passes"], 4))
+    plain = metrics.mean("decode.plain.tokens_per_sec")
+    if plain:
+        metrics.set_gauge("assisted.speedup", round(metrics.mean("decode.assisted.tokens_per_sec") / plain, 3))
+
+
+@_serialized
+def prefill_prefix(raw_messages: List[dict]) -> dict:
+    # runs the leading part of a conversation that stays fixed across runs
+    # (template header and system prompt) through the model once;
+    # generate_response(prefix=...) reuses the resulting KV cache for the
+    # longest token prefix it shares with a request. Gemma's template folds
+    # the system prompt into the first user turn, so the prefix is cut from
+    # the template rendered for the whole conversation, right before the
+    # content of that user turn
+    initialize_model()
+    import torch
+    from transformers import DynamicCache
+    
+    first_user = next(i for i, msg in enumerate(raw_messages) if msg["role"] == "user")
+    probe = raw_messages[:first_user] + [{"role": "user", "content": [{"type": "text", "text": _PREFIX_END}]}]
+    text = processor.apply_chat_template(probe, tokenize=False, add_generation_prompt=True)
+    prefix_ids = _tokenize_rendered(text[:text.index(_PREFIX_END)])
+    # the last tokens before the cut can merge with what follows it; only
+    # the part shared with the whole rendered conversation is kept
+    full_ids = _tokenize_rendered(
+        processor.apply_chat_template(raw_messages, tokenize=False, add_generation_prompt=True)
     )
-    return processor.decode(outputs[0], skip_special_tokens=True)
+    n = _common_prefix_len(prefix_ids, full_ids)
+    input_ids = prefix_ids[:, :n].to(model.device)
+    cache = DynamicCache()
+    with torch.no_grad():
+        model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), past_key_values=cache, use_cache=True)
+    metrics.set_gauge("prefix_cache.tokens", n)
+    return {"input_ids": input_ids, "cache": cache}
+
+
+def _tokenize_rendered(text: str) -> torch.Tensor:
+    # the rendered template already contains <bos>
+    return processor.tokenizer(text, add_special_tokens=False, return_tensors='pt')['input_ids']
+
+
+def _common_prefix_len(a: torch.Tensor, b: torch.Tensor) -> int:
+    n = min(a.shape[1], b.shape[1])
+    mismatch = (a[0, :n] != b[0, :n].to(a.device)).nonzero()
+    return int(mismatch[0]) if len(mismatch) else n
+
+
+def _reusable_prefix_cache(prefix: dict, input_ids: torch.Tensor):
+    cached_ids = prefix["input_ids"]
+    if input_ids.shape[0] != 1:
+        return None
+    # the cached ids must be a true prefix of this request's ids; anything
+    # past the first mismatch is cropped from the cache
+    n = min(_common_prefix_len(cached_ids, input_ids), input_ids.shape[1] - 1)
+    if n < cached_ids.shape[1]:
+        metrics.incr("prefix_cache.partial")
+    # media placeholders must stay in the uncached part so their features
+    # are merged in during generation
+    for token_id in (getattr(model.config, "image_token_id", None), getattr(model.config, "audio_token_id", None)):
+        if token_id is not None:
+            hits = (input_ids[0, :n] == token_id).nonzero()
+            if len(hits):
+                n = min(n, int(hits[0]))
+    if n < MIN_PREFIX_TOKENS:
+        metrics.incr("prefix_cache.too_short")
+        return None
+    try:
+        cache = copy.deepcopy(prefix["cache"])
+        cache.crop(n)
+        metrics.incr("prefix_cache.reused")
+        return cache
+    except Exception as e:
+        print(f"Prefix cache not reusable, running full prefill: {e}")
+        return None
+
+
+@_serialized
+def generate_batch(raw_messages_list: List[List[dict]], max_new_tokens: int,
+                   include_prompt: bool = False, response_prefix: str = "") -> List[str]:
+    # one left-padded generate call for several conversations; only the
+    # generated continuation of each conversation is decoded unless
+    # include_prompt, which matches generate_response's prompt + reply.
+    # response_prefix is forced as the start of every reply: it is appended
+    # to the prompt tokens and returned in front of the continuation
+    initialize_model()
+    _check_modalities(raw_messages_list)
+
+    with profiling.span("preprocess"):
+        inputs = processor.apply_chat_template(
+            raw_messages_list,
+            tokenize=True,
+            return_dict=True,
+            return_tensors='pt',
+            add_generation_prompt=True,
+            padding=True
+        )
+        if response_prefix:
+            inputs = _append_tokens(inputs, response_prefix)
+        inputs = _to_device(inputs)
+    batch_size, prompt_len = inputs['input_ids'].shape
+    with profiling.span("generate_batch"), profiling.torch_profile(), profiling.module_spans(model):
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            **_static_cache_kwargs(batch_size, prompt_len + max_new_tokens)
+        )
+    if include_prompt:
+        # left padding is a special token and drops out of the decode
+        return processor.batch_decode(outputs, skip_special_tokens=True)
+    replies = processor.batch_decode(outputs[:, prompt_len:], skip_special_tokens=True)
+    return [response_prefix + reply for reply in replies]
+
+
+def _append_tokens(inputs, text: str):
+    # prompts are left-padded, so the same tokens can be appended to every row
+    import torch
+    ids = processor.tokenizer(text, add_special_tokens=False, return_tensors='pt')['input_ids']
+    ids = ids.expand(inputs['input_ids'].shape[0], -1)
+    inputs['input_ids'] = torch.cat([inputs['input_ids'], ids], dim=1)
+    inputs['attention_mask'] = torch.cat([inputs['attention_mask'], torch.ones_like(ids)], dim=1)
+    if 'token_type_ids' in inputs:
+        inputs['token_type_ids'] = torch.cat([inputs['token_type_ids'], torch.zeros_like(ids)], dim=1)
+    return inputs
+
+
+@_serialized
+def generate_shared_media(raw_messages_list: List[List[dict]], max_new_tokens: List[int]) -> List[str]:
+    # for conversations that start with the same media and differ only in
+    # the text after it: the shared token prefix (including every media
+    # placeholder) is prefilled once, so the vision/audio encoders run once,
+    # and each conversation decodes from a copy of that KV cache. Replies
+    # are prompt + reply, as from generate_response, so a job's output does
+    # not depend on whether it ran grouped or alone
+    initialize_model()
+    _check_modalities(raw_messages_list)
+    import torch
+    from transformers import DynamicCache
+    
+    encoded = [
+        _to_device(processor.apply_chat_template(
+            raw_messages,
+            tokenize=True,
+            return_dict=True,
+            return_tensors='pt',
+            add_generation_prompt=True
+        ))
+        for raw_messages in raw_messages_list
+    ]
+    ids = [inputs['input_ids'] for inputs in encoded]
+    n = min(x.shape[1] for x in ids) - 1
+    for other in ids[1:]:
+        mismatch = (ids[0][0, :n] != other[0, :n]).nonzero()
+        if len(mismatch):
+            n = int(mismatch[0])
+    
+    media_ids = [getattr(model.config, name, None) for name in ("image_token_id", "audio_token_id")]
+    last_media = max(
+        (int(hits.max()) for hits in ((ids[0][0] == t).nonzero() for t in media_ids if t is not None) if len(hits)),
+        default=-1
+    )
+    if last_media >= n:
+        # the media is not part of a common prefix; batch them instead
+        return generate_batch(raw_messages_list, max(max_new_tokens), include_prompt=True)
+    
+    first = encoded[0]
+    prefill_inputs = {k: v for k, v in first.items() if k not in ("input_ids", "attention_mask", "token_type_ids")}
+    if "token_type_ids" in first:
+        prefill_inputs["token_type_ids"] = first["token_type_ids"][:, :n]
+    cache = DynamicCache()
+    with torch.no_grad():
+        model(
+            input_ids=ids[0][:, :n],
+            attention_mask=first["attention_mask"][:, :n],
+            past_key_values=cache,
+            use_cache=True,
+            **prefill_inputs
+        )
+    
+    replies = []
+    for inputs, tokens in zip(encoded, max_new_tokens):
+        outputs = model.generate(
+            input_ids=inputs['input_ids'],
+            attention_mask=inputs['attention_mask'],
+            past_key_values=copy.deepcopy(cache),
+            max_new_tokens=tokens
+        )
+        replies.append(processor.decode(outputs[0], skip_special_tokens=True))
+    return replies
+
+
+@_serialized
+def score_yes_no(raw_messages_list: List[List[dict]]) -> List[float]:
+    # P(yes) of the first answer token for each conversation, from one
+    # batched forward pass instead of a generate call; YES/Yes/yes and
+    # NO/No/no are pooled and the two are normalized against each other
+    initialize_model()
+    _check_modalities(raw_messages_list)
+    import inspect
+    import torch
+    
+    with profiling.span("preprocess"):
+        inputs = processor.apply_chat_template(
+            raw_messages_list,
+            tokenize=True,
+            return_dict=True,
+            return_tensors='pt',
+            add_generation_prompt=True,
+            padding=True
+        )
+        inputs = _to_device(inputs)
+    # only the last position's logits are needed; the full vocabulary at
+    # every position would dwarf the rest of the batch
+    params = inspect.signature(model.forward).parameters
+    keep = next(({name: 1} for name in ("logits_to_keep", "num_logits_to_keep") if name in params), {})
+    yes_ids, no_ids = _answer_token_ids()
+    with profiling.span("score"), profiling.module_spans(model), torch.inference_mode():
+        logits = model(**inputs, **keep).logits[:, -1, :].float()
+    log_probs = torch.log_softmax(logits, dim=-1)
+    yes = torch.logsumexp(log_probs[:, yes_ids], dim=-1)
+    no = torch.logsumexp(log_probs[:, no_ids], dim=-1)
+    metrics.incr("score.conversations", len(raw_messages_list))
+    return torch.sigmoid(yes - no).tolist()
+
+
+def _answer_token_ids():
+    global _answer_ids
+    if _answer_ids is None:
+        ids = []
+        for words in (("YES", "Yes", "yes"), ("NO", "No", "no")):
+            ids.append(sorted({processor.tokenizer.encode(w, add_special_tokens=False)[0] for w in words}))
+        _answer_ids = tuple(ids)
+    return _answer_ids
+
+
+@_serialized
+def embed_media(kind: str, media: list):
+    # one L2-normalized vector per image or audio clip: the encoder output
+    # after its projection into the language model's embedding space,
+    # mean-pooled over the soft tokens (over unpadded frames for audio)
+    initialize_model()
+    _check_modalities([[{"role": "user", "content": [{"type": kind}]}]])
+    import numpy as np
+    import torch
+    
+    owner = model.model if hasattr(model.model, "get_image_features") else model
+    vectors = []
+    with profiling.span("embed"), torch.inference_mode():
+        for start in range(0, len(media), EMBED_BATCH):
+            chunk = media[start:start + EMBED_BATCH]
+            if kind == "image":
+                inputs = _to_device(processor.image_processor(chunk, return_tensors="pt"))
+                features = _projected(owner.get_image_features(inputs["pixel_values"]))
+                pooled = features.mean(dim=1) if features.dim() == 3 else features
+            else:
+                inputs = _to_device(processor.feature_extractor(chunk, return_tensors="pt"))
+                # the encoder's mask marks padding, the feature extractor's
+                # marks valid frames
+                out = owner.get_audio_features(inputs["input_features"], ~inputs["input_features_mask"])
+                if hasattr(out, "last_hidden_state"):
+                    features, padding = _projected(out), out.audio_mel_mask
+                else:
+                    features, padding = out
+                valid = (~padding).unsqueeze(-1).to(features.dtype)
+                pooled = (features * valid).sum(dim=1) / valid.sum(dim=1).clamp(min=1)
+            vectors.append(torch.nn.functional.normalize(pooled.float(), dim=-1).cpu().numpy())
+    metrics.incr(f"embeddings.{kind}", len(media))
+    return np.concatenate(vectors)
+
+
+def _projected(out):
+    # transformers 4.x returns the projected soft tokens as a tensor, 5.x a
+    # ModelOutput with them in pooler_output and the raw encoder output in
+    # last_hidden_state
+    if not hasattr(out, "last_hidden_state"):
+        return out
+    return out.pooler_output if getattr(out, "pooler_output", None) is not None else out.last_hidden_state
+
+
+def _to_device(inputs):
+    import torch
+    if DEVICE == "cuda":
+        return inputs.to(device="cuda", dtype=torch.bfloat16)
+    return inputs.to(device="cpu")
 
@@ -0,0 +1,154 @@
+# src/daemon.py
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import time
+from contextlib import redirect_stdout
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+SOCKET_PATH = os.getenv("GEMMA3N_SOCKET", "/tmp/gemma3n.sock")
+
+
+def _run_cli(argv: List[str]):
+    import cli
+    cli.main(argv)
+
+
+def _run_waggle(argv: List[str]):
+    import waggle_cli
+    waggle_cli.main(argv)
+
+
+ENTRY_POINTS = {
+    "cli": _run_cli,
+    "waggle": _run_waggle,
+}
+
+
+def run_entry(entry: str, argv: List[str]) -> int:
+    try:
+        ENTRY_POINTS[entry](argv)
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+
+
+class _SocketWriter:
+    # file-like object forwarding writes to the client as JSON lines
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        if text:
+            self.wfile.write((json.dumps({"out": text}) + "\n").encode())
+            self.wfile.flush()
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    # one job per connection: {"entry": "cli"|"waggle", "argv": [...], "cwd": "..."}
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            entry, argv = request["entry"], request["argv"]
+            if entry not in ENTRY_POINTS:
+                raise ValueError(f"Unknown entry point: {entry}")
+        except Exception as e:
+            self.wfile.write((json.dumps({"error": f"Bad request: {e}"}) + "\n").encode())
+            return
+
+        writer = _SocketWriter(self.wfile)
+        log_handler = logging.StreamHandler(writer)
+        log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        root = logging.getLogger()
+        root.addHandler(log_handler)
+        previous_cwd = os.getcwd()
+        start = time.monotonic()
+        try:
+            os.chdir(request.get("cwd") or previous_cwd)
+            with redirect_stdout(writer):
+                code = run_entry(entry, argv)
+        except Exception as e:
+            logger.exception(f"Job failed: {entry} {argv}")
+            writer.write(f"Job failed: {e}\n")
+            code = 1
+        finally:
+            os.chdir(previous_cwd)
+            root.removeHandler(log_handler)
+        logger.info(f"Finished {entry} {' '.join(argv)} in {time.monotonic() - start:.1f}s (exit {code})")
+        self.wfile.write((json.dumps({"exit": code}) + "\n").encode())
+
+
+def serve(socket_path: str = SOCKET_PATH):
+    # keeps the model resident and runs submitted jobs one at a time, which
+    # also serializes access to the single model instance
+    import src.core as core
+    core.initialize_model()
+
+    if os.path.exists(socket_path):
+        if submit_ping(socket_path):
+            raise RuntimeError(f"A daemon is already listening on {socket_path}")
+        os.remove(socket_path)
+
+    with socketserver.UnixStreamServer(socket_path, _JobHandler) as server:
+        os.chmod(socket_path, 0o600)
+        print(f"Gemma3n daemon listening on {socket_path}")
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+def _connect(socket_path: str) -> Optional[socket.socket]:
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
+def submit_ping(socket_path: str = SOCKET_PATH) -> bool:
+    sock = _connect(socket_path)
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+def submit(entry: str, argv: List[str], socket_path: str = SOCKET_PATH) -> Optional[int]:
+    # runs the job on a running daemon, streaming its output to this
+    # process; returns None when no daemon is reachable
+    sock = _connect(socket_path)
+    if sock is None:
+        return None
+
+    with sock, sock.makefile("rwb") as stream:
+        stream.write((json.dumps({"entry": entry, "argv": argv, "cwd": os.getcwd()}) + "\n").encode())
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "out" in message:
+                sys.stdout.write(message["out"])
+                sys.stdout.flush()
+            elif "error" in message:
+                print(message["error"], file=sys.stderr)
+                return 1
+            elif "exit" in message:
+                return message["exit"]
+    print("Daemon closed the connection before the job finished", file=sys.stderr)
+    return 1
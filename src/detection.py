@@ -0,0 +1,141 @@
+# src/detection.py
+import json
+import os
+import re
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from src.core import generate_batch
+from src.scheduler import estimate_cost
+
+TILE_SIZE = int(os.getenv("TILE_SIZE", "768"))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+DETECTION_BATCH = int(os.getenv("DETECTION_BATCH", "4"))
+NMS_IOU = float(os.getenv("NMS_IOU", "0.5"))
+# a box mostly inside a higher-scoring one is the same object cut by a tile edge
+NMS_CONTAINMENT = 0.8
+
+DETECTION_PROMPT = "You are an expert object detector. Find every instance of '{object_name}' in the image. Respond only with JSON of the form {{\"boxes\": [{{\"box\": [x_min, y_min, x_max, y_max], \"confidence\": 0.0}}]}} where coordinates are integers from 0 to 1000 relative to the image width and height and confidence is between 0 and 1. Respond with {{\"boxes\": []}} if there is none."
+# forced as the start of every reply so generation begins inside the JSON
+RESPONSE_PREFIX = '{"boxes": ['
+
+
+def make_tiles(width: int, height: int, tile_size: int = TILE_SIZE, overlap: float = TILE_OVERLAP) -> List[Tuple[int, int, int, int]]:
+    # (left, top, right, bottom) crops; the whole image always comes first so
+    # objects larger than a tile are still seen in one piece
+    tiles = [(0, 0, width, height)]
+    if max(width, height) <= tile_size * 1.25:
+        return tiles
+    step = max(1, int(tile_size * (1 - overlap)))
+    xs = list(range(0, max(1, width - tile_size), step)) + [max(0, width - tile_size)]
+    ys = list(range(0, max(1, height - tile_size), step)) + [max(0, height - tile_size)]
+    for top in sorted(set(ys)):
+        for left in sorted(set(xs)):
+            tiles.append((left, top, min(width, left + tile_size), min(height, top + tile_size)))
+    return tiles
+
+
+def parse_boxes(text: str) -> List[Tuple[float, float, float, float, float]]:
+    # tolerant of code fences and surrounding prose; returns
+    # (x_min, y_min, x_max, y_max, confidence) with coordinates in 0-1
+    match = re.search(r"\{.*\}|\[.*\]", text, re.S)
+    if not match:
+        return []
+    try:
+        data = json.loads(match.group(0))
+        items = data.get("boxes", []) if isinstance(data, dict) else data
+    except json.JSONDecodeError:
+        # a reply cut off by max_new_tokens still holds complete boxes
+        items = []
+        for obj in re.findall(r"\{[^{}]*\}", text):
+            try:
+                items.append(json.loads(obj))
+            except json.JSONDecodeError:
+                continue
+
+    boxes = []
+    for item in items if isinstance(items, list) else []:
+        coords, conf = item, 0.5
+        if isinstance(item, dict):
+            coords = item.get("box") or item.get("bbox") or item.get("box_2d")
+            conf = item.get("confidence", 0.5)
+        try:
+            x0, y0, x1, y1 = (min(1000.0, max(0.0, float(c))) / 1000 for c in coords)
+            conf = min(1.0, max(0.0, float(conf)))
+        except (TypeError, ValueError):
+            continue
+        if x1 > x0 and y1 > y0:
+            boxes.append((x0, y0, x1, y1, conf))
+    return boxes
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float = NMS_IOU) -> List[int]:
+    # greedy non-maximum suppression; each step compares the best remaining
+    # box against all others at once
+    x0, y0, x1, y1 = boxes.T
+    areas = (x1 - x0) * (y1 - y0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i, rest = order[0], order[1:]
+        keep.append(int(i))
+        iw = np.clip(np.minimum(x1[i], x1[rest]) - np.maximum(x0[i], x0[rest]), 0, None)
+        ih = np.clip(np.minimum(y1[i], y1[rest]) - np.maximum(y0[i], y0[rest]), 0, None)
+        inter = iw * ih
+        iou = inter / (areas[i] + areas[rest] - inter)
+        contained = inter / np.minimum(areas[i], areas[rest])
+        order = rest[(iou <= iou_threshold) & (contained <= NMS_CONTAINMENT)]
+    return keep
+
+
+def estimate_detection_cost(width: int, height: int, max_new_tokens: int) -> float:
+    # one single-image conversation per tile
+    per_tile = estimate_cost([{"role": "user", "content": [{"type": "image"}]}], max_new_tokens)
+    return len(make_tiles(width, height)) * per_tile
+
+
+def detect_objects(image: Image.Image, object_name: str, max_new_tokens: int = 150) -> dict:
+    # every tile is one conversation in a batched generate call; tile-local
+    # boxes are mapped to pixel coordinates of the full image and merged
+    tiles = make_tiles(*image.size)
+    prompt = DETECTION_PROMPT.format(object_name=object_name)
+    replies = []
+    for i in range(0, len(tiles), DETECTION_BATCH):
+        batch = [
+            [
+                {"role":"system", "content":[{"type":"text","text":prompt}]},
+                {"role":"user", "content":[{"type":"image", "image": image.crop(tile)}]},
+            ]
+            for tile in tiles[i:i + DETECTION_BATCH]
+        ]
+        replies.extend(generate_batch(batch, max_new_tokens, response_prefix=RESPONSE_PREFIX))
+
+    found = []
+    for (left, top, right, bottom), reply in zip(tiles, replies):
+        w, h = right - left, bottom - top
+        for x0, y0, x1, y1, conf in parse_boxes(reply):
+            found.append((left + x0 * w, top + y0 * h, left + x1 * w, top + y1 * h, conf))
+
+    detections = []
+    if found:
+        arr = np.array(found, dtype=np.float32)
+        for i in nms(arr[:, :4], arr[:, 4]):
+            x0, y0, x1, y1, conf = (float(v) for v in arr[i])
+            detections.append({
+                "bbox": {"x_min": round(x0, 1), "y_min": round(y0, 1), "x_max": round(x1, 1), "y_max": round(y1, 1)},
+                "confidence": round(conf, 3),
+            })
+    return {"detections": detections, "tiles": len(tiles)}
+
+
+def render_overlay(image_path: str, detections: List[dict], out_path: str):
+    image = Image.open(image_path).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    width = max(2, round(max(image.size) / 400))
+    for det in detections:
+        b = det["bbox"]
+        draw.rectangle((b["x_min"], b["y_min"], b["x_max"], b["y_max"]), outline=(255, 0, 0), width=width)
+        draw.text((b["x_min"] + width, b["y_min"] + width), f"{det['confidence']:.2f}", fill=(255, 0, 0))
+    image.save(out_path, "JPEG", quality=90)
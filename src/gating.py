@@ -0,0 +1,118 @@
+# src/gating.py
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from src.utils import AUDIO_SAMPLE_RATE
+
+IMAGE_CHANGE_THRESHOLD = float(os.getenv("IMAGE_CHANGE_THRESHOLD", "0.05"))
+AUDIO_CHANGE_THRESHOLD = float(os.getenv("AUDIO_CHANGE_THRESHOLD", "0.2"))
+
+THUMB_SIZE = 32
+AUDIO_FRAME = 1024
+AUDIO_BANDS = 16
+
+
+def image_signature(image) -> dict:
+    # image is a PIL image or a path; returns a 64-bit difference hash plus a
+    # small grayscale thumbnail for the mean absolute frame difference
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    gray = image.convert("L")
+    dhash_px = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    thumb = np.asarray(gray.resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR), dtype=np.float32) / 255.0
+    return {"dhash": dhash_px[:, 1:] > dhash_px[:, :-1], "thumb": thumb}
+
+
+def image_change(a: dict, b: dict) -> float:
+    hamming = np.count_nonzero(a["dhash"] != b["dhash"]) / a["dhash"].size
+    frame_diff = float(np.abs(a["thumb"] - b["thumb"]).mean())
+    return max(hamming, frame_diff)
+
+
+def audio_signature(audio, samplerate: int = AUDIO_SAMPLE_RATE) -> dict:
+    # audio is a mono array or a path; returns loudness in dB and the share of
+    # spectral energy in log-spaced bands
+    if isinstance(audio, str):
+        import librosa
+        audio, samplerate = librosa.load(audio, sr=AUDIO_SAMPLE_RATE, mono=True)
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+
+    rms = float(np.sqrt(np.mean(audio ** 2))) if audio.size else 0.0
+    energy_db = 20.0 * np.log10(rms + 1e-8)
+
+    n_frames = max(1, audio.size // AUDIO_FRAME)
+    frames = np.zeros((n_frames, AUDIO_FRAME), dtype=np.float32)
+    usable = audio[:n_frames * AUDIO_FRAME]
+    frames.reshape(-1)[:usable.size] = usable
+    power = (np.abs(np.fft.rfft(frames * np.hanning(AUDIO_FRAME), axis=1)) ** 2).mean(axis=0)
+
+    edges = np.unique(np.geomspace(1, power.size, AUDIO_BANDS + 1).astype(int))
+    bands = np.add.reduceat(power, edges[:-1])
+    total = bands.sum()
+    bands = bands / total if total > 0 else bands
+    return {"energy_db": energy_db, "bands": bands}
+
+
+def audio_change(a: dict, b: dict) -> float:
+    spectral = 0.5 * float(np.abs(a["bands"] - b["bands"]).sum())
+    loudness = min(1.0, abs(a["energy_db"] - b["energy_db"]) / 20.0)
+    return max(spectral, loudness)
+
+
+class ChangeGate:
+    # remembers the signature of the last processed sample per mode and the
+    # result it produced; a new sample only needs inference when some mode
+    # moved past its threshold
+
+    def __init__(self, image_threshold: float = IMAGE_CHANGE_THRESHOLD, audio_threshold: float = AUDIO_CHANGE_THRESHOLD):
+        self.thresholds = {"image": image_threshold, "audio": audio_threshold}
+        self.signatures: Dict[str, dict] = {}
+        self.last_result: Optional[str] = None
+
+    def check(self, items: List[tuple]) -> Tuple[bool, dict, Dict[str, float]]:
+        # items are (mode, data) pairs; returns (changed, signatures, scores)
+        signatures = {}
+        scores = {}
+        changed = self.last_result is None
+        for mode, data in items:
+            if mode == "image":
+                signatures[mode] = image_signature(data)
+                compare = image_change
+            elif mode == "audio":
+                signatures[mode] = audio_signature(data)
+                compare = audio_change
+            else:
+                # videos are not fingerprinted and always count as changed
+                changed = True
+                continue
+            previous = self.signatures.get(mode)
+            if previous is None:
+                changed = True
+                continue
+            scores[mode] = round(compare(previous, signatures[mode]), 4)
+            if scores[mode] >= self.thresholds[mode]:
+                changed = True
+        if set(signatures) != set(self.signatures):
+            changed = True
+        return changed, signatures, scores
+
+    def commit(self, signatures: dict, result: str):
+        self.signatures = signatures
+        self.last_result = result
+
+
+def build_gate(args) -> Optional[ChangeGate]:
+    # shared by cli.py and waggle_cli.py: --gate plus optional thresholds
+    if not getattr(args, "gate", False):
+        return None
+    thresholds = {}
+    if args.image_change_threshold is not None:
+        thresholds["image_threshold"] = args.image_change_threshold
+    if args.audio_change_threshold is not None:
+        thresholds["audio_threshold"] = args.audio_change_threshold
+    return ChangeGate(**thresholds)
@@ -0,0 +1,324 @@
+# src/jobs.py
+import asyncio
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from src.scheduler import scheduler, estimate_cost, current, AdmissionError, RequestContext
+from src.utils import media_duration, TARGET_FPS, MAX_FRAMES
+
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+JOBS_MEDIA_DIR = os.getenv("JOBS_MEDIA_DIR", "job_media")
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_RESULT_TTL = int(os.getenv("JOBS_RESULT_TTL", "86400"))
+JOBS_RETRY_DELAY = float(os.getenv("JOBS_RETRY_DELAY", "30"))
+JOBS_POLL_INTERVAL = 1.0
+# serving replicas share the database; only one of them runs the worker
+JOBS_WORKER = os.getenv("JOBS_WORKER", "1") == "1"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    params       TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    cost         REAL NOT NULL,
+    callback_url TEXT,
+    result       TEXT,
+    error        TEXT,
+    created      REAL NOT NULL,
+    updated      REAL NOT NULL,
+    not_before   REAL NOT NULL DEFAULT 0,
+    expires      REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, not_before, created);
+"""
+
+# queued -> running -> done | failed; failed attempts go back to queued
+# after JOBS_RETRY_DELAY until max_attempts is used up
+STATUSES = ("queued", "running", "done", "failed")
+
+
+def _run_long_video(params: dict) -> dict:
+    from src.long_video import analyze_long_video
+    result = analyze_long_video(params["path"], params["user_text"], params["max_new_tokens"])
+    return {"reply": result["summary"], "timeline": result["timeline"]}
+
+
+def _run_video_captioning(params: dict) -> dict:
+    from src.core import generate_response
+    from src.prompts import render
+    from src.utils import extract_frames_to_tempdir, TEMP_DIR
+    frame_dir = extract_frames_to_tempdir(params["path"], target_fps=TARGET_FPS, max_frames=MAX_FRAMES, parent_dir=TEMP_DIR)
+    content = [{"type": "text", "text": params["user_text"]}] if params["user_text"] else []
+    for frame in sorted(pathlib.Path(frame_dir).glob("*.jpg")):
+        content.append({"type": "image", "image": frame.as_posix()})
+    try:
+        reply = generate_response([
+            {"role": "system", "content": [{"type": "text", "text": render("video_caption")}]},
+            {"role": "user", "content": content},
+        ], params["max_new_tokens"])
+    finally:
+        shutil.rmtree(frame_dir, ignore_errors=True)
+    return {"reply": reply}
+
+
+def _run_audio_captioning(params: dict) -> dict:
+    from src.core import generate_response
+    from src.prompts import render
+    content = [{"type": "text", "text": params["user_text"]}] if params["user_text"] else []
+    content.append({"type": "audio", "audio": params["path"]})
+    reply = generate_response([
+        {"role": "system", "content": [{"type": "text", "text": render("audio_caption")}]},
+        {"role": "user", "content": content},
+    ], params["max_new_tokens"])
+    return {"reply": reply}
+
+
+HANDLERS: Dict[str, Callable[[dict], dict]] = {
+    "video_long_analysis": _run_long_video,
+    "video_captioning": _run_video_captioning,
+    "audio_captioning": _run_audio_captioning,
+}
+
+
+def estimate_job_cost(kind: str, path: str, max_new_tokens: int) -> float:
+    # seconds of model time, from the media duration and the same per-call
+    # estimate the request scheduler uses
+    if kind == "audio_captioning":
+        return estimate_cost([{"role": "user", "content": [{"type": "audio"}]}], max_new_tokens)
+    duration = media_duration(path)
+    if kind == "video_captioning":
+        images = [{"type": "image"}] * min(max(1, int(duration * TARGET_FPS)), MAX_FRAMES)
+        return estimate_cost([{"role": "user", "content": images}], max_new_tokens)
+    from src.long_video import estimate_long_video_cost
+    return estimate_long_video_cost(path, max_new_tokens)
+
+
+class JobStore:
+    # one SQLite connection shared by the API and the worker; WAL keeps
+    # status polls from blocking on the worker's writes
+
+    def __init__(self, path: str = JOBS_DB, media_dir: str = JOBS_MEDIA_DIR):
+        self.media_dir = media_dir
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def submit(self, kind: str, media_path: str, params: dict, callback_url: str = "",
+               max_attempts: int = JOBS_MAX_ATTEMPTS) -> dict:
+        # the upload is moved out of the temp dir so it survives restarts
+        if kind not in HANDLERS:
+            raise ValueError(f"Unknown job kind '{kind}', expected one of {list(HANDLERS)}")
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.media_dir, exist_ok=True)
+        stored = os.path.join(self.media_dir, job_id + pathlib.Path(media_path).suffix)
+        shutil.move(media_path, stored)
+        params = {**params, "path": stored}
+        cost = estimate_job_cost(kind, stored, params.get("max_new_tokens", 0))
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO jobs (id, kind, params, status, max_attempts, cost, callback_url, created, updated) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), max_attempts, cost, callback_url or None, now, now),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = self._to_dict(row)
+            if job["status"] == "queued":
+                # model time of everything that runs before this job
+                ahead = self.db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(cost), 0) FROM jobs WHERE status IN ('queued', 'running') "
+                    "AND (status = 'running' OR created < ?)", (row["created"],)
+                ).fetchone()
+                job["position"], job["estimated_wait"] = ahead[0], round(ahead[1], 1)
+        return job
+
+    def list(self, status: str = "", limit: int = 100) -> List[dict]:
+        query, args = "SELECT * FROM jobs", ()
+        if status:
+            query, args = query + " WHERE status = ?", (status,)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY created DESC LIMIT ?", args + (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def delete(self, job_id: str) -> bool:
+        # running jobs finish but their result is discarded
+        with self.lock:
+            row = self.db.execute("SELECT params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return False
+            self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        self._remove_media(json.loads(row["params"]))
+        return True
+
+    def claim(self) -> Optional[dict]:
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND not_before <= ? ORDER BY created LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            # another process sharing the database may have claimed it first
+            claimed = self.db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ? AND status = 'queued'",
+                (now, row["id"])
+            ).rowcount
+            if not claimed:
+                return None
+        return {**self._to_dict(row), "attempts": row["attempts"] + 1}
+
+    def finish(self, job: dict, result: Optional[dict] = None, error: str = ""):
+        now = time.time()
+        retry = error and job["attempts"] < job["max_attempts"]
+        status = "queued" if retry else ("failed" if error else "done")
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ?, not_before = ?, expires = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error or None, now,
+                 now + JOBS_RETRY_DELAY if retry else 0, None if retry else now + JOBS_RESULT_TTL, job["id"]),
+            )
+        if not retry:
+            self._remove_media(job["params"])
+
+    def requeue_interrupted(self) -> int:
+        # jobs left running by a previous process; the attempt is counted, so
+        # a job that keeps taking the process down fails once it has used up
+        # max_attempts instead of being claimed again on every restart
+        now = time.time()
+        with self.lock:
+            exhausted = self.db.execute(
+                "SELECT id, params FROM jobs WHERE status = 'running' AND attempts >= max_attempts"
+            ).fetchall()
+            self.db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated = ?, expires = ? "
+                "WHERE status = 'running' AND attempts >= max_attempts",
+                ("interrupted by a server restart on its last attempt", now, now + JOBS_RESULT_TTL),
+            )
+            requeued = self.db.execute("UPDATE jobs SET status = 'queued', updated = ? WHERE status = 'running'",
+                                       (now,)).rowcount
+        for row in exhausted:
+            print(f"Job {row['id']} failed: interrupted on its last attempt")
+            self._remove_media(json.loads(row["params"]))
+        return requeued
+
+    def purge_expired(self) -> int:
+        with self.lock:
+            return self.db.execute("DELETE FROM jobs WHERE expires IS NOT NULL AND expires < ?", (time.time(),)).rowcount
+
+    def _remove_media(self, params: dict):
+        path = params.get("path")
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def _to_dict(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["cost"] = round(job["cost"], 1)
+        return job
+
+
+class JobWorker:
+    # runs queued jobs one at a time in a background thread; each job is
+    # admitted by the request scheduler on the server's event loop as bulk
+    # priority, so interactive requests are not starved by long media
+
+    def __init__(self):
+        self.store = None
+        self.loop = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if self.thread is not None or not JOBS_WORKER:
+            return
+        self.store = get_store()
+        self.loop = loop
+        requeued = self.store.requeue_interrupted()
+        if requeued:
+            print(f"Requeued {requeued} interrupted job(s)")
+        self.thread = threading.Thread(target=self._loop, name="job-worker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _loop(self):
+        last_purge = 0.0
+        while not self.stop_event.is_set():
+            if time.monotonic() - last_purge > 60:
+                self.store.purge_expired()
+                last_purge = time.monotonic()
+            job = self.store.claim()
+            if job is None:
+                self.stop_event.wait(JOBS_POLL_INTERVAL)
+                continue
+            self._run(job)
+
+    def _run(self, job: dict):
+        try:
+            result = asyncio.run_coroutine_threadsafe(self._admitted(job), self.loop).result()
+        except Exception as e:
+            print(f"Job {job['id']} attempt {job['attempts']} failed: {e}")
+            self.store.finish(job, error=str(e))
+        else:
+            self.store.finish(job, result=result)
+        finished = self.store.get(job["id"])
+        if finished is not None and finished["status"] in ("done", "failed") and job["callback_url"]:
+            _notify(job["callback_url"], finished)
+
+    async def _admitted(self, job: dict) -> dict:
+        # a full bulk class is not a failure of the job; it waits for room
+        # without using up an attempt
+        current.set(RequestContext("bulk"))
+        while True:
+            try:
+                async with scheduler.admit(job["cost"]):
+                    return await asyncio.to_thread(HANDLERS[job["kind"]], job["params"])
+            except AdmissionError:
+                await asyncio.sleep(JOBS_POLL_INTERVAL)
+
+
+def _notify(url: str, job: dict):
+    body = {k: job[k] for k in ("id", "kind", "status", "result", "error", "attempts")}
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    try:
+        urllib.request.urlopen(request, timeout=10).close()
+    except Exception as e:
+        print(f"Callback for job {job['id']} to {url} failed: {e}")
+
+
+# the database is opened on first use, not on import
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> JobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore()
+    return _store
+
+
+worker = JobWorker()
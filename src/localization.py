@@ -0,0 +1,101 @@
+# src/localization.py
+import os
+from typing import List
+
+from src.core import score_yes_no
+from src.prompts import render
+from src.scheduler import estimate_cost
+from src.utils import iter_frame_windows, media_duration
+
+LOCALIZE_FPS = float(os.getenv("LOCALIZE_FPS", "1"))
+LOCALIZE_BATCH = int(os.getenv("LOCALIZE_BATCH", "8"))
+LOCALIZE_MAX_WINDOWS = int(os.getenv("LOCALIZE_MAX_WINDOWS", "600"))
+
+
+def estimate_localization_cost(video_path: str, fps: float, window_frames: int) -> float:
+    # one prefill of window_frames images and a single scored token per
+    # sampled frame
+    windows = min(LOCALIZE_MAX_WINDOWS, max(1, int(media_duration(video_path) * fps)))
+    return windows * estimate_cost([{"role": "user", "content": [{"type": "image"}] * window_frames}], 1)
+
+
+def localize_event(
+    video_path: str,
+    event_description: str,
+    fps: float = LOCALIZE_FPS,
+    window_frames: int = 1,
+    threshold: float = 0.5,
+    max_gap: float = 1.0,
+    min_duration: float = 0.0,
+) -> dict:
+    # windows of window_frames frames with a stride of one frame, so every
+    # sampled frame from the window_frames-th on ends one window; windows are
+    # scored LOCALIZE_BATCH at a time so only that many windows of decoded
+    # frames are alive
+    system_prompt = render("frame_event", event_description=event_description)
+    scores, pending = [], []
+    truncated = False
+    for start, end, frames in iter_frame_windows(video_path, fps, window_frames, 1):
+        if len(scores) + len(pending) >= LOCALIZE_MAX_WINDOWS:
+            # only a window past the limit makes the result truncated
+            truncated = True
+            break
+        pending.append((start, end, frames))
+        if len(pending) >= LOCALIZE_BATCH:
+            scores.extend(_score_windows(pending, system_prompt))
+            pending = []
+    if pending:
+        scores.extend(_score_windows(pending, system_prompt))
+
+    if not scores:
+        raise ValueError("No frames could be decoded from the video")
+
+    return {
+        "scores": scores,
+        "intervals": merge_intervals(scores, threshold, max_gap, min_duration),
+        "windows": len(scores),
+        "truncated": truncated,
+    }
+
+
+def _score_windows(windows, system_prompt: str) -> List[dict]:
+    batch = [
+        [
+            {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
+            {"role": "user", "content": [{"type": "image", "image": image} for _, image in frames]},
+        ]
+        for _, _, frames in windows
+    ]
+    probabilities = score_yes_no(batch)
+    return [
+        {"start": round(start, 3), "end": round(end, 3), "probability": round(p, 4)}
+        for (start, end, _), p in zip(windows, probabilities)
+    ]
+
+
+def merge_intervals(scores: List[dict], threshold: float = 0.5, max_gap: float = 1.0,
+                    min_duration: float = 0.0) -> List[dict]:
+    # windows at or above threshold, merged when they overlap or are at most
+    # max_gap seconds apart; intervals shorter than min_duration are dropped
+    intervals = []
+    for score in scores:
+        if score["probability"] < threshold:
+            continue
+        last = intervals[-1] if intervals else None
+        if last is not None and score["start"] - last["end"] <= max_gap:
+            last["end"] = max(last["end"], score["end"])
+            last["probabilities"].append(score["probability"])
+        else:
+            intervals.append({"start": score["start"], "end": score["end"], "probabilities": [score["probability"]]})
+
+    merged = []
+    for interval in intervals:
+        if interval["end"] - interval["start"] < min_duration:
+            continue
+        probabilities = interval.pop("probabilities")
+        merged.append({
+            **interval,
+            "peak": max(probabilities),
+            "mean": round(sum(probabilities) / len(probabilities), 4),
+        })
+    return merged
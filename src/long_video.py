@@ -0,0 +1,111 @@
+# src/long_video.py
+import math
+import os
+from typing import List, Tuple
+
+from src.core import generate_batch
+from src.scheduler import estimate_cost
+from src.utils import iter_frame_windows, media_duration, TARGET_FPS, WINDOW_FRAMES, WINDOW_STRIDE
+
+WINDOW_BATCH = int(os.getenv("WINDOW_BATCH", "2"))
+MERGE_FANOUT = int(os.getenv("MERGE_FANOUT", "4"))
+
+WINDOW_PROMPT = "You are an expert video analyst. The frames provided are consecutive frames from one segment of a longer video. Describe the notable actions, events, objects and scene changes in this segment in a few concise sentences, in the order they happen."
+MERGE_PROMPT = "You are an expert video analyst. You are given chronological summaries of consecutive segments of a video, each prefixed with its time range. Merge them into a single coherent summary of the whole span. Preserve the order of events and mention when notable events happen using the given timestamps."
+
+
+def format_ts(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def estimate_long_video_cost(video_path: str, max_new_tokens: int) -> float:
+    # one batched summary per window plus roughly one text-only merge per
+    # window across all merge levels
+    frames = max(1, int(media_duration(video_path) * TARGET_FPS))
+    windows = max(1, math.ceil(max(0, frames - WINDOW_FRAMES) / WINDOW_STRIDE) + 1)
+    per_window = estimate_cost([{"role": "user", "content": [{"type": "image"}] * WINDOW_FRAMES}], max_new_tokens)
+    per_merge = estimate_cost([{"role": "user", "content": []}], max_new_tokens)
+    return windows * (per_window + per_merge)
+
+
+def analyze_long_video(
+    video_path: str,
+    user_text: str = "",
+    max_new_tokens: int = 150,
+    target_fps: float = TARGET_FPS,
+    window_frames: int = WINDOW_FRAMES,
+    stride_frames: int = WINDOW_STRIDE,
+) -> dict:
+    # level 0: every window becomes a timestamped timeline entry; windows are
+    # summarized WINDOW_BATCH at a time so only that many windows of decoded
+    # frames are alive, regardless of the video length
+    timeline = []
+    pending = []
+    for start, end, frames in iter_frame_windows(video_path, target_fps, window_frames, stride_frames):
+        pending.append((start, end, frames))
+        if len(pending) >= WINDOW_BATCH:
+            timeline.extend(_summarize_windows(pending, user_text, max_new_tokens))
+            pending = []
+    if pending:
+        timeline.extend(_summarize_windows(pending, user_text, max_new_tokens))
+
+    if not timeline:
+        raise ValueError("No frames could be decoded from the video")
+
+    levels = 0
+    nodes = [(e["start"], e["end"], e["summary"]) for e in timeline]
+    while len(nodes) > 1:
+        nodes = _merge_level(nodes, user_text, max_new_tokens)
+        levels += 1
+
+    return {
+        "summary": nodes[0][2],
+        "timeline": timeline,
+        "windows": len(timeline),
+        "merge_levels": levels,
+    }
+
+
+def _summarize_windows(windows, user_text: str, max_new_tokens: int) -> List[dict]:
+    batch = []
+    for start, end, frames in windows:
+        content = [{"type": "text", "text": f"Segment {format_ts(start)}-{format_ts(end)}."}]
+        if user_text:
+            content.append({"type": "text", "text": user_text})
+        for _, image in frames:
+            content.append({"type": "image", "image": image})
+        batch.append([
+            {"role": "system", "content": [{"type": "text", "text": WINDOW_PROMPT}]},
+            {"role": "user", "content": content},
+        ])
+
+    replies = generate_batch(batch, max_new_tokens)
+    return [
+        {"start": round(start, 2), "end": round(end, 2), "summary": reply.strip()}
+        for (start, end, _), reply in zip(windows, replies)
+    ]
+
+
+def _merge_level(nodes: List[Tuple[float, float, str]], user_text: str, max_new_tokens: int):
+    groups = [nodes[i:i + MERGE_FANOUT] for i in range(0, len(nodes), MERGE_FANOUT)]
+    # a trailing single node has nothing to merge with and moves up unchanged
+    carry = groups.pop() if len(groups) > 1 and len(groups[-1]) == 1 else None
+    merged = []
+    for i in range(0, len(groups), WINDOW_BATCH):
+        chunk = groups[i:i + WINDOW_BATCH]
+        batch = []
+        for group in chunk:
+            text = "\n".join(f"[{format_ts(s)}-{format_ts(e)}] {summary}" for s, e, summary in group)
+            if user_text:
+                text = f"{user_text}\n\n{text}"
+            batch.append([
+                {"role": "system", "content": [{"type": "text", "text": MERGE_PROMPT}]},
+                {"role": "user", "content": [{"type": "text", "text": text}]},
+            ])
+        replies = generate_batch(batch, max_new_tokens)
+        for group, reply in zip(chunk, replies):
+            merged.append((group[0][0], group[-1][1], reply.strip()))
+    if carry:
+        merged.append(carry[0])
+    return merged
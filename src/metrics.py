@@ -0,0 +1,53 @@
+# src/metrics.py
+import os
+import resource
+import threading
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_observations: Dict[str, dict] = {}
+
+
+def incr(name: str, value: float = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float):
+    with _lock:
+        obs = _observations.setdefault(name, {"count": 0, "sum": 0.0, "max": value, "last": value})
+        obs["count"] += 1
+        obs["sum"] += value
+        obs["max"] = max(obs["max"], value)
+        obs["last"] = value
+
+
+def mean(name: str) -> float:
+    with _lock:
+        obs = _observations.get(name)
+        return obs["sum"] / obs["count"] if obs else 0.0
+
+
+def snapshot() -> dict:
+    with _lock:
+        observations = {
+            name: {**obs, "mean": round(obs["sum"] / obs["count"], 4)}
+            for name, obs in _observations.items()
+        }
+        return {"counters": dict(_counters), "gauges": dict(_gauges), "observations": observations}
+
+
+def rss_mb() -> float:
+    # current resident set size; peak RSS where /proc is unavailable
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,156 @@
+# src/ple.py
+import gc
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+import torch
+
+from src import metrics
+
+# Gemma 3n's per-layer embedding (PLE) table holds one row of
+# num_layers * hidden_size_per_layer_input values per token; a forward pass
+# only touches the rows of the tokens it sees. PLE_OFFLOAD=1 moves the table
+# into a memory-mapped file in PLE_DIR and keeps the PLE_CACHE_ROWS most
+# recently used rows in RAM
+PLE_OFFLOAD = os.getenv("PLE_OFFLOAD", "0") == "1"
+PLE_DIR = os.getenv("PLE_DIR", "ple_cache")
+PLE_CACHE_ROWS = int(os.getenv("PLE_CACHE_ROWS", "4096"))
+EXPORT_CHUNK_ROWS = 4096
+
+# the first attribute path that exists on the model is used
+PLE_MODULES = ("model.language_model.embed_tokens_per_layer", "language_model.model.embed_tokens_per_layer",
+               "language_model.embed_tokens_per_layer")
+
+# numpy has no bfloat16, so bfloat16 tables are stored as their raw bits
+_STORAGE = {torch.float32: np.float32, torch.float16: np.float16, torch.bfloat16: np.int16}
+
+
+class MappedEmbedding(torch.nn.Module):
+    # drop-in for the scaled PLE embedding: rows are gathered from the
+    # memory-mapped table through a hot-row LRU cache and scaled the same way
+
+    def __init__(self, path: str, dtype: torch.dtype, embed_scale: float, cache_rows: int = PLE_CACHE_ROWS):
+        super().__init__()
+        self.path = path
+        self.dtype = dtype
+        self.embed_scale = embed_scale
+        self.table = np.load(path, mmap_mode="r")
+        self.num_embeddings, self.embedding_dim = self.table.shape
+        self.cache_rows = cache_rows
+        self.cache = torch.empty(cache_rows, self.embedding_dim, dtype=dtype)
+        self.slots: "OrderedDict[int, int]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _read(self, ids: List[int]) -> torch.Tensor:
+        rows = torch.from_numpy(np.ascontiguousarray(self.table[ids]))
+        return rows.view(self.dtype) if self.dtype == torch.bfloat16 else rows
+
+    def _rows(self, ids: List[int]) -> torch.Tensor:
+        if not self.cache_rows:
+            metrics.incr("ple.cache_misses", len(ids))
+            return self._read(ids)
+        with self.lock:
+            rows = torch.empty(len(ids), self.embedding_dim, dtype=self.dtype)
+            hits, hit_slots, missing = [], [], []
+            for i, token in enumerate(ids):
+                slot = self.slots.get(token)
+                if slot is None:
+                    missing.append(i)
+                else:
+                    self.slots.move_to_end(token)
+                    hits.append(i)
+                    hit_slots.append(slot)
+            if hits:
+                rows[hits] = self.cache[hit_slots]
+            if missing:
+                fetched = self._read([ids[i] for i in missing])
+                rows[missing] = fetched
+                # when one call misses more rows than the cache holds, only
+                # the last cache_rows of them stay cached
+                for i, row in zip(missing[-self.cache_rows:], fetched[-self.cache_rows:]):
+                    if len(self.slots) < self.cache_rows:
+                        slot = len(self.slots)
+                    else:
+                        _, slot = self.slots.popitem(last=False)
+                    self.slots[ids[i]] = slot
+                    self.cache[slot] = row
+            metrics.incr("ple.cache_hits", len(hits))
+            metrics.incr("ple.cache_misses", len(missing))
+        return rows
+
+    @torch.compiler.disable
+    def forward(self, input_ids: torch.Tensor) -> torch.Tensor:
+        start = time.perf_counter()
+        unique, inverse = torch.unique(input_ids.reshape(-1).cpu(), return_inverse=True)
+        rows = self._rows(unique.tolist())[inverse]
+        out = rows.reshape(*input_ids.shape, self.embedding_dim).to(input_ids.device)
+        out = out * torch.tensor(self.embed_scale, dtype=self.dtype, device=out.device)
+        metrics.observe("ple.lookup_seconds", time.perf_counter() - start)
+        return out
+
+
+def _resolve(model):
+    # (parent module, attribute name) of the PLE table
+    for path in PLE_MODULES:
+        *parents, name = path.split(".")
+        owner = model
+        for attr in parents:
+            owner = getattr(owner, attr, None)
+            if owner is None:
+                break
+        if owner is not None and hasattr(owner, name):
+            return owner, name
+    return None, None
+
+
+def _export(weight: torch.Tensor, path: str):
+    # written in chunks to a temp file so a crash never leaves a truncated
+    # table behind
+    tmp = path + ".tmp"
+    table = np.lib.format.open_memmap(tmp, mode="w+", dtype=_STORAGE[weight.dtype], shape=tuple(weight.shape))
+    for start in range(0, weight.shape[0], EXPORT_CHUNK_ROWS):
+        chunk = weight[start:start + EXPORT_CHUNK_ROWS].detach().cpu()
+        table[start:start + len(chunk)] = (chunk.view(torch.int16) if weight.dtype == torch.bfloat16 else chunk).numpy()
+    table.flush()
+    del table
+    os.replace(tmp, path)
+
+
+def offload_per_layer_embeddings(model, model_id: str) -> float:
+    # replaces the loaded PLE table with a MappedEmbedding and returns the
+    # MB of weights released; the table file is written on first use and
+    # reused as long as the model, shape and dtype match
+    owner, name = _resolve(model)
+    if owner is None:
+        print("No per-layer embedding table found; PLE offload skipped")
+        return 0.0
+    embedding = getattr(owner, name)
+    weight = embedding.weight
+    if weight.dtype not in _STORAGE:
+        print(f"PLE offload does not support {weight.dtype}; skipped")
+        return 0.0
+    rows, dim = weight.shape
+    key = hashlib.sha1(model_id.encode()).hexdigest()[:12]
+    path = os.path.join(PLE_DIR, f"ple_{key}_{rows}x{dim}_{str(weight.dtype).split('.')[-1]}.npy")
+    if not os.path.exists(path):
+        os.makedirs(PLE_DIR, exist_ok=True)
+        start = time.perf_counter()
+        _export(weight, path)
+        print(f"Wrote per-layer embeddings to {path} in {time.perf_counter() - start:.1f}s")
+
+    scale = embedding.embed_scale
+    scale = float(scale) if not isinstance(scale, torch.Tensor) else scale.item()
+    freed = weight.numel() * weight.element_size() / 2**20
+    mapped = MappedEmbedding(path, weight.dtype, scale)
+    setattr(owner, name, mapped)
+    del embedding, weight
+    gc.collect()
+    metrics.set_gauge("ple.offloaded_mb", round(freed, 1))
+    metrics.set_gauge("ple.cache_mb", round(mapped.cache.numel() * mapped.cache.element_size() / 2**20, 1))
+    print(f"Per-layer embeddings memory-mapped from {path} ({freed:.0f} MB released, {PLE_CACHE_ROWS} hot rows cached)")
+    return freed
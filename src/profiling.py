@@ -0,0 +1,226 @@
+# src/profiling.py
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import List, Optional
+
+# every PROFILE_SAMPLE_RATE-th request (0 = none) is traced, and with
+# PROFILE_HEADER=1 so is every request with an "X-Profile: 1" header;
+# unsampled requests only pay for one context-variable lookup per span
+PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "0") == "1"
+PROFILE_TORCH = os.getenv("PROFILE_TORCH", "1") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "gemma3n_traces"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+# submodules timed as spans while a request is traced; the first attribute
+# path that exists on the model is used
+ENCODER_MODULES = {
+    "vision_encoder": ("model.vision_tower", "vision_tower"),
+    "audio_encoder": ("model.audio_tower", "audio_tower"),
+}
+
+_current = contextvars.ContextVar("trace_recorder", default=None)
+_counter = itertools.count(1)
+_NULL = nullcontext()
+
+
+class TraceRecorder:
+    # collects Chrome-trace "complete" events for one request; spans from
+    # worker threads land on their own track
+
+    def __init__(self, label: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.events: List[dict] = []
+        self.torch_traces: List[str] = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, begin: float, end: float):
+        event = {
+            "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+            "ts": round((begin - self.origin) * 1e6, 1), "dur": round((end - begin) * 1e6, 1),
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def torch_trace_path(self) -> str:
+        with self.lock:
+            path = os.path.join(PROFILE_DIR, f"{self.id}.torch{len(self.torch_traces)}.json")
+            self.torch_traces.append(os.path.basename(path))
+        return path
+
+    def save(self, status: int):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        duration = max((e["ts"] + e["dur"] for e in self.events), default=0.0) / 1000
+        trace = {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "trace_id": self.id, "label": self.label, "status": status,
+                "started": self.started, "duration_ms": round(duration, 1),
+                "torch_traces": self.torch_traces,
+            },
+        }
+        # written under a temporary name and renamed so readers never see
+        # a partial trace
+        path = os.path.join(PROFILE_DIR, f"{self.id}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(trace, f)
+        os.replace(f"{path}.tmp", path)
+        _rotate()
+
+
+@contextmanager
+def _span(recorder: TraceRecorder, name: str):
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.add(name, begin, time.perf_counter())
+
+
+def span(name: str):
+    recorder = _current.get()
+    if recorder is None:
+        return _NULL
+    return _span(recorder, name)
+
+
+def traced(name: str):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            recorder = _current.get()
+            if recorder is None:
+                return fn(*args, **kwargs)
+            with _span(recorder, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def torch_profile():
+    # torch.profiler around one model call, exported next to the span trace
+    recorder = _current.get()
+    if recorder is None or not PROFILE_TORCH:
+        yield
+        return
+    import torch
+    from torch.profiler import profile, ProfilerActivity
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    with profile(activities=activities) as prof:
+        yield
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prof.export_chrome_trace(recorder.torch_trace_path())
+
+
+@contextmanager
+def module_spans(model):
+    # spans for the vision/audio encoders through forward hooks that exist
+    # only while a traced request is running
+    recorder = _current.get()
+    if recorder is None:
+        yield
+        return
+    handles = []
+    for name, paths in ENCODER_MODULES.items():
+        module = next((m for m in (_resolve(model, p) for p in paths) if m is not None), None)
+        if module is None:
+            continue
+        starts = []
+        handles.append(module.register_forward_pre_hook(lambda *_, s=starts: s.append(time.perf_counter())))
+        handles.append(module.register_forward_hook(
+            lambda *_, s=starts, n=name: recorder.add(n, s.pop(), time.perf_counter()) if s else None))
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+def _resolve(obj, path: str):
+    for attr in path.split("."):
+        obj = getattr(obj, attr, None)
+        if obj is None:
+            return None
+    return obj
+
+
+async def profile_requests(request, call_next):
+    # HTTP middleware; the trace id of a sampled request is returned in the
+    # X-Trace-Id response header
+    sampled = PROFILE_HEADER and request.headers.get("x-profile") == "1"
+    if not sampled and PROFILE_SAMPLE_RATE:
+        sampled = next(_counter) % PROFILE_SAMPLE_RATE == 0
+    if not sampled:
+        return await call_next(request)
+
+    recorder = TraceRecorder(f"{request.method} {request.url.path}")
+    token = _current.set(recorder)
+    status = 500
+    try:
+        with _span(recorder, "request"):
+            response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Trace-Id"] = recorder.id
+        return response
+    finally:
+        _current.reset(token)
+        await asyncio.to_thread(recorder.save, status)
+
+
+def _rotate():
+    # keeps the newest PROFILE_KEEP traces along with their torch exports
+    traces = []
+    for f in os.listdir(PROFILE_DIR):
+        if f.endswith(".json") and ".torch" not in f:
+            try:
+                traces.append((os.path.getmtime(os.path.join(PROFILE_DIR, f)), f))
+            except FileNotFoundError:
+                continue
+    traces.sort()
+    stale = {f[:-len(".json")] for _, f in traces[:-PROFILE_KEEP]} if len(traces) > PROFILE_KEEP else set()
+    for f in os.listdir(PROFILE_DIR):
+        if f.split(".")[0] in stale:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f))
+            except FileNotFoundError:
+                pass
+
+
+def list_traces() -> List[dict]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    traces = []
+    for f in os.listdir(PROFILE_DIR):
+        if f.endswith(".json") and ".torch" not in f:
+            # a concurrent _rotate may delete a trace between listing and
+            # reading it
+            try:
+                with open(os.path.join(PROFILE_DIR, f)) as fh:
+                    traces.append(json.load(fh)["otherData"])
+            except (OSError, ValueError, KeyError):
+                continue
+    return sorted(traces, key=lambda t: t["started"], reverse=True)
+
+
+def trace_path(name: str) -> Optional[str]:
+    # name is a trace id or one of its torch trace file names
+    name = os.path.basename(name)
+    path = os.path.join(PROFILE_DIR, name if name.endswith(".json") else f"{name}.json")
+    return path if os.path.exists(path) else None
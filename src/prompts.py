@@ -0,0 +1,279 @@
+# src/prompts.py
+import os
+import re
+import time
+from string import Formatter
+from typing import Dict, List, Optional, Tuple, Union
+
+from src import metrics
+
+# builds input ids for a single-turn conversation from the same text the
+# chat template renders, but without rendering the Jinja template. The text
+# is a sequence of fixed pieces (chat markup, media placeholder sequences and
+# the literal text of each template) and variable pieces (template values,
+# user text, free-form system prompts). Fixed pieces are tokenized once and
+# cached; at request time only the variable text plus PRETOKENIZED_WINDOW
+# tokens of fixed text on each side of every splice is tokenized, since
+# SentencePiece can merge across a splice but not far past it. Special tokens
+# are hard boundaries. At startup every template is checked against
+# apply_chat_template; templates that do not match, or every conversation
+# when the check itself fails, go through apply_chat_template.
+# PRETOKENIZED_PROMPTS=0 always does
+PRETOKENIZED_PROMPTS = os.getenv("PRETOKENIZED_PROMPTS", "1") == "1"
+PRETOKENIZED_WINDOW = int(os.getenv("PRETOKENIZED_WINDOW", "3"))
+
+# Gemma chat markup as rendered by the chat template; the system prompt is
+# prepended to the first user turn
+TURN_START = "<start_of_turn>user\n"
+TURN_END = "<end_of_turn>\n<start_of_turn>model\n"
+
+TEMPLATES = {
+    "image_caption": "You are an expert image analyst. Provide detailed, accurate captions describing the image content including objects, scenes, people, actions, and any notable features.",
+    "image_event": "You are an expert image event detector. Analyze the image and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if the event is detected, 'NO' if it's not detected, followed by a brief explanation of what you see.",
+    "image_classification": "You are an expert image classifier. Analyze this image and provide a detailed classification including the main subject, scene type, and any notable features.",
+    "image_classification_categories": "You are an expert image classifier. Classify this image into one of the following categories: {categories}. Respond with the most appropriate category and a brief explanation.",
+    "image_change": "You are an expert in image comparison and change detection. Compare these two images and identify what has changed between them. Describe any differences in objects, positions, appearances, or scenes. Be specific about what was added, removed, or modified.",
+    "audio_caption": "You are an expert audio analyst. Provide detailed, accurate captions describing the audio content including sounds, speech, music, environment, and any notable events or patterns you detect.",
+    "audio_event": "You are an expert audio event detector. Analyze the audio and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if the event is detected, 'NO' if it's not detected, followed by a brief explanation of what you hear.",
+    "video_caption": "You are an expert video analyst. Provide detailed, accurate captions describing the video content including actions, scenes, objects, people, and any notable events or patterns. Describe the temporal progression of events.",
+    "video_event": "You are an expert video event detector. Analyze the video frames and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if the event is detected, 'NO' if it's not detected, followed by a detailed explanation of what you see in the video and when/where the event occurs if detected.",
+    "frame_event": "You are an expert video event detector. The images are consecutive frames from a video. Is the following event happening in these frames: '{event_description}'? Answer with only YES or NO.",
+    "multimodal_caption": "You are an expert multimodal analyst. Provide detailed, accurate captions describing the content across all provided media types.",
+    "multimodal_event": "You are an expert multimodal event detector. Analyze all provided media and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if detected, 'NO' if not, followed by explanation.",
+    "audio_vision": "You are an expert multimodal analyst. Analyze both the audio and visual information provided to create a comprehensive understanding of the environment and situation. Correlate information from both modalities to provide insights that wouldn't be possible from either alone. Describe the scene, events, context, and any relationships between what you hear and see.",
+    "audio_video": "You are an expert multimodal analyst. Analyze both the audio and video information provided to create a comprehensive understanding of the environment and situation. Correlate information from both modalities, including temporal alignment between audio and visual events. Describe the scene, events, context, and any relationships between what you hear and see over time.",
+}
+
+
+class Prompt(str):
+    # a rendered template; behaves as the plain prompt text everywhere and
+    # tells encode_messages which template it came from
+    name: str
+    values: Dict[str, str]
+
+
+def render(name: str, **values) -> Prompt:
+    prompt = Prompt(TEMPLATES[name].format(**values))
+    prompt.name = name
+    prompt.values = values
+    return prompt
+
+
+# set by preload: whether spliced ids matched apply_chat_template at all,
+# and the templates whose ids did not
+_verified = False
+_mismatched = set()
+_special = None
+# fixed text -> its parts between special tokens: a special token id, or
+# (token ids, start offset of each token) of the text. Only fixed text is
+# ever cached, so its size is bounded by the templates and the markup
+_fixed: Dict[str, list] = {}
+
+SAMPLE_VALUES = {"event_description": "a person walking a dog", "categories": "nature, urban, indoor"}
+SAMPLE_USER_TEXTS = ("Describe what you notice.", "  Was passiert hier? Zähle die Personen (max. 3)...  ")
+
+
+def _fixed_parts(tokenizer, text: str) -> list:
+    parts = _fixed.get(text)
+    if parts is None:
+        parts = []
+        for piece in _special.split(text):
+            if not piece:
+                continue
+            special_id = tokenizer.added_tokens_encoder.get(piece)
+            if special_id is not None:
+                parts.append(special_id)
+            else:
+                enc = tokenizer(piece, add_special_tokens=False, return_offsets_mapping=True)
+                parts.append((piece, tuple(enc["input_ids"]), tuple(start for start, _ in enc["offset_mapping"])))
+        _fixed[text] = parts
+    return parts
+
+
+def _template_pieces(prompt: Prompt) -> List[Tuple[str, bool]]:
+    formatter = Formatter()
+    pieces = []
+    for literal, field, spec, conversion in formatter.parse(TEMPLATES[prompt.name]):
+        if literal:
+            pieces.append((literal, True))
+        if field is not None:
+            value = formatter.convert_field(prompt.values[field], conversion)
+            pieces.append((formatter.format_field(value, spec), False))
+    return pieces
+
+
+def _pieces(processor, system: Optional[str], content: List[dict]) -> List[Tuple[str, bool]]:
+    # (text, fixed) pieces of what the chat template renders for one user
+    # turn (after <bos>), with the image/audio markers already expanded the
+    # way the processor expands them; the system prompt is prepended to the
+    # user turn
+    pieces = [(TURN_START, True)]
+    if isinstance(system, Prompt):
+        pieces += _template_pieces(system) + [("\n\n", True)]
+    elif system is not None:
+        pieces += [(system, False), ("\n\n", True)]
+    for item in content:
+        if item["type"] == "text":
+            pieces.append((item["text"].strip(), False))
+        elif item["type"] == "image":
+            pieces.append((processor.full_image_sequence, True))
+        else:
+            pieces.append((processor.full_audio_sequence, True))
+    pieces.append((TURN_END, True))
+    return pieces
+
+
+def _encode(tokenizer, pieces: List[Tuple[str, bool]]) -> List[int]:
+    # runs of text between special tokens; inside a run, each fixed text
+    # keeps its cached ids except the PRETOKENIZED_WINDOW tokens next to a
+    # neighbouring piece, which are tokenized again together with that
+    # neighbour (special tokens inside variable text are handled by the
+    # tokenizer itself)
+    items: List[Union[int, tuple]] = []
+    for text, fixed in pieces:
+        if fixed:
+            items.extend(_fixed_parts(tokenizer, text))
+        elif text:
+            items.append((text, None, None))
+
+    ids, window = [], ""
+    reused = tokenized = 0
+    for i, item in enumerate(items):
+        if isinstance(item, int):
+            if window:
+                ids.extend(tokenizer.encode(window, add_special_tokens=False))
+                tokenized += len(window)
+                window = ""
+            ids.append(item)
+            continue
+        text, seg_ids, starts = item
+        if seg_ids is None:
+            window += text
+            continue
+        n = len(seg_ids)
+        head = PRETOKENIZED_WINDOW if i > 0 and not isinstance(items[i - 1], int) else 0
+        tail = PRETOKENIZED_WINDOW if i + 1 < len(items) and not isinstance(items[i + 1], int) else 0
+        # cut only where a token starts past the previous one, never inside
+        # a character split into byte tokens
+        while 0 < head < n and starts[head] <= starts[head - 1]:
+            head += 1
+        tail_at = n - tail
+        while head < tail_at < n and starts[tail_at] <= starts[tail_at - 1]:
+            tail_at -= 1
+        if tail_at <= head:
+            window += text
+            continue
+        window += text[:starts[head]] if head else ""
+        if window:
+            ids.extend(tokenizer.encode(window, add_special_tokens=False))
+            tokenized += len(window)
+        ids.extend(seg_ids[head:tail_at])
+        reused += tail_at - head
+        window = text[starts[tail_at]:] if tail_at < n else ""
+    if window:
+        ids.extend(tokenizer.encode(window, add_special_tokens=False))
+        tokenized += len(window)
+    metrics.incr("prompt.cached_tokens", reused)
+    metrics.incr("prompt.tokenized_chars", tokenized)
+    return ids
+
+
+def _input_ids(processor, system: Optional[str], content: List[dict]) -> List[int]:
+    return [processor.tokenizer.bos_token_id] + _encode(processor.tokenizer, _pieces(processor, system, content))
+
+
+def preload(processor):
+    # compares the spliced ids with apply_chat_template for every template on
+    # sample conversations with user text, an image and an audio clip, and
+    # for a free-form system prompt; this also fills the cache of fixed text
+    global _verified, _special
+    if not PRETOKENIZED_PROMPTS:
+        return
+    if not all(hasattr(processor, name) for name in ("full_image_sequence", "full_audio_sequence")):
+        return
+    import numpy as np
+    from PIL import Image
+
+    start = time.perf_counter()
+    markup = TURN_START + TURN_END + processor.full_image_sequence + processor.full_audio_sequence
+    tokens = sorted((t for t in processor.tokenizer.added_tokens_encoder if t in markup), key=len, reverse=True)
+    _special = re.compile("(" + "|".join(re.escape(t) for t in tokens) + ")")
+    image = Image.new("RGB", (64, 64))
+    audio = np.zeros(processor.feature_extractor.sampling_rate, dtype=np.float32)
+    # a free-form system prompt that does not match marks "<free-form>" as
+    # mismatched, which sends every non-template system prompt through the
+    # chat template
+    samples = [(None, None), ("<free-form>", "You are a careful assistant. Answer briefly.")]
+    samples += [(name, render(name, **SAMPLE_VALUES)) for name in TEMPLATES]
+    try:
+        for name, system in samples:
+            for user_text in SAMPLE_USER_TEXTS:
+                content = [{"type": "text", "text": user_text},
+                           {"type": "image", "image": image}, {"type": "audio", "audio": audio}]
+                messages = [{"role": "user", "content": content}]
+                if system is not None:
+                    messages.insert(0, {"role": "system", "content": [{"type": "text", "text": str(system)}]})
+                expected = processor.apply_chat_template(messages, tokenize=True, return_dict=True,
+                                                         add_generation_prompt=True)["input_ids"]
+                expected = list(expected[0] if expected and isinstance(expected[0], list) else expected)
+                if _input_ids(processor, system, content) == expected:
+                    continue
+                if name is None:
+                    # the conversation structure itself differs; nothing is spliced
+                    print("Pre-tokenized prompts do not match the chat template; using apply_chat_template")
+                    return
+                _mismatched.add(name)
+                break
+    except Exception as e:
+        print(f"Pre-tokenized prompts could not be checked, using apply_chat_template: {e}")
+        return
+    _verified = True
+    if _mismatched:
+        print(f"Templates using apply_chat_template (pre-tokenized ids differ): {sorted(_mismatched)}")
+    metrics.set_gauge("prompt.preload_seconds", time.perf_counter() - start)
+    metrics.set_gauge("prompt.mismatched_templates", len(_mismatched))
+    metrics.set_gauge("prompt.cached_texts", len(_fixed))
+
+
+def encode_messages(processor, raw_messages: List[dict]):
+    # BatchFeature for an optional system message plus one user message of
+    # text/image/audio items, or None when the conversation has another
+    # shape and the chat template has to render it
+    if not (PRETOKENIZED_PROMPTS and _verified):
+        return None
+    system, turns = None, raw_messages
+    if raw_messages and raw_messages[0]["role"] == "system":
+        system, turns = raw_messages[0]["content"][0]["text"], raw_messages[1:]
+        if len(raw_messages[0]["content"]) != 1:
+            return None
+    if len(turns) != 1 or turns[0]["role"] != "user":
+        return None
+    if any(item["type"] not in ("text", "image", "audio") for item in turns[0]["content"]):
+        return None
+    # a template that failed the startup check goes through the chat
+    # template; free-form system prompts only when every template passed
+    if isinstance(system, Prompt):
+        if system.name in _mismatched:
+            return None
+    elif system is not None and _mismatched:
+        return None
+
+    import torch
+    from transformers import BatchFeature
+    from transformers.audio_utils import load_audio
+    from transformers.image_utils import load_image
+
+    images, audios = [], []
+    for item in turns[0]["content"]:
+        if item["type"] == "image":
+            images.append(load_image(item["image"]))
+        elif item["type"] == "audio":
+            audios.append(load_audio(item["audio"], sampling_rate=processor.feature_extractor.sampling_rate))
+
+    input_ids = torch.tensor([_input_ids(processor, system, turns[0]["content"])], dtype=torch.long)
+    data = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+    if images:
+        data.update(processor.image_processor(images, return_tensors="pt"))
+    if audios:
+        data.update(processor.feature_extractor(audios, return_tensors="pt"))
+    return BatchFeature(data=data)
@@ -0,0 +1,168 @@
+# src/replicas.py
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Request, Response
+
+HEALTH_INTERVAL = 2.0
+PROXY_TIMEOUT = float(os.getenv("PROXY_TIMEOUT", "600"))
+# hop-by-hop headers are not forwarded in either direction
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "upgrade", "host", "content-length"}
+# replicas expire idle sessions after this long (the replicas' own setting);
+# the dispatcher forgets its affinity entry for them after the same time
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", "300"))
+
+
+def cpu_topology() -> List[List[int]]:
+    # physical cores available to this process as lists of their logical
+    # CPUs (hyperthread siblings), ordered by socket and core id
+    allowed = sorted(os.sched_getaffinity(0))
+    cores: Dict[tuple, List[int]] = {}
+    for cpu in allowed:
+        base = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(f"{base}/physical_package_id") as f:
+                socket = int(f.read())
+            with open(f"{base}/core_id") as f:
+                core = int(f.read())
+        except (OSError, ValueError):
+            socket, core = 0, cpu
+        cores.setdefault((socket, core), []).append(cpu)
+    return [cores[key] for key in sorted(cores)]
+
+
+def partition_cores(replicas: int, cores: Optional[List[List[int]]] = None) -> List[List[List[int]]]:
+    # contiguous runs of physical cores, so a replica stays on one socket
+    # whenever the replica count divides evenly into the sockets
+    cores = cores if cores is not None else cpu_topology()
+    if replicas > len(cores):
+        raise ValueError(f"{replicas} replicas requested but only {len(cores)} physical cores are available")
+    size, extra = divmod(len(cores), replicas)
+    parts, start = [], 0
+    for i in range(replicas):
+        end = start + size + (1 if i < extra else 0)
+        parts.append(cores[start:end])
+        start = end
+    return parts
+
+
+def launch_replicas(replicas: int, host: str, base_port: int) -> List[dict]:
+    # each replica is a uvicorn process pinned to its cores, with one
+    # intra-op thread per physical core; only the first runs the job worker
+    procs = []
+    for i, cores in enumerate(partition_cores(replicas)):
+        cpus = sorted(cpu for core in cores for cpu in core)
+        threads = str(len(cores))
+        env = {
+            **os.environ,
+            "OMP_NUM_THREADS": threads,
+            "MKL_NUM_THREADS": threads,
+            "TORCH_NUM_THREADS": threads,
+            "JOBS_WORKER": "1" if i == 0 else "0",
+        }
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", host, "--port", str(base_port + i), "--workers", "1"],
+            env=env,
+            preexec_fn=lambda cpus=cpus: os.sched_setaffinity(0, cpus),
+        )
+        print(f"Replica {i} on port {base_port + i}: pid {proc.pid}, cpus {cpus}, {threads} threads")
+        procs.append({"url": f"http://{host}:{base_port + i}", "process": proc, "cpus": cpus})
+    return procs
+
+
+def create_dispatcher(replica_urls: List[str]) -> FastAPI:
+    # forwards every request to the ready replica with the fewest requests
+    # in flight; session routes stick to the replica that owns the session
+    app = FastAPI(title="Gemma-3n Dispatcher")
+    state = {
+        "inflight": {url: 0 for url in replica_urls},
+        "ready": {url: False for url in replica_urls},
+        # session id -> [replica url, time.monotonic() of last use]
+        "sessions": {},
+        "order": itertools.count(),
+    }
+    client = httpx.AsyncClient(timeout=PROXY_TIMEOUT, limits=httpx.Limits(max_connections=None))
+
+    def forget_idle_sessions():
+        cutoff = time.monotonic() - SESSION_IDLE_SECONDS
+        for session_id in [sid for sid, (_, used) in state["sessions"].items() if used < cutoff]:
+            del state["sessions"][session_id]
+
+    async def watch_health():
+        while True:
+            forget_idle_sessions()
+            for url in replica_urls:
+                try:
+                    state["ready"][url] = (await client.get(f"{url}/health", timeout=2)).status_code == 200
+                except httpx.HTTPError:
+                    state["ready"][url] = False
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    @app.on_event("startup")
+    async def start_health_watch():
+        app.state.health_task = asyncio.create_task(watch_health())
+
+    @app.on_event("shutdown")
+    async def close_client():
+        app.state.health_task.cancel()
+        await client.aclose()
+
+    def session_of(path: str) -> Optional[str]:
+        parts = path.strip("/").split("/")
+        return parts[2] if parts[:2] == ["video", "sessions"] and len(parts) > 2 else None
+
+    def pick(path: str) -> Optional[str]:
+        entry = state["sessions"].get(session_of(path))
+        if entry is not None:
+            entry[1] = time.monotonic()
+            return entry[0]
+        ready = [url for url in replica_urls if state["ready"][url]]
+        if not ready:
+            return None
+        # ties rotate so idle replicas share the load
+        turn = next(state["order"])
+        return min(ready, key=lambda url: (state["inflight"][url], (replica_urls.index(url) - turn) % len(replica_urls)))
+
+    @app.get("/replicas")
+    async def replicas():
+        return {"replicas": [
+            {"url": url, "ready": state["ready"][url], "inflight": state["inflight"][url]} for url in replica_urls
+        ], "sessions": len(state["sessions"])}
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+    async def proxy(path: str, request: Request):
+        url = pick(request.url.path)
+        if url is None:
+            return Response('{"detail": "No replica is ready"}', status_code=503, media_type="application/json")
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+        state["inflight"][url] += 1
+        try:
+            upstream = await client.request(
+                request.method, f"{url}{request.url.path}", params=request.query_params,
+                headers=headers, content=await request.body(),
+            )
+        except httpx.HTTPError as e:
+            return Response(f'{{"detail": "Replica {url} failed: {e}"}}', status_code=502, media_type="application/json")
+        finally:
+            state["inflight"][url] -= 1
+
+        session_id = session_of(request.url.path)
+        if request.method == "POST" and request.url.path.rstrip("/") == "/video/sessions" and upstream.status_code == 200:
+            state["sessions"][upstream.json()["session_id"]] = [url, time.monotonic()]
+        elif session_id is not None and (request.method == "DELETE" or upstream.status_code == 404):
+            # closed, or already expired or lost on the replica
+            state["sessions"].pop(session_id, None)
+
+        return Response(
+            upstream.content,
+            status_code=upstream.status_code,
+            headers={k: v for k, v in upstream.headers.items() if k.lower() not in HOP_HEADERS | {"content-encoding"}},
+        )
+
+    return app
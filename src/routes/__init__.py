@@ -6,15 +6,29 @@ from .video import router as video_router
 from .multimodal import router as multimodal_router
 from .general import router as general_router
 from .object_detection import router as object_detection_router
+from .sessions import router as sessions_router
+from .admin import router as admin_router
+from .jobs import router as jobs_router
+from .embeddings import router as embeddings_router
 
 
-def register_routes(app: FastAPI):
-    app.include_router(audio_router)
-    app.include_router(vision_router)
-    app.include_router(video_router)
-    app.include_router(multimodal_router)
+# routers per serving mode; general, admin and embeddings routes are always
+# registered (embeddings reject media of a pruned modality)
+MODE_ROUTERS = {
+    "audio": [audio_router, jobs_router],
+    "image": [vision_router, object_detection_router],
+    "video": [vision_router, object_detection_router, video_router, sessions_router, jobs_router],
+    "multimodal": [audio_router, vision_router, video_router, multimodal_router,
+                   object_detection_router, sessions_router, jobs_router],
+}
+
+
+def register_routes(app: FastAPI, mode: str = "multimodal"):
+    for router in MODE_ROUTERS[mode]:
+        app.include_router(router)
     app.include_router(general_router)
-    app.include_router(object_detection_router)
+    app.include_router(admin_router)
+    app.include_router(embeddings_router)
 
 __all__ = [
     "register_routes",
@@ -23,6 +37,10 @@ __all__ = [
     "video_router",
     "multimodal_router",
     "general_router",
-    "object_detection_router"
+    "object_detection_router",
+    "sessions_router",
+    "admin_router",
+    "jobs_router",
+    "embeddings_router"
 ]
 
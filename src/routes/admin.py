@@ -0,0 +1,27 @@
+# src/routes/admin.py
+import asyncio
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from src import profiling
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get("/traces")
+async def list_traces():
+    return {
+        "sample_rate": profiling.PROFILE_SAMPLE_RATE,
+        "header_enabled": profiling.PROFILE_HEADER,
+        "directory": profiling.PROFILE_DIR,
+        "traces": await asyncio.to_thread(profiling.list_traces),
+    }
+
+
+@router.get("/traces/{name}")
+async def get_trace(name: str):
+    # name is a trace id (span trace) or a torch trace file name; both open
+    # in chrome://tracing or Perfetto
+    path = profiling.trace_path(name)
+    if path is None:
+        raise HTTPException(404, f"Unknown trace {name}")
+    return FileResponse(path, media_type="application/json", filename=name if name.endswith(".json") else f"{name}.json")
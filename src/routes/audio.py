@@ -1,6 +1,8 @@
 # src/routes/audio.py
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from src.core import generate_response
+from src.core import generate_response_async, DECODING_MODES
+from src.scheduler import AdmissionError
+from src.prompts import render
 from src.utils import save_to_temp, AUDIO_FILE_TYPES
 
 router = APIRouter(prefix="/audio", tags=["audio"])
@@ -11,12 +13,15 @@ async def audio_captioning(
     file: UploadFile = File(...),
     user_text: str = Form(""),
     max_new_tokens: int = Form(100),
+    decoding: str = Form(""),
 ):
+    if decoding and decoding not in DECODING_MODES:
+        raise HTTPException(400, f"decoding must be one of {DECODING_MODES}")
     if not file.filename.lower().endswith(AUDIO_FILE_TYPES):
         raise HTTPException(400, "Only audio files are supported")
     
     audio_path = save_to_temp(file)
-    system_prompt = "You are an expert audio analyst. Provide detailed, accurate captions describing the audio content including sounds, speech, music, environment, and any notable events or patterns you detect."
+    system_prompt = render("audio_caption")
     
     content = []
     if user_text:
@@ -29,8 +34,10 @@ async def audio_captioning(
     ]
     
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
+        reply = await generate_response_async(raw_msgs, max_new_tokens, decoding=decoding or None)
         return {"reply": reply, "task": "audio_captioning"}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=str(e))
 
@@ -45,7 +52,7 @@ async def audio_event_detection(
         raise HTTPException(400, "Only audio files are supported")
     
     audio_path = save_to_temp(file)
-    system_prompt = f"You are an expert audio event detector. Analyze the audio and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if the event is detected, 'NO' if it's not detected, followed by a brief explanation of what you hear."
+    system_prompt = render("audio_event", event_description=event_description)
     
     content = [{"type":"audio", "audio": audio_path}]
     
@@ -55,7 +62,9 @@ async def audio_event_detection(
     ]
     
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
+        reply = await generate_response_async(raw_msgs, max_new_tokens)
         return {"reply": reply, "task": "audio_event_detection", "event": event_description}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=str(e))
\ No newline at end of file
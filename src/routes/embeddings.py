@@ -0,0 +1,118 @@
+# src/routes/embeddings.py
+import asyncio
+import time
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from src.core import embed_media
+from src.scheduler import scheduler, estimate_cost, AdmissionError
+from src.vector_index import registry
+from src.utils import save_to_temp, decode_frames, TARGET_FPS, MAX_FRAMES, AUDIO_SAMPLE_RATE
+from src.utils import IMAGE_FILE_TYPES, AUDIO_FILE_TYPES, VIDEO_FILE_TYPES
+
+router = APIRouter(prefix="/embeddings", tags=["embeddings"])
+
+
+def _load_media(path: str, filename: str):
+    # (kind, media, timestamps); videos are sampled at TARGET_FPS and give
+    # one image embedding per frame
+    name = filename.lower()
+    if name.endswith(IMAGE_FILE_TYPES):
+        from PIL import Image
+        return "image", [Image.open(path).convert("RGB")], [None]
+    if name.endswith(VIDEO_FILE_TYPES):
+        frames = decode_frames(path, TARGET_FPS, MAX_FRAMES)
+        return "image", frames, [round(i / TARGET_FPS, 3) for i in range(len(frames))]
+    if name.endswith(AUDIO_FILE_TYPES):
+        import librosa
+        audio, _ = librosa.load(path, sr=AUDIO_SAMPLE_RATE, mono=True)
+        return "audio", [audio], [None]
+    raise HTTPException(400, f"Only {', '.join(IMAGE_FILE_TYPES + VIDEO_FILE_TYPES + AUDIO_FILE_TYPES)} files are supported")
+
+
+async def _embed(file: UploadFile):
+    # encoder forward passes only, admitted by the scheduler like a
+    # generation without any new tokens
+    path = save_to_temp(file)
+    kind, media, timestamps = await asyncio.to_thread(_load_media, path, file.filename)
+    if not media:
+        raise HTTPException(400, "No frames could be decoded")
+    async with scheduler.admit(estimate_cost([{"role": "user", "content": [{"type": kind}] * len(media)}], 0)):
+        vectors = await asyncio.to_thread(embed_media, kind, media)
+    return kind, vectors, timestamps
+
+
+@router.post("")
+async def create_embeddings(
+    file: UploadFile = File(...),
+    index: str = Form(""),
+    label: str = Form(""),
+    return_vectors: bool = Form(True),
+):
+    # with index, the vectors are also added to that index (created on
+    # first use) along with the file name, timestamp and label
+    try:
+        kind, vectors, timestamps = await _embed(file)
+        result = {"kind": kind, "dim": int(vectors.shape[1]), "count": len(vectors), "task": "embeddings"}
+        if return_vectors:
+            result["embeddings"] = [{"timestamp": ts, "vector": v.tolist()} for ts, v in zip(timestamps, vectors)]
+        if index:
+            metas = [{"kind": kind, "source": file.filename, "timestamp": ts, "label": label, "added": time.time()}
+                     for ts in timestamps]
+            result["index"] = index
+            result["ids"] = await asyncio.to_thread(registry.get(index, int(vectors.shape[1])).add, vectors, metas)
+        return result
+    except HTTPException:
+        raise
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
+
+
+@router.post("/search")
+async def search_embeddings(
+    file: UploadFile = File(...),
+    index: str = Form(...),
+    k: int = Form(10),
+    min_score: float = Form(0.0),
+):
+    # k nearest stored vectors of the same kind for every query vector (one
+    # per image or audio clip, one per sampled frame for videos)
+    try:
+        vector_index = registry.get(index)
+    except KeyError:
+        raise HTTPException(404, f"Unknown index {index}")
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    try:
+        kind, vectors, timestamps = await _embed(file)
+        matches = []
+        for ts, vector in zip(timestamps, vectors):
+            neighbors = await asyncio.to_thread(vector_index.search, vector, k, kind)
+            matches.append({"timestamp": ts, "neighbors": [n for n in neighbors if n["score"] >= min_score]})
+        return {"kind": kind, "index": index, "matches": matches, "task": "embedding_search"}
+    except HTTPException:
+        raise
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
+
+
+@router.get("/indexes")
+async def list_indexes():
+    return {"indexes": registry.list()}
+
+
+@router.delete("/indexes/{name}")
+async def delete_index(name: str):
+    try:
+        registry.delete(name)
+    except KeyError:
+        raise HTTPException(404, f"Unknown index {name}")
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    return {"deleted": name}
@@ -1,5 +1,7 @@
 # src/routes/general.py
 from fastapi import APIRouter
+from src import metrics
+from src.scheduler import scheduler
 
 router = APIRouter(tags=["general"])
 
@@ -18,13 +20,28 @@ async def list_endpoints():
             "/audio/event_detection - Detect specific events in audio",
             "/vision/image_classification - Classify images into categories",
             "/vision/image_event_detection - Detect specific events in images",
-            "/vision/image_change_detection - Compare two images for changes",
-            "/vision/bounding_box_detection - NOT IMPLEMENTED YET",
+            "/vision/image_change_detection - Compare two images (or a stored reference) for changes",
+            "/vision/references - Register, list and delete reference images for change detection",
+            "/vision/bounding_box_detection - Locate objects with tiled inference; optional box overlay",
             "/video/captioning - Generate captions for video content",
             "/video/event_detection - Detect specific events in video",
+            "/video/long_analysis - Windowed analysis of long videos with an event timeline",
+            "/video/event_localization - Per-frame event probabilities and the intervals where the event occurs",
+            "/video/sessions - Streaming sessions: push frames/audio incrementally and query at any time",
+            "/jobs - Queue long video/audio work; poll /jobs/{id} or receive a callback",
+            "/embeddings - Pooled vision/audio encoder embeddings, optionally added to a local vector index",
+            "/embeddings/search - Nearest stored frames/clips for uploaded media",
             "/multimodal/audio_vision - Combined audio and image analysis",
             "/multimodal/audio_video - Combined audio and video analysis",
             "/health - Health check",
+            "/metrics - Decoding and serving metrics",
+            "/admin/traces - Recent request traces (sampled, or X-Profile: 1 with PROFILE_HEADER=1)",
             "/endpoints - List all available endpoints"
         ]
-    }
\ No newline at end of file
+    }
+
+
+@router.get("/metrics")
+async def get_metrics():
+    metrics.set_gauge("process.rss_mb", round(metrics.rss_mb(), 1))
+    return {**metrics.snapshot(), "scheduler": scheduler.info()}
\ No newline at end of file
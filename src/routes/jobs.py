@@ -0,0 +1,80 @@
+# src/routes/jobs.py
+import asyncio
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from src.jobs import get_store, STATUSES, JOBS_MAX_ATTEMPTS
+from src.utils import save_to_temp, AUDIO_FILE_TYPES, VIDEO_FILE_TYPES
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+async def _submit(kind: str, file: UploadFile, file_types: tuple, user_text: str, max_new_tokens: int,
+                  callback_url: str, max_attempts: int):
+    if not file.filename.lower().endswith(file_types):
+        raise HTTPException(400, f"Only {', '.join(file_types)} files are supported")
+    # saving the upload, probing its duration and the SQLite insert all
+    # block; off the event loop
+    try:
+        job = await asyncio.to_thread(
+            lambda: get_store().submit(kind, save_to_temp(file),
+                                       {"user_text": user_text, "max_new_tokens": max_new_tokens},
+                                       callback_url, max_attempts)
+        )
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
+    return {"job_id": job["id"], "status": job["status"], "estimated_cost": job["cost"],
+            "estimated_wait": job.get("estimated_wait")}
+
+
+@router.post("/video/long_analysis")
+async def submit_long_analysis(
+    file: UploadFile = File(...),
+    user_text: str = Form(""),
+    max_new_tokens: int = Form(150),
+    callback_url: str = Form(""),
+    max_attempts: int = Form(JOBS_MAX_ATTEMPTS),
+):
+    return await _submit("video_long_analysis", file, VIDEO_FILE_TYPES, user_text, max_new_tokens, callback_url, max_attempts)
+
+
+@router.post("/video/captioning")
+async def submit_video_captioning(
+    file: UploadFile = File(...),
+    user_text: str = Form(""),
+    max_new_tokens: int = Form(150),
+    callback_url: str = Form(""),
+    max_attempts: int = Form(JOBS_MAX_ATTEMPTS),
+):
+    return await _submit("video_captioning", file, VIDEO_FILE_TYPES, user_text, max_new_tokens, callback_url, max_attempts)
+
+
+@router.post("/audio/captioning")
+async def submit_audio_captioning(
+    file: UploadFile = File(...),
+    user_text: str = Form(""),
+    max_new_tokens: int = Form(100),
+    callback_url: str = Form(""),
+    max_attempts: int = Form(JOBS_MAX_ATTEMPTS),
+):
+    return await _submit("audio_captioning", file, AUDIO_FILE_TYPES, user_text, max_new_tokens, callback_url, max_attempts)
+
+
+@router.get("")
+async def list_jobs(status: str = "", limit: int = 100):
+    if status and status not in STATUSES:
+        raise HTTPException(400, f"status must be one of {STATUSES}")
+    return {"jobs": get_store().list(status, limit)}
+
+
+@router.get("/{job_id}")
+async def job_status(job_id: str):
+    job = get_store().get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Unknown or expired job {job_id}")
+    return job
+
+
+@router.delete("/{job_id}")
+async def delete_job(job_id: str):
+    if not get_store().delete(job_id):
+        raise HTTPException(404, f"Unknown or expired job {job_id}")
+    return {"deleted": job_id}
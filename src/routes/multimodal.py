@@ -2,7 +2,9 @@
 import pathlib
 from typing import List
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from src.core import generate_response
+from src.core import generate_response_async, DECODING_MODES
+from src.scheduler import AdmissionError
+from src.prompts import render
 from src.utils import (
     save_to_temp, 
     extract_frames_to_tempdir,
@@ -23,7 +25,10 @@ async def chat_multimodal(
     user_text: str          = Form(""),
     files: List[UploadFile] = File([]),
     max_new_tokens: int     = Form(50),
+    decoding: str           = Form(""),
 ):
+    if decoding and decoding not in DECODING_MODES:
+        raise HTTPException(400, f"decoding must be one of {DECODING_MODES}")
     paths = [save_to_temp(f) for f in files]
 
     video_paths = [p for p in paths if pathlib.Path(p).suffix.lower() in VIDEO_FILE_TYPES]
@@ -58,8 +63,10 @@ async def chat_multimodal(
     ]
 
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
+        reply = await generate_response_async(raw_msgs, max_new_tokens, decoding=decoding or None)
         return {"reply": reply}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=str(e))
 
@@ -70,7 +77,10 @@ async def audio_vision_understanding(
     image_file: UploadFile = File(...),
     user_text: str = Form(""),
     max_new_tokens: int = Form(150),
+    decoding: str = Form(""),
 ):
+    if decoding and decoding not in DECODING_MODES:
+        raise HTTPException(400, f"decoding must be one of {DECODING_MODES}")
     if not audio_file.filename.lower().endswith(AUDIO_FILE_TYPES):
         raise HTTPException(400, "Audio file must be in supported format")
     if not image_file.filename.lower().endswith(IMAGE_FILE_TYPES):
@@ -79,7 +89,7 @@ async def audio_vision_understanding(
     audio_path = save_to_temp(audio_file)
     image_path = save_to_temp(image_file)
     
-    system_prompt = "You are an expert multimodal analyst. Analyze both the audio and visual information provided to create a comprehensive understanding of the environment and situation. Correlate information from both modalities to provide insights that wouldn't be possible from either alone. Describe the scene, events, context, and any relationships between what you hear and see."
+    system_prompt = render("audio_vision")
     
     content = []
     if user_text:
@@ -95,8 +105,10 @@ async def audio_vision_understanding(
     ]
     
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
+        reply = await generate_response_async(raw_msgs, max_new_tokens, decoding=decoding or None)
         return {"reply": reply, "task": "multimodal_audio_vision"}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=str(e))
 
@@ -107,7 +119,10 @@ async def audio_video_understanding(
     video_file: UploadFile = File(...),
     user_text: str = Form(""),
     max_new_tokens: int = Form(200),
+    decoding: str = Form(""),
 ):
+    if decoding and decoding not in DECODING_MODES:
+        raise HTTPException(400, f"decoding must be one of {DECODING_MODES}")
     if not audio_file.filename.lower().endswith(AUDIO_FILE_TYPES):
         raise HTTPException(400, "Audio file must be in supported format")
     if not video_file.filename.lower().endswith(VIDEO_FILE_TYPES):
@@ -116,7 +131,7 @@ async def audio_video_understanding(
     audio_path = save_to_temp(audio_file)
     video_path = save_to_temp(video_file)
     
-    system_prompt = "You are an expert multimodal analyst. Analyze both the audio and video information provided to create a comprehensive understanding of the environment and situation. Correlate information from both modalities, including temporal alignment between audio and visual events. Describe the scene, events, context, and any relationships between what you hear and see over time."
+    system_prompt = render("audio_video")
     
     frame_dir = extract_frames_to_tempdir(
         video_path,
@@ -139,7 +154,9 @@ async def audio_video_understanding(
     ]
     
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
+        reply = await generate_response_async(raw_msgs, max_new_tokens, decoding=decoding or None)
         return {"reply": reply, "task": "multimodal_audio_video"}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=str(e))
\ No newline at end of file
@@ -1,32 +1,43 @@
 # src/routes/bounding_box_detection.py
 
-import json
-import base64
-from io import BytesIO
-from typing import Optional
+import asyncio
+import os
+import uuid
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, UploadFile, File, Form
+from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field
-from PIL import Image, ImageDraw
+from PIL import Image
 
-from src.core import generate_response
-from src.utils import save_to_temp, IMAGE_FILE_TYPES
+from src.detection import detect_objects, estimate_detection_cost, render_overlay
+from src.scheduler import scheduler, AdmissionError
+from src.utils import save_to_temp, IMAGE_FILE_TYPES, TEMP_DIR
 
 router = APIRouter(prefix="/vision", tags=["vision"])
 
+OVERLAY_DIR = os.path.join(TEMP_DIR, "gemma3n_overlays")
+# newest overlays kept on disk; older ones are deleted as new ones land
+OVERLAY_KEEP = int(os.getenv("OVERLAY_KEEP", "100"))
+
 class BBox(BaseModel):
     x_min: float
     y_min: float
     x_max: float
     y_max: float
 
+class Detection(BaseModel):
+    bbox: BBox
+    confidence: float = Field(..., ge=0.0, le=1.0)
+
 class BoundingBoxDetectionResponse(BaseModel):
     task: str = Field("bounding_box_detection", Literal=True)
     object: str
     detected: bool
     confidence: float = Field(..., ge=0.0, le=1.0)
     bbox: Optional[BBox] = None
+    detections: List[Detection] = []
+    tiles: int = 1
     image_with_boxes: Optional[str] = None   
 
 @router.post(
@@ -34,9 +45,87 @@ class BoundingBoxDetectionResponse(BaseModel):
     response_model=BoundingBoxDetectionResponse,
 )
 async def bounding_box_detection(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     object_name: str = Form(...),
     max_new_tokens: int = Form(150),
     draw_boxes: bool = Form(False),
 ):
-    raise NotImplementedError("Bounding box detection is not implemented yet.")
\ No newline at end of file
+    # boxes are in pixels of the uploaded image; bbox/confidence are the best
+    # detection. With draw_boxes the overlay is rendered after the response is
+    # sent and image_with_boxes is the URL to fetch it from
+    if not file.filename.lower().endswith(IMAGE_FILE_TYPES):
+        raise HTTPException(400, "Only image files are supported")
+
+    image_path = save_to_temp(file)
+
+    try:
+        image = await asyncio.to_thread(lambda: Image.open(image_path).convert("RGB"))
+        # admitted once for all tiles; the batched generate calls run in a
+        # worker thread
+        async with scheduler.admit(estimate_detection_cost(*image.size, max_new_tokens)):
+            result = await asyncio.to_thread(detect_objects, image, object_name, max_new_tokens)
+    except AdmissionError as e:
+        _remove(image_path)
+        raise HTTPException(e.status_code, detail=str(e))
+    except Exception as e:
+        _remove(image_path)
+        raise HTTPException(500, detail=str(e))
+
+    detections = result["detections"]
+    best = max(detections, key=lambda d: d["confidence"], default=None)
+
+    overlay_url = None
+    if draw_boxes:
+        overlay_id = uuid.uuid4().hex
+        os.makedirs(OVERLAY_DIR, exist_ok=True)
+        background_tasks.add_task(_render, image_path, detections, os.path.join(OVERLAY_DIR, f"{overlay_id}.jpg"))
+        overlay_url = f"/vision/bounding_box_detection/overlay/{overlay_id}"
+    else:
+        _remove(image_path)
+
+    return BoundingBoxDetectionResponse(
+        object=object_name,
+        detected=bool(detections),
+        confidence=best["confidence"] if best else 0.0,
+        bbox=best["bbox"] if best else None,
+        detections=detections,
+        tiles=result["tiles"],
+        image_with_boxes=overlay_url,
+    )
+
+
+def _render(image_path: str, detections: List[dict], out_path: str):
+    # background task: the upload is only needed until the overlay exists
+    try:
+        render_overlay(image_path, detections, out_path)
+    finally:
+        _remove(image_path)
+        _rotate_overlays()
+
+
+def _rotate_overlays():
+    overlays = []
+    for f in os.listdir(OVERLAY_DIR):
+        try:
+            overlays.append((os.path.getmtime(os.path.join(OVERLAY_DIR, f)), f))
+        except FileNotFoundError:
+            continue
+    overlays.sort()
+    for _, f in overlays[:-OVERLAY_KEEP] if len(overlays) > OVERLAY_KEEP else []:
+        _remove(os.path.join(OVERLAY_DIR, f))
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@router.get("/bounding_box_detection/overlay/{overlay_id}")
+async def bounding_box_overlay(overlay_id: str):
+    path = os.path.join(OVERLAY_DIR, f"{os.path.basename(overlay_id)}.jpg")
+    if not os.path.exists(path):
+        raise HTTPException(404, "Overlay not found or not rendered yet")
+    return FileResponse(path, media_type="image/jpeg")
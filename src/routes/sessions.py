@@ -0,0 +1,156 @@
+# src/routes/sessions.py
+import asyncio
+import pathlib
+import time
+from typing import List
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from src.core import model_lock
+from src.scheduler import scheduler, estimate_cost, AdmissionError
+from src.sessions import manager, SessionLimitError, DEFAULT_SESSION_PROMPT
+from src.utils import (
+    save_to_temp,
+    extract_frames_to_tempdir,
+    to_model_audio,
+    AUDIO_FILE_TYPES,
+    IMAGE_FILE_TYPES,
+    VIDEO_FILE_TYPES,
+    AUDIO_SAMPLE_RATE,
+    TARGET_FPS,
+    MAX_FRAMES,
+    TEMP_DIR
+)
+
+router = APIRouter(prefix="/video/sessions", tags=["video"])
+
+
+def _get_session(session_id: str):
+    try:
+        return manager.get(session_id)
+    except KeyError:
+        raise HTTPException(404, f"Unknown or expired session {session_id}")
+
+
+@router.post("")
+async def create_session(
+    system_prompt: str = Form(""),
+):
+    # the system prompt is prefilled into the session's cache, so creation
+    # is admitted like any other model work and runs in a worker thread
+    text = [{"role": "system", "content": [{"type": "text", "text": system_prompt or DEFAULT_SESSION_PROMPT}]}]
+    try:
+        async with scheduler.admit(estimate_cost(text, 0)):
+            session = await asyncio.to_thread(manager.create, system_prompt or None)
+    except SessionLimitError as e:
+        raise HTTPException(429, detail=str(e))
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
+    return session.info()
+
+
+@router.get("")
+async def list_sessions():
+    return {"sessions": manager.list()}
+
+
+@router.get("/{session_id}")
+async def session_info(session_id: str):
+    return _get_session(session_id).info()
+
+
+@router.delete("/{session_id}")
+async def close_session(session_id: str):
+    try:
+        manager.close(session_id)
+    except KeyError:
+        raise HTTPException(404, f"Unknown or expired session {session_id}")
+    return {"closed": session_id}
+
+
+@router.post("/{session_id}/media")
+async def push_media(
+    session_id: str,
+    files: List[UploadFile] = File(...),
+    timestamp: float = Form(-1.0),
+):
+    # images are appended as single frames, videos are sampled at TARGET_FPS
+    # and audio clips are appended whole; timestamp defaults to seconds since
+    # the session was created
+    session = _get_session(session_id)
+    ts = timestamp if timestamp >= 0 else time.time() - session.created
+
+    uploads = []
+    for f in files:
+        name = f.filename.lower()
+        if not name.endswith(IMAGE_FILE_TYPES + VIDEO_FILE_TYPES + AUDIO_FILE_TYPES):
+            raise HTTPException(400, f"Unsupported file type {pathlib.Path(name).suffix}")
+        uploads.append((name, save_to_temp(f)))
+
+    try:
+        chunks = await asyncio.to_thread(_load_chunks, uploads, ts)
+        async with scheduler.admit(estimate_cost([{"role": "user", "content": [{"type": kind} for kind, _, _ in chunks]}], 0)):
+            await asyncio.to_thread(_append_chunks, session, chunks)
+        return {**session.info(), "appended": len(chunks)}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
+
+
+def _load_chunks(uploads, ts: float):
+    # decoded in a worker thread; (kind, data, timestamp) per chunk
+    from PIL import Image
+    chunks = []
+    for name, path in uploads:
+        if name.endswith(IMAGE_FILE_TYPES):
+            chunks.append(("image", Image.open(path).convert("RGB"), ts))
+        elif name.endswith(VIDEO_FILE_TYPES):
+            frame_dir = extract_frames_to_tempdir(
+                path,
+                target_fps=TARGET_FPS,
+                max_frames=MAX_FRAMES,
+                parent_dir=TEMP_DIR,
+            )
+            for i, frame in enumerate(sorted(pathlib.Path(frame_dir).glob("*.jpg"))):
+                chunks.append(("image", Image.open(frame).convert("RGB"), ts + i / TARGET_FPS))
+        else:
+            import librosa
+            audio, sr = librosa.load(path, sr=AUDIO_SAMPLE_RATE, mono=True)
+            chunks.append(("audio", to_model_audio(audio, sr), ts))
+    return chunks
+
+
+def _append_chunks(session, chunks):
+    with session.lock, model_lock:
+        for kind, data, chunk_ts in chunks:
+            session.append(kind, data, chunk_ts)
+
+
+def _query(session, question: str, max_new_tokens: int) -> str:
+    with session.lock, model_lock:
+        return session.query(question, max_new_tokens)
+
+
+@router.post("/{session_id}/query")
+async def query_session(
+    session_id: str,
+    question: str = Form(...),
+    max_new_tokens: int = Form(100),
+):
+    session = _get_session(session_id)
+    # the media is already in the session's cache; only the question is
+    # prefilled
+    text = [{"role": "user", "content": [{"type": "text", "text": question}]}]
+    try:
+        async with scheduler.admit(estimate_cost(text, max_new_tokens)):
+            reply = await asyncio.to_thread(_query, session, question, max_new_tokens)
+        return {"reply": reply, "task": "video_session_query", **session.info()}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
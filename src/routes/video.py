@@ -1,7 +1,12 @@
 # src/routes/video.py
+import asyncio
 import pathlib
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from src.core import generate_response
+from src.core import generate_response_async, DECODING_MODES
+from src.scheduler import scheduler, AdmissionError
+from src.prompts import render
+from src.long_video import analyze_long_video, estimate_long_video_cost
+from src.localization import localize_event, estimate_localization_cost, LOCALIZE_FPS
 from src.utils import save_to_temp, extract_frames_to_tempdir, VIDEO_FILE_TYPES, TARGET_FPS, MAX_FRAMES, TEMP_DIR
 
 router = APIRouter(prefix="/video", tags=["video"])
@@ -12,12 +17,15 @@ async def video_captioning(
     file: UploadFile = File(...),
     user_text: str = Form(""),
     max_new_tokens: int = Form(150),
+    decoding: str = Form(""),
 ):
+    if decoding and decoding not in DECODING_MODES:
+        raise HTTPException(400, f"decoding must be one of {DECODING_MODES}")
     if not file.filename.lower().endswith(VIDEO_FILE_TYPES):
         raise HTTPException(400, "Only video files are supported")
     
     video_path = save_to_temp(file)
-    system_prompt = "You are an expert video analyst. Provide detailed, accurate captions describing the video content including actions, scenes, objects, people, and any notable events or patterns. Describe the temporal progression of events."
+    system_prompt = render("video_caption")
     
     frame_dir = extract_frames_to_tempdir(
         video_path,
@@ -39,8 +47,10 @@ async def video_captioning(
     ]
     
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
+        reply = await generate_response_async(raw_msgs, max_new_tokens, decoding=decoding or None)
         return {"reply": reply, "task": "video_captioning"}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=str(e))
 
@@ -55,7 +65,7 @@ async def video_event_detection(
         raise HTTPException(400, "Only video files are supported")
     
     video_path = save_to_temp(file)
-    system_prompt = f"You are an expert video event detector. Analyze the video frames and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if the event is detected, 'NO' if it's not detected, followed by a detailed explanation of what you see in the video and when/where the event occurs if detected."
+    system_prompt = render("video_event", event_description=event_description)
     
     frame_dir = extract_frames_to_tempdir(
         video_path,
@@ -74,7 +84,68 @@ async def video_event_detection(
     ]
     
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
+        reply = await generate_response_async(raw_msgs, max_new_tokens)
         return {"reply": reply, "task": "video_event_detection", "event": event_description}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
-        raise HTTPException(500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(500, detail=str(e))
+
+
+@router.post("/long_analysis")
+async def video_long_analysis(
+    file: UploadFile = File(...),
+    user_text: str = Form(""),
+    max_new_tokens: int = Form(150),
+):
+    if not file.filename.lower().endswith(VIDEO_FILE_TYPES):
+        raise HTTPException(400, "Only video files are supported")
+    
+    video_path = save_to_temp(file)
+    
+    try:
+        # admitted once for the whole analysis, which runs many batched
+        # generate calls in a worker thread
+        async with scheduler.admit(estimate_long_video_cost(video_path, max_new_tokens)):
+            result = await asyncio.to_thread(analyze_long_video, video_path, user_text, max_new_tokens)
+        return {"reply": result["summary"], "timeline": result["timeline"], "task": "video_long_analysis"}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
+
+
+@router.post("/event_localization")
+async def video_event_localization(
+    file: UploadFile = File(...),
+    event_description: str = Form(...),
+    fps: float = Form(LOCALIZE_FPS),
+    window_frames: int = Form(1),
+    threshold: float = Form(0.5),
+    max_gap: float = Form(1.0),
+    min_duration: float = Form(0.0),
+):
+    # per-window probability that the event is happening plus the merged
+    # intervals where it is; each window costs one batched prefill and no
+    # decoding
+    if not file.filename.lower().endswith(VIDEO_FILE_TYPES):
+        raise HTTPException(400, "Only video files are supported")
+    if fps <= 0 or window_frames < 1:
+        raise HTTPException(400, "fps must be positive and window_frames at least 1")
+    
+    video_path = save_to_temp(file)
+    
+    try:
+        async with scheduler.admit(estimate_localization_cost(video_path, fps, window_frames)):
+            result = await asyncio.to_thread(
+                localize_event, video_path, event_description, fps, window_frames, threshold, max_gap, min_duration
+            )
+        return {**result, "task": "video_event_localization", "event": event_description}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
@@ -1,6 +1,12 @@
 # src/routes/vision.py
+import asyncio
+from typing import Optional
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from src.core import generate_response
+from PIL import Image
+from src.core import generate_response_async
+from src.scheduler import AdmissionError
+from src.prompts import render
+from src.change_detection import registry, image_features, diff_features, crop_region, CHANGE_THRESHOLD
 from src.utils import save_to_temp, IMAGE_FILE_TYPES
 
 router = APIRouter(prefix="/vision", tags=["vision"])
@@ -18,9 +24,9 @@ async def image_classification(
     image_path = save_to_temp(file)
     
     if categories:
-        system_prompt = f"You are an expert image classifier. Classify this image into one of the following categories: {categories}. Respond with the most appropriate category and a brief explanation."
+        system_prompt = render("image_classification_categories", categories=categories)
     else:
-        system_prompt = "You are an expert image classifier. Analyze this image and provide a detailed classification including the main subject, scene type, and any notable features."
+        system_prompt = render("image_classification")
     
     content = [{"type":"image", "image": image_path}]
     
@@ -30,8 +36,10 @@ async def image_classification(
     ]
     
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
+        reply = await generate_response_async(raw_msgs, max_new_tokens)
         return {"reply": reply, "task": "image_classification"}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=str(e))
 
@@ -46,7 +54,7 @@ async def image_event_detection(
         raise HTTPException(400, "Only image files are supported")
     
     image_path = save_to_temp(file)
-    system_prompt = f"You are an expert image event detector. Analyze the image and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if the event is detected, 'NO' if it's not detected, followed by a brief explanation of what you see."
+    system_prompt = render("image_event", event_description=event_description)
     
     content = [{"type":"image", "image": image_path}]
     
@@ -56,31 +64,66 @@ async def image_event_detection(
     ]
     
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
+        reply = await generate_response_async(raw_msgs, max_new_tokens)
         return {"reply": reply, "task": "image_event_detection", "event": event_description}
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=str(e))
 
 
 @router.post("/image_change_detection")
 async def image_change_detection(
-    file1: UploadFile = File(...),
+    file1: Optional[UploadFile] = File(None),
     file2: UploadFile = File(...),
+    reference_id: str = Form(""),
+    change_threshold: float = Form(CHANGE_THRESHOLD),
     max_new_tokens: int = Form(100),
 ):
-    if not (file1.filename.lower().endswith(IMAGE_FILE_TYPES) and 
-            file2.filename.lower().endswith(IMAGE_FILE_TYPES)):
+    # file1 (or the stored reference named by reference_id) is the baseline;
+    # a pixel-level diff runs first and the model is only called when the
+    # changed share of the image exceeds change_threshold
+    if file1 is None and not reference_id:
+        raise HTTPException(400, "Provide file1 or reference_id")
+    if not (file2.filename.lower().endswith(IMAGE_FILE_TYPES) and
+            (file1 is None or file1.filename.lower().endswith(IMAGE_FILE_TYPES))):
         raise HTTPException(400, "Only image files are supported")
-    
-    image1_path = save_to_temp(file1)
+
+    if reference_id:
+        try:
+            reference = registry.get(reference_id)
+        except KeyError:
+            raise HTTPException(404, f"Unknown reference {reference_id}")
+        image1_path, ref_features = reference["image"], reference["features"]
+    else:
+        image1_path = save_to_temp(file1)
+        ref_features = None
     image2_path = save_to_temp(file2)
-    
-    system_prompt = "You are an expert in image comparison and change detection. Compare these two images and identify what has changed between them. Describe any differences in objects, positions, appearances, or scenes. Be specific about what was added, removed, or modified."
+
+    # decoding, alignment and the diff are NumPy work; off the event loop
+    image1, image2, diff = await asyncio.to_thread(_pixel_diff, image1_path, image2_path, ref_features)
+
+    if diff["score"] < change_threshold:
+        return {
+            "reply": "No significant change detected.",
+            "task": "image_change_detection",
+            "changed": False,
+            "change_score": diff["score"],
+            "regions": [],
+        }
+
+    system_prompt = render("image_change")
     
     content = [
         {"type":"image", "image": image1_path},
         {"type":"image", "image": image2_path}
     ]
+    for i, region in enumerate(diff["regions"], 1):
+        content += [
+            {"type":"text", "text": f"Changed region {i}, before and after:"},
+            {"type":"image", "image": crop_region(image1, region)},
+            {"type":"image", "image": crop_region(image2, region)},
+        ]
     
     raw_msgs = [
         {"role":"system", "content":[{"type":"text","text":system_prompt}]},
@@ -88,7 +131,50 @@ async def image_change_detection(
     ]
     
     try:
-        reply = generate_response(raw_msgs, max_new_tokens)
-        return {"reply": reply, "task": "image_change_detection"}
+        reply = await generate_response_async(raw_msgs, max_new_tokens)
+        return {
+            "reply": reply,
+            "task": "image_change_detection",
+            "changed": True,
+            "change_score": diff["score"],
+            "regions": diff["regions"],
+        }
+    except AdmissionError as e:
+        raise HTTPException(e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(500, detail=str(e))
+
+
+def _pixel_diff(image1_path: str, image2_path: str, ref_features=None):
+    image1 = Image.open(image1_path).convert("RGB")
+    image2 = Image.open(image2_path).convert("RGB")
+    if ref_features is None:
+        ref_features = image_features(image1)
+    return image1, image2, diff_features(ref_features, image_features(image2, size=ref_features.shape[::-1]))
+
+
+@router.post("/references")
+async def add_reference(
+    file: UploadFile = File(...),
+    name: str = Form(""),
+):
+    if not file.filename.lower().endswith(IMAGE_FILE_TYPES):
+        raise HTTPException(400, "Only image files are supported")
+    try:
+        return await asyncio.to_thread(registry.add, save_to_temp(file), name)
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
+
+
+@router.get("/references")
+async def list_references():
+    return {"references": registry.list()}
+
+
+@router.delete("/references/{reference_id}")
+async def delete_reference(reference_id: str):
+    try:
+        registry.delete(reference_id)
+    except KeyError:
+        raise HTTPException(404, f"Unknown reference {reference_id}")
+    return {"deleted": reference_id}
@@ -0,0 +1,183 @@
+# src/scheduler.py
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from src import metrics
+
+# lower rank is served first; within a class requests are served in arrival order
+PRIORITY_CLASSES = {"realtime": 0, "interactive": 1, "bulk": 2}
+DEFAULT_PRIORITY = "interactive"
+
+# alarm-style yes/no routes go first, long captions last; other routes are
+# interactive. The X-Priority header overrides the route default
+ROUTE_PRIORITIES = {
+    "/audio/event_detection": "realtime",
+    "/vision/image_event_detection": "realtime",
+    "/vision/image_change_detection": "realtime",
+    "/video/event_detection": "realtime",
+    "/audio/captioning": "bulk",
+    "/video/captioning": "bulk",
+    "/multimodal/": "bulk",
+    "/multimodal/audio_vision": "bulk",
+    "/multimodal/audio_video": "bulk",
+}
+
+# generations allowed to run at once; the model itself is serialized, so
+# more than one slot only overlaps request setup
+MODEL_SLOTS = int(os.getenv("MODEL_SLOTS", "1"))
+# queued plus running requests allowed per class, e.g. "realtime=16,bulk=2"
+CLASS_LIMITS = dict(
+    {"realtime": 16, "interactive": 8, "bulk": 4},
+    **{k: int(v) for k, v in (item.split("=") for item in os.getenv("SCHEDULER_LIMITS", "").split(",") if item)}
+)
+
+# cost model: prompt tokens are prefilled at PREFILL_TOKENS_PER_SEC and new
+# tokens decoded at the measured plain decode rate (DECODE_TOKENS_PER_SEC
+# until something has been measured)
+IMAGE_TOKENS = 256
+AUDIO_TOKENS = 188
+PREFILL_TOKENS_PER_SEC = float(os.getenv("PREFILL_TOKENS_PER_SEC", "2000"))
+DECODE_TOKENS_PER_SEC = float(os.getenv("DECODE_TOKENS_PER_SEC", "20"))
+
+
+class AdmissionError(Exception):
+    # status_code is 429 when a class is at its limit and 503 when the
+    # request cannot finish before its deadline
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class RequestContext:
+    priority: str = DEFAULT_PRIORITY
+    deadline: Optional[float] = None   # time.monotonic() value
+
+
+current = contextvars.ContextVar("request_context", default=RequestContext())
+
+
+async def request_context(request, call_next):
+    # HTTP middleware: X-Priority picks the class, X-Deadline-Ms is the time
+    # budget for the whole request in milliseconds
+    priority = request.headers.get("x-priority", "").lower()
+    if priority not in PRIORITY_CLASSES:
+        priority = ROUTE_PRIORITIES.get(request.url.path, DEFAULT_PRIORITY)
+    deadline = None
+    try:
+        deadline = time.monotonic() + float(request.headers["x-deadline-ms"]) / 1000
+    except (KeyError, ValueError):
+        pass
+    token = current.set(RequestContext(priority, deadline))
+    try:
+        return await call_next(request)
+    finally:
+        current.reset(token)
+
+
+def estimate_cost(raw_messages: List[dict], max_new_tokens: int) -> float:
+    # rough seconds of model time for a request, without tokenizing it
+    prompt_tokens = 0
+    for msg in raw_messages:
+        for item in msg["content"]:
+            if item["type"] == "text":
+                prompt_tokens += len(item["text"]) // 4 + 1
+            elif item["type"] == "image":
+                prompt_tokens += IMAGE_TOKENS
+            elif item["type"] == "audio":
+                prompt_tokens += AUDIO_TOKENS
+    decode_rate = metrics.mean("decode.plain.tokens_per_sec") or DECODE_TOKENS_PER_SEC
+    return prompt_tokens / PREFILL_TOKENS_PER_SEC + max_new_tokens / decode_rate
+
+
+@dataclass(order=True)
+class _Ticket:
+    rank: int
+    seq: int
+    cost: float = field(compare=False)
+    priority: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    started: float = field(default=0.0, compare=False)
+
+
+class Scheduler:
+
+    def __init__(self, slots: int = MODEL_SLOTS, limits: Dict[str, int] = CLASS_LIMITS):
+        self.slots = slots
+        self.limits = limits
+        self.queue: List[_Ticket] = []
+        self.running: List[_Ticket] = []
+        self.outstanding = {name: 0 for name in PRIORITY_CLASSES}
+        self.seq = itertools.count()
+
+    def estimated_wait(self, rank: int) -> float:
+        # remaining work of running requests plus everything queued at the
+        # same or a higher priority, spread over the slots
+        now = time.monotonic()
+        running = sum(max(0.0, t.cost - (now - t.started)) for t in self.running)
+        if len(self.running) < self.slots:
+            running = 0.0
+        ahead = sum(t.cost for t in self.queue if t.rank <= rank and not t.future.done())
+        return (running + ahead) / self.slots
+
+    def _dispatch(self):
+        while self.queue and len(self.running) < self.slots:
+            ticket = heapq.heappop(self.queue)
+            if ticket.future.done():
+                continue
+            ticket.started = time.monotonic()
+            self.running.append(ticket)
+            ticket.future.set_result(None)
+
+    @asynccontextmanager
+    async def admit(self, cost: float):
+        # waits for a model slot in priority order; raises AdmissionError
+        # instead of queueing when the class is full or the deadline is
+        # already out of reach
+        ctx = current.get()
+        rank = PRIORITY_CLASSES[ctx.priority]
+        if self.outstanding[ctx.priority] >= self.limits.get(ctx.priority, 1):
+            metrics.incr(f"scheduler.{ctx.priority}.rejected_limit")
+            raise AdmissionError(429, f"Too many {ctx.priority} requests in flight ({self.limits.get(ctx.priority, 1)}); retry later")
+        wait = self.estimated_wait(rank)
+        if ctx.deadline is not None and time.monotonic() + wait + cost > ctx.deadline:
+            metrics.incr(f"scheduler.{ctx.priority}.rejected_deadline")
+            raise AdmissionError(503, f"Estimated completion in {wait + cost:.1f}s exceeds the request deadline")
+
+        ticket = _Ticket(rank, next(self.seq), cost, ctx.priority, asyncio.get_running_loop().create_future())
+        self.outstanding[ctx.priority] += 1
+        queued_at = time.monotonic()
+        heapq.heappush(self.queue, ticket)
+        self._dispatch()
+        try:
+            await ticket.future
+            metrics.observe(f"scheduler.{ctx.priority}.queue_seconds", time.monotonic() - queued_at)
+            yield
+        finally:
+            self.outstanding[ctx.priority] -= 1
+            if ticket in self.running:
+                self.running.remove(ticket)
+            elif not ticket.future.done():
+                ticket.future.cancel()
+            self._dispatch()
+
+    def info(self) -> dict:
+        return {
+            "slots": self.slots,
+            "running": len(self.running),
+            "queued": len([t for t in self.queue if not t.future.done()]),
+            "outstanding": dict(self.outstanding),
+            "limits": dict(self.limits),
+            "estimated_wait": {name: round(self.estimated_wait(rank), 2) for name, rank in PRIORITY_CLASSES.items()},
+        }
+
+
+scheduler = Scheduler()
@@ -0,0 +1,209 @@
+# src/sessions.py
+import asyncio
+import copy
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Optional
+
+import src.core as core
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "4"))
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", "300"))
+SESSION_WINDOW = int(os.getenv("SESSION_WINDOW", "16"))
+SESSION_EVICT = int(os.getenv("SESSION_EVICT", "8"))
+SESSION_SWEEP_SECONDS = int(os.getenv("SESSION_SWEEP_SECONDS", "30"))
+
+DEFAULT_SESSION_PROMPT = "You are an expert video analyst monitoring a live camera feed. Frames and audio clips arrive in chronological order, each labelled with its capture time. Answer questions about what is happening using only the media you have seen."
+
+# Gemma turn markup; the user turn stays open while media is streamed in and
+# each query closes it on a throwaway copy of the cache
+TURN_START = "<start_of_turn>user\n"
+TURN_END = "<end_of_turn>\n<start_of_turn>model\n"
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class Session:
+    # a persistent conversation whose KV cache covers the system prompt and
+    # every media chunk in the sliding window; new chunks are encoded and
+    # appended to the cache without touching the earlier ones
+
+    def __init__(self, system_prompt: str):
+        self.id = uuid.uuid4().hex
+        self.system_prompt = system_prompt
+        self.created = time.time()
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        self.chunks = deque()
+        self.input_ids = None
+        self.cache = None
+        self.evictions = 0
+        self._reset()
+
+    def _reset(self):
+        import torch
+        from transformers import DynamicCache
+
+        core.initialize_model()
+        header = core.processor.tokenizer(f"{TURN_START}{self.system_prompt}\n\n", return_tensors="pt")
+        self.input_ids = header["input_ids"].to(core.model.device)
+        self.cache = DynamicCache()
+        with torch.no_grad():
+            core.model(input_ids=self.input_ids, past_key_values=self.cache, use_cache=True)
+
+    def _encode(self, chunk: dict):
+        import torch
+
+        # the processor only expands image_token / audio_token into the
+        # boi/boa-wrapped run of soft tokens the encoder output is merged into
+        label = f"{chunk['kind'].capitalize()} at {chunk['ts']:.1f}s:"
+        if chunk["kind"] == "image":
+            enc = core.processor(text=[f"{label} {core.processor.image_token}"], images=[[chunk["data"]]],
+                                 return_tensors="pt", add_special_tokens=False)
+            soft_id, expected = core.model.config.image_token_id, core.processor.image_seq_length
+        else:
+            enc = core.processor(text=[f"{label} {core.processor.audio_token}"], audio=[chunk["data"]],
+                                 return_tensors="pt", add_special_tokens=False)
+            soft_id, expected = core.model.config.audio_token_id, core.processor.audio_seq_length
+        enc = core._to_device(enc)
+
+        new_ids = enc["input_ids"]
+        soft = int((new_ids == soft_id).sum())
+        if soft != expected:
+            raise ValueError(f"{chunk['kind']} chunk encoded to {soft} soft tokens, expected {expected}")
+        past = self.input_ids.shape[1]
+        extra = {k: v for k, v in enc.items() if k not in ("input_ids", "attention_mask")}
+        with torch.no_grad():
+            core.model(
+                input_ids=new_ids,
+                attention_mask=torch.ones(1, past + new_ids.shape[1], dtype=torch.long, device=new_ids.device),
+                cache_position=torch.arange(past, past + new_ids.shape[1], device=new_ids.device),
+                past_key_values=self.cache,
+                use_cache=True,
+                **extra
+            )
+        self.input_ids = torch.cat([self.input_ids, new_ids], dim=1)
+        cached = self.cache.get_seq_length()
+        if cached != self.input_ids.shape[1]:
+            raise RuntimeError(f"Session cache holds {cached} tokens but {self.input_ids.shape[1]} were encoded")
+        chunk["tokens"] = new_ids.shape[1]
+
+    def append(self, kind: str, data, ts: float):
+        # kind is "image" (PIL image) or "audio" (16 kHz mono array)
+        core._check_modalities([[{"role": "user", "content": [{"type": kind}]}]])
+        self.last_used = time.monotonic()
+        self.chunks.append({"kind": kind, "data": data, "ts": ts})
+        if len(self.chunks) > SESSION_WINDOW:
+            # the cache cannot drop entries from the middle, so the oldest
+            # SESSION_EVICT chunks are dropped at once and the rest re-encoded;
+            # this keeps re-encoding to once every SESSION_EVICT appends
+            for _ in range(min(SESSION_EVICT, len(self.chunks) - 1)):
+                self.chunks.popleft()
+            self.evictions += 1
+            self._reset()
+            for retained in self.chunks:
+                self._encode(retained)
+        else:
+            try:
+                self._encode(self.chunks[-1])
+            except ValueError:
+                # rejected before it reached the cache
+                self.chunks.pop()
+                raise
+
+    def query(self, question: str, max_new_tokens: int) -> str:
+        import torch
+
+        self.last_used = time.monotonic()
+        if not self.chunks:
+            raise ValueError("No media has been pushed to this session yet")
+        q = core.processor.tokenizer(f"{question}{TURN_END}", add_special_tokens=False, return_tensors="pt")
+        input_ids = torch.cat([self.input_ids, q["input_ids"].to(self.input_ids.device)], dim=1)
+        outputs = core.model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=copy.deepcopy(self.cache),
+            max_new_tokens=max_new_tokens
+        )
+        return core.processor.decode(outputs[0, input_ids.shape[1]:], skip_special_tokens=True)
+
+    def info(self) -> dict:
+        return {
+            "session_id": self.id,
+            "created": self.created,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "chunks": len(self.chunks),
+            "window": SESSION_WINDOW,
+            "cached_tokens": int(self.input_ids.shape[1]) if self.input_ids is not None else 0,
+            "evictions": self.evictions,
+            "oldest_ts": self.chunks[0]["ts"] if self.chunks else None,
+            "newest_ts": self.chunks[-1]["ts"] if self.chunks else None,
+        }
+
+
+class SessionManager:
+
+    def __init__(self, max_sessions: int = SESSION_MAX, idle_seconds: int = SESSION_IDLE_SECONDS):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.sessions: Dict[str, Session] = {}
+        # slots taken by sessions still prefilling their system prompt
+        self.reserved = 0
+        self.lock = threading.Lock()
+
+    def evict_idle(self) -> List[str]:
+        now = time.monotonic()
+        with self.lock:
+            idle = [sid for sid, s in self.sessions.items() if now - s.last_used > self.idle_seconds]
+            for sid in idle:
+                del self.sessions[sid]
+        return idle
+
+    async def sweep(self, interval: int = SESSION_SWEEP_SECONDS):
+        # drops idle sessions, and their KV caches, even when nobody calls
+        # the sessions API; runs for the lifetime of the server
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+    def create(self, system_prompt: Optional[str] = None) -> Session:
+        self.evict_idle()
+        # the slot is reserved before the slow prefill so concurrent creates
+        # cannot overshoot max_sessions
+        with self.lock:
+            if len(self.sessions) + self.reserved >= self.max_sessions:
+                raise SessionLimitError(f"Session limit reached ({self.max_sessions}); close a session or wait for idle ones to expire")
+            self.reserved += 1
+        try:
+            with core.model_lock:
+                session = Session(system_prompt or DEFAULT_SESSION_PROMPT)
+        except BaseException:
+            with self.lock:
+                self.reserved -= 1
+            raise
+        with self.lock:
+            self.reserved -= 1
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str) -> Session:
+        self.evict_idle()
+        with self.lock:
+            return self.sessions[session_id]
+
+    def close(self, session_id: str):
+        with self.lock:
+            del self.sessions[session_id]
+
+    def list(self) -> List[dict]:
+        self.evict_idle()
+        with self.lock:
+            return [s.info() for s in self.sessions.values()]
+
+
+manager = SessionManager()
@@ -0,0 +1,270 @@
+# src/spool.py
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = os.getenv("GEMMA3N_SPOOL_DIR", "spool")
+SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+BATCH_SIZE = int(os.getenv("SPOOL_BATCH_SIZE", "32"))
+MAX_BACKOFF = float(os.getenv("SPOOL_MAX_BACKOFF", "60"))
+
+
+class Spool:
+    # append-only log of publish/upload records split into numbered segment
+    # files; `position.json` holds the (segment, byte offset) of the first
+    # record that has not been acknowledged yet
+
+    def __init__(self, directory: str = SPOOL_DIR, segment_bytes: int = SEGMENT_BYTES, fsync: bool = False):
+        self.directory = directory
+        self.files_dir = os.path.join(directory, "files")
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        os.makedirs(self.files_dir, exist_ok=True)
+
+        segments = self._segments()
+        self.write_segment = segments[-1] if segments else 0
+        self.writer = open(self._segment_path(self.write_segment), "ab")
+        self.position = self._load_position(segments)
+        self.depth = self._count_pending()
+        self.appended = 0
+        self.acked = 0
+
+    def _segment_path(self, n: int) -> str:
+        return os.path.join(self.directory, f"segment-{n:08d}.log")
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[len("segment-"):-len(".log")])
+            for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".log")
+        )
+
+    def _load_position(self, segments):
+        try:
+            with open(os.path.join(self.directory, "position.json")) as f:
+                pos = json.load(f)
+            return pos["segment"], pos["offset"]
+        except (OSError, ValueError, KeyError):
+            return (segments[0] if segments else 0), 0
+
+    def _count_pending(self) -> int:
+        segment, offset = self.position
+        pending = 0
+        for n in self._segments():
+            if n < segment:
+                continue
+            with open(self._segment_path(n), "rb") as f:
+                if n == segment:
+                    f.seek(offset)
+                pending += sum(1 for line in f if line.endswith(b"\n"))
+        return pending
+
+    def append(self, record: dict):
+        line = (json.dumps(record) + "\n").encode()
+        with self.lock:
+            if self.writer.tell() + len(line) > self.segment_bytes and self.writer.tell() > 0:
+                self.writer.close()
+                self.write_segment += 1
+                self.writer = open(self._segment_path(self.write_segment), "ab")
+            self.writer.write(line)
+            self.writer.flush()
+            if self.fsync:
+                os.fsync(self.writer.fileno())
+            self.depth += 1
+            self.appended += 1
+            self.not_empty.notify_all()
+
+    def keep_file(self, path: str) -> str:
+        # moves a file that is waiting for upload into the spool so it
+        # survives restarts and temp cleanup
+        target = os.path.join(self.files_dir, f"{time.time_ns()}_{os.path.basename(path)}")
+        shutil.move(path, target)
+        return target
+
+    def read_batch(self, limit: int = BATCH_SIZE, timeout: Optional[float] = None):
+        # returns [(record, (segment, end_offset)), ...] starting at the
+        # acknowledged position, waiting up to `timeout` for new records
+        with self.not_empty:
+            if self.depth == 0:
+                self.not_empty.wait(timeout)
+            segment, offset = self.position
+            write_segment = self.write_segment
+
+        batch = []
+        while len(batch) < limit and segment <= write_segment:
+            path = self._segment_path(segment)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    while len(batch) < limit:
+                        line = f.readline()
+                        if not line.endswith(b"\n"):
+                            break
+                        offset += len(line)
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            logger.warning(f"Skipping corrupt spool record in {path}")
+                            record = None
+                        batch.append((record, (segment, offset)))
+            if len(batch) < limit and segment < write_segment:
+                segment, offset = segment + 1, 0
+            else:
+                break
+        return batch
+
+    def ack(self, position, count: int):
+        with self.lock:
+            self.position = position
+            self.depth -= count
+            self.acked += count
+            tmp = os.path.join(self.directory, "position.json.tmp")
+            with open(tmp, "w") as f:
+                json.dump({"segment": position[0], "offset": position[1]}, f)
+            os.replace(tmp, os.path.join(self.directory, "position.json"))
+        self.compact()
+
+    def compact(self):
+        # fully acknowledged segments are deleted; the segment being written
+        # is never removed
+        with self.lock:
+            ack_segment = self.position[0]
+            write_segment = self.write_segment
+        for n in self._segments():
+            if n < ack_segment and n < write_segment:
+                os.remove(self._segment_path(n))
+
+    def publisher(self) -> "SpoolPublisher":
+        return SpoolPublisher(self)
+
+    def close(self):
+        with self.lock:
+            self.writer.close()
+
+
+class SpoolPublisher:
+    # drop-in for the Plugin publish/upload_file calls; records are appended
+    # to the spool and the call returns immediately
+
+    def __init__(self, spool: Spool):
+        self.spool = spool
+
+    def publish(self, name, value, timestamp=None, meta=None):
+        self.spool.append({"kind": "publish", "name": name, "value": value,
+                           "timestamp": timestamp, "meta": meta or {}})
+
+    def upload_file(self, path, meta=None, timestamp=None):
+        kept = self.spool.keep_file(path)
+        self.spool.append({"kind": "upload", "path": kept, "timestamp": timestamp, "meta": meta or {}})
+
+
+class SpoolSender:
+    # background thread draining the spool into a Plugin (or any object with
+    # publish/upload_file) in batches, retrying with exponential backoff
+
+    def __init__(self, spool: Spool, plugin, batch_size: int = BATCH_SIZE,
+                 max_backoff: float = MAX_BACKOFF, stats_interval: float = 60.0):
+        self.spool = spool
+        self.plugin = plugin
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.stats_interval = stats_interval
+        self.failures = 0
+        self.last_error = None
+        self.drain_rate = 0.0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="spool-sender", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self, drain: bool = True, timeout: float = 30.0):
+        if drain:
+            deadline = time.monotonic() + timeout
+            while self.spool.depth > 0 and time.monotonic() < deadline and self.thread.is_alive():
+                time.sleep(0.1)
+            if self.spool.depth > 0:
+                logger.warning(f"Stopping with {self.spool.depth} spooled records left for the next run")
+        self.stop_event.set()
+        self.thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.spool.depth,
+            "appended": self.spool.appended,
+            "acked": self.spool.acked,
+            "drain_rate": round(self.drain_rate, 3),
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+    def _send(self, record: dict):
+        if record["kind"] == "publish":
+            self.plugin.publish(record["name"], record["value"],
+                                timestamp=record.get("timestamp"), meta=record.get("meta"))
+        elif record["kind"] == "upload":
+            if not os.path.exists(record["path"]):
+                logger.warning(f"Spooled upload {record['path']} no longer exists, dropping")
+                return
+            kwargs = {"meta": record.get("meta")}
+            if record.get("timestamp") is not None:
+                kwargs["timestamp"] = record["timestamp"]
+            self.plugin.upload_file(record["path"], **kwargs)
+            if os.path.exists(record["path"]):
+                os.remove(record["path"])
+
+    def drain_once(self, timeout: Optional[float] = 1.0) -> int:
+        # sends one batch; returns the number of acknowledged records and
+        # raises on failure with the acknowledged prefix already committed
+        batch = self.spool.read_batch(self.batch_size, timeout=timeout)
+        sent = 0
+        position = None
+        try:
+            for record, end in batch:
+                if record is not None:
+                    self._send(record)
+                sent += 1
+                position = end
+        finally:
+            if sent:
+                self.spool.ack(position, sent)
+        return sent
+
+    def _run(self):
+        last_stats = time.monotonic()
+        window_start, window_sent = last_stats, 0
+        while not self.stop_event.is_set():
+            try:
+                window_sent += self.drain_once()
+                self.failures = 0
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                backoff = min(self.max_backoff, 2 ** min(self.failures, 10)) * (0.5 + random.random() / 2)
+                logger.warning(f"Spool send failed ({self.failures} in a row), retrying in {backoff:.1f}s: {e}")
+                self.stop_event.wait(backoff)
+
+            now = time.monotonic()
+            if now - window_start >= 5.0:
+                rate = window_sent / (now - window_start)
+                self.drain_rate = rate if self.drain_rate == 0.0 else 0.7 * self.drain_rate + 0.3 * rate
+                window_start, window_sent = now, 0
+            if now - last_stats >= self.stats_interval:
+                last_stats = now
+                stats = self.stats()
+                logger.info(f"Spool depth={stats['depth']} drain_rate={stats['drain_rate']}/s failures={stats['failures']}")
+                try:
+                    self.plugin.publish("gemma3n.spool.depth", stats["depth"])
+                    self.plugin.publish("gemma3n.spool.drain_rate", stats["drain_rate"])
+                except Exception:
+                    pass
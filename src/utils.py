@@ -1,17 +1,29 @@
 # src/utils.py
+from __future__ import annotations
 import os, pathlib, shutil, tempfile
-from typing import List
-from fastapi import UploadFile
-from av import open as av_open  
+from collections import deque
+from typing import TYPE_CHECKING, Iterator, List, Tuple
+
+from src.profiling import traced
+
+# fastapi, PyAV and PIL are imported where they are used so the CLIs can
+# import the constants below without paying for them
+if TYPE_CHECKING:
+    from fastapi import UploadFile
+    from PIL import Image
 
 TARGET_FPS    = int(os.getenv("TARGET_FPS", "3"))
 MAX_FRAMES    = int(os.getenv("MAX_FRAMES", "30"))
+WINDOW_FRAMES = int(os.getenv("WINDOW_FRAMES", "16"))
+WINDOW_STRIDE = int(os.getenv("WINDOW_STRIDE", "12"))
+AUDIO_SAMPLE_RATE = 16_000
 TEMP_DIR   = tempfile.gettempdir()
 IMAGE_FILE_TYPES = (".jpg", ".jpeg", ".png", ".webp")
 VIDEO_FILE_TYPES = (".mp4", ".mov", ".webm")
 AUDIO_FILE_TYPES = (".mp3", ".wav", ".ogg")
 
 
+@traced("video.extract_frames")
 def extract_frames_to_tempdir(
     video_path: str,
     target_fps: float,
@@ -19,6 +31,7 @@ def extract_frames_to_tempdir(
     parent_dir: str | None = None,
     prefix: str = "frames_",
 ) -> str:
+    from av import open as av_open
     temp_dir = tempfile.mkdtemp(prefix=prefix, dir=parent_dir)
     container = av_open(video_path)
     stream    = container.streams.video[0]
@@ -42,6 +55,97 @@ def extract_frames_to_tempdir(
     return temp_dir
 
 
+def decode_frames(video_path: str, target_fps: float, max_frames: int | None = None) -> List[Image.Image]:
+    # same sampling as extract_frames_to_tempdir, kept in memory
+    from av import open as av_open
+    container = av_open(video_path)
+    try:
+        stream   = container.streams.video[0]
+        tb, dur  = stream.time_base, float(stream.duration * stream.time_base)
+        interval = 1.0 / target_fps
+        total    = min(int(dur * target_fps), max_frames or 10_000)
+        frames   = []
+        for frame in container.decode(video=0):
+            if frame.pts is None: continue
+            if abs(float(frame.pts * tb) - len(frames) * interval) < (interval/2):
+                frames.append(frame.to_image())
+                if len(frames) >= total:
+                    break
+    finally:
+        container.close()
+    return frames
+
+
+def iter_frame_windows(
+    video_path: str,
+    target_fps: float,
+    window_frames: int = WINDOW_FRAMES,
+    stride_frames: int = WINDOW_STRIDE,
+) -> Iterator[Tuple[float, float, List[Tuple[float, Image.Image]]]]:
+    # streams the container and yields (start_ts, end_ts, [(ts, image), ...])
+    # sliding windows; at most `window_frames` decoded frames are held at once
+    from av import open as av_open
+    stride_frames = max(1, min(stride_frames, window_frames))
+    container = av_open(video_path)
+    stream    = container.streams.video[0]
+    tb        = stream.time_base
+    interval  = 1.0 / target_fps
+    next_ts   = 0.0
+    window    = deque()
+    fresh     = 0
+
+    try:
+        for frame in container.decode(video=0):
+            if frame.pts is None: continue
+            ts = float(frame.pts * tb)
+            if ts < next_ts - interval/2:
+                continue
+            next_ts = ts + interval
+            window.append((ts, frame.to_image()))
+            fresh += 1
+            if len(window) == window_frames:
+                yield window[0][0], window[-1][0] + interval, list(window)
+                fresh = 0
+                for _ in range(stride_frames):
+                    window.popleft()
+        if fresh and window:
+            yield window[0][0], window[-1][0] + interval, list(window)
+    finally:
+        container.close()
+
+
+def media_duration(path: str) -> float:
+    # container duration in seconds, 0 when unknown
+    try:
+        from av import open as av_open
+        with av_open(path) as container:
+            return (container.duration or 0) / 1_000_000
+    except Exception:
+        return 0.0
+
+
+def to_model_audio(data, samplerate: int):
+    # mono float32 at the rate the Gemma-3n feature extractor expects
+    import numpy as np
+    audio = np.asarray(data, dtype=np.float32)
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    if samplerate != AUDIO_SAMPLE_RATE:
+        import librosa
+        audio = librosa.resample(audio, orig_sr=samplerate, target_sr=AUDIO_SAMPLE_RATE)
+    return audio
+
+
+def to_model_image(data, fmt: str = "RGB"):
+    # pywaggle camera frames are BGR; the processor expects RGB
+    import numpy as np
+    from PIL import Image
+    if str(fmt).upper() == "BGR":
+        data = np.ascontiguousarray(np.asarray(data)[..., ::-1])
+    return Image.fromarray(data)
+
+
+@traced("upload.save")
 def save_to_temp(upload: UploadFile) -> str:
     suffix = pathlib.Path(upload.filename).suffix
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
@@ -0,0 +1,253 @@
+# src/vector_index.py
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src import metrics
+
+INDEX_DIR = os.getenv("INDEX_DIR", "vector_indexes")
+# below IVF_MIN_VECTORS an index is searched exhaustively; above it, an IVF
+# partition with about sqrt(N) lists is trained and IVF_NPROBE lists are
+# scanned per query. The partition is retrained once the index has grown
+# by IVF_RETRAIN_GROWTH since the last training
+IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", "4096"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_RETRAIN_GROWTH = float(os.getenv("IVF_RETRAIN_GROWTH", "2.0"))
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50_000
+SEARCH_CHUNK = 65_536
+
+# a leading letter or digit rules out "." and ".."
+_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    # spherical k-means on unit vectors; empty clusters are reseeded from
+    # random points
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(k):
+            members = vectors[assign == c]
+            centroids[c] = members.sum(axis=0) if len(members) else vectors[rng.integers(len(vectors))]
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+    return centroids
+
+
+class VectorIndex:
+    # unit vectors appended to a raw float32 file that is memory-mapped for
+    # search, one metadata line per vector, and an optional IVF partition.
+    # Scores are cosine similarities
+
+    def __init__(self, directory: str, dim: Optional[int] = None):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.paths = {
+            "info": os.path.join(directory, "info.json"),
+            "vectors": os.path.join(directory, "vectors.f32"),
+            "meta": os.path.join(directory, "meta.jsonl"),
+            "ivf": os.path.join(directory, "ivf.npz"),
+        }
+        if os.path.exists(self.paths["info"]):
+            with open(self.paths["info"]) as f:
+                self.info = json.load(f)
+        else:
+            if dim is None:
+                raise KeyError(directory)
+            os.makedirs(directory, exist_ok=True)
+            self.info = {"dim": dim, "created": time.time()}
+            self._save_info()
+        self.dim = self.info["dim"]
+        self.meta: List[dict] = []
+        if os.path.exists(self.paths["meta"]):
+            with open(self.paths["meta"]) as f:
+                self.meta = [json.loads(line) for line in f if line.strip()]
+        # kind per vector as a small integer code, so kind filters stay in
+        # numpy instead of walking the metadata
+        self.kind_codes: Dict[str, int] = {}
+        self.kinds = self._codes(self.meta)
+        self._mapped = None
+        self.ivf = None
+        if os.path.exists(self.paths["ivf"]):
+            data = np.load(self.paths["ivf"])
+            self.ivf = {name: data[name] for name in ("centroids", "order", "offsets")}
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    def _codes(self, metas: List[dict]) -> np.ndarray:
+        return np.array([self.kind_codes.setdefault(m.get("kind", ""), len(self.kind_codes)) for m in metas],
+                        dtype=np.int16)
+
+    def _save_info(self):
+        with open(self.paths["info"], "w") as f:
+            json.dump(self.info, f)
+
+    def _vectors(self) -> np.ndarray:
+        # remapped only when vectors were appended since the last mapping
+        n = len(self.meta)
+        if n == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if self._mapped is None or len(self._mapped) != n:
+            self._mapped = np.memmap(self.paths["vectors"], dtype=np.float32, mode="r", shape=(n, self.dim))
+        return self._mapped
+
+    def add(self, vectors: np.ndarray, metas: List[dict]) -> List[int]:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+        with self.lock:
+            first = len(self.meta)
+            # vectors first: a crash between the two writes leaves vectors
+            # without metadata, which are ignored and overwritten next time
+            with open(self.paths["vectors"], "r+b" if os.path.exists(self.paths["vectors"]) else "wb") as f:
+                f.seek(first * self.dim * 4)
+                f.write(vectors.tobytes())
+                f.truncate()
+            entries = [{**meta, "id": first + i} for i, meta in enumerate(metas)]
+            with open(self.paths["meta"], "a") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+            self.meta.extend(entries)
+            self.kinds = np.concatenate([self.kinds, self._codes(entries)])
+            self._maybe_train()
+        metrics.incr("vector_index.added", len(entries))
+        return [entry["id"] for entry in entries]
+
+    def _maybe_train(self):
+        n = len(self.meta)
+        trained = self.info.get("trained_on", 0)
+        if n < IVF_MIN_VECTORS or (trained and n < trained * IVF_RETRAIN_GROWTH):
+            return
+        start = time.perf_counter()
+        vectors = np.asarray(self._vectors())
+        sample = vectors
+        if n > KMEANS_SAMPLE:
+            sample = vectors[np.random.default_rng(0).choice(n, KMEANS_SAMPLE, replace=False)]
+        centroids = kmeans(sample, max(1, int(np.sqrt(n))))
+        # inverted lists: vector ids grouped by list, list l spanning
+        # order[offsets[l]:offsets[l + 1]]
+        assign = self._assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+        np.savez(self.paths["ivf"] + ".tmp.npz", centroids=centroids, order=order, offsets=offsets)
+        os.replace(self.paths["ivf"] + ".tmp.npz", self.paths["ivf"])
+        self.ivf = {"centroids": centroids, "order": order, "offsets": offsets}
+        self.info["trained_on"] = n
+        self._save_info()
+        metrics.observe("vector_index.train_seconds", time.perf_counter() - start)
+
+    def _assign(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        assign = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), SEARCH_CHUNK):
+            assign[start:start + SEARCH_CHUNK] = np.argmax(vectors[start:start + SEARCH_CHUNK] @ centroids.T, axis=1)
+        return assign
+
+    def search(self, query: np.ndarray, k: int = 10, kind: str = "", nprobe: int = IVF_NPROBE) -> List[dict]:
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / (np.linalg.norm(query) + 1e-12)
+        start = time.perf_counter()
+        with self.lock:
+            vectors = self._vectors()
+            n = len(vectors)
+            if n == 0:
+                return []
+            if self.ivf is not None:
+                # vectors added after training are not in any list and are
+                # always scanned
+                order, offsets = self.ivf["order"], self.ivf["offsets"]
+                lists = np.argsort(-(self.ivf["centroids"] @ query))[:nprobe]
+                candidates = np.concatenate(
+                    [order[offsets[l]:offsets[l + 1]] for l in lists] + [np.arange(len(order), n)]
+                )
+            else:
+                candidates = None
+            if kind:
+                code = self.kind_codes.get(kind)
+                if code is None:
+                    return []
+                if candidates is None:
+                    candidates = np.nonzero(self.kinds[:n] == code)[0]
+                else:
+                    candidates = candidates[self.kinds[candidates] == code]
+
+            ids, scores = [], []
+            total = n if candidates is None else len(candidates)
+            for chunk_start in range(0, total, SEARCH_CHUNK):
+                if candidates is None:
+                    chunk_ids = np.arange(chunk_start, min(n, chunk_start + SEARCH_CHUNK))
+                    chunk = vectors[chunk_start:chunk_start + SEARCH_CHUNK]
+                else:
+                    chunk_ids = np.sort(candidates[chunk_start:chunk_start + SEARCH_CHUNK])
+                    chunk = vectors[chunk_ids]
+                chunk_scores = chunk @ query
+                top = np.argsort(-chunk_scores)[:k]
+                ids.append(chunk_ids[top])
+                scores.append(chunk_scores[top])
+            if not ids:
+                return []
+            ids, scores = np.concatenate(ids), np.concatenate(scores)
+            order = np.argsort(-scores)[:k]
+            results = [{**self.meta[int(ids[i])], "score": round(float(scores[i]), 4)} for i in order]
+        metrics.observe("vector_index.search_seconds", time.perf_counter() - start)
+        return results
+
+    def describe(self) -> dict:
+        return {"name": os.path.basename(self.directory), "dim": self.dim, "count": len(self),
+                "ivf_lists": 0 if self.ivf is None else len(self.ivf["centroids"]),
+                "trained_on": self.info.get("trained_on", 0), "created": self.info["created"]}
+
+
+class IndexRegistry:
+    # named indexes under INDEX_DIR, opened on first use
+
+    def __init__(self, directory: str = INDEX_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.indexes: Dict[str, VectorIndex] = {}
+
+    def _path(self, name: str) -> str:
+        # the index directory, which must resolve to a direct child of the
+        # registry directory before anything is written or removed
+        if not _NAME.match(name):
+            raise ValueError(f"Invalid index name '{name}'; start with a letter or digit, then use letters, "
+                             f"digits, '_', '-' and '.'")
+        root = os.path.realpath(self.directory)
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.dirname(path) != root:
+            raise ValueError(f"Invalid index name '{name}'")
+        return path
+
+    def get(self, name: str, dim: Optional[int] = None) -> VectorIndex:
+        # with dim, a missing index is created
+        path = self._path(name)
+        with self.lock:
+            index = self.indexes.get(name)
+            if index is None:
+                index = VectorIndex(path, dim)
+                self.indexes[name] = index
+        if dim is not None and index.dim != dim:
+            raise ValueError(f"Index '{name}' holds {index.dim}-dimensional vectors, got {dim}")
+        return index
+
+    def list(self) -> List[dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        return [self.get(name).describe() for name in sorted(os.listdir(self.directory))
+                if os.path.exists(os.path.join(self.directory, name, "info.json"))]
+
+    def delete(self, name: str):
+        index = self.get(name)
+        with self.lock:
+            self.indexes.pop(name, None)
+        with index.lock:
+            shutil.rmtree(self._path(name))
+
+
+registry = IndexRegistry()
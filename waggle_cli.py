@@ -2,18 +2,19 @@
 import argparse
 import os
 import pathlib
+import queue
 import sys
+import threading
 import time
 import logging
+from contextlib import ExitStack
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
-from waggle.plugin import Plugin
-from waggle.data.vision import Camera, ImageFolder
-from waggle.data.audio import Microphone, AudioFolder
-
 from cli import GemmaCliProcessor
-from src.utils import IMAGE_FILE_TYPES, AUDIO_FILE_TYPES, VIDEO_FILE_TYPES
+from src.spool import Spool, SpoolSender, SPOOL_DIR
+from src.prompts import render
+from src.utils import IMAGE_FILE_TYPES, AUDIO_FILE_TYPES, VIDEO_FILE_TYPES, TEMP_DIR, to_model_audio, to_model_image
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -40,10 +41,13 @@ def get_file_path(filename):
 
 class WaggleMediaProcessor:
     
-    def __init__(self):
+    def __init__(self, gate=None, on_unchanged="republish"):
         self.processor = GemmaCliProcessor()
+        self.gate = gate
+        self.on_unchanged = on_unchanged
         
     def capture_live_image(self, camera_device=None):
+        from waggle.data.vision import Camera
         try:
             if camera_device:
                 camera = Camera(camera_device)
@@ -61,6 +65,7 @@ class WaggleMediaProcessor:
             return None, None
     
     def capture_live_audio(self, duration=10):
+        from waggle.data.audio import Microphone
         try:
             with Microphone() as microphone:
                 sample = microphone.record(duration)
@@ -75,7 +80,10 @@ class WaggleMediaProcessor:
     
     def process_and_publish(self, plugin, task, modes, files, event_description=None, 
                           user_text="", max_tokens=100, use_live_capture=False, 
-                          audio_duration=10, camera_device=None):
+                          audio_duration=10, camera_device=None, publisher=None):
+        # publisher defaults to the plugin itself; a SpoolPublisher decouples
+        # the inference loop from the broker
+        publisher = publisher or plugin
         
         processed_files = []
         capture_timestamps = {}
@@ -108,69 +116,107 @@ class WaggleMediaProcessor:
             logger.error("No valid files found for processing")
             return
         
+        items = [(self._get_file_mode(f), f) for f in processed_files]
+        
         try:
             with plugin.timeit("plugin.duration.processing"):
-                if task == 'caption':
-                    result = self._process_captioning(processed_files, user_text, max_tokens)
-                elif task == 'detect':
-                    if not event_description:
-                        logger.error("Event description is required for detection task")
-                        return
-                    result = self._process_detection(processed_files, event_description, max_tokens)
-                else:
-                    logger.error(f"Unknown task: {task}")
-                    return
-            
-            timestamp = int(time.time() * 1e9)  
-            
-            plugin.publish(f"gemma3n.{task}.result", result, timestamp=timestamp, 
-                         meta={
-                             "modes": modes,
-                             "files": [os.path.basename(f) for f in processed_files],
-                             "model": "gemma-3n",
-                             "event_description": event_description,
-                             "live_capture": use_live_capture
-                         })
-            
-            if len(processed_files) > 1:
-                for file_path in processed_files:
-                    file_mode = self._get_file_mode(file_path)
-                    if file_mode:
-                        plugin.publish(f"gemma3n.{task}.{file_mode}", result, 
-                                     timestamp=capture_timestamps.get(file_path, timestamp),
-                                     meta={
-                                         "file": os.path.basename(file_path),
-                                         "mode": file_mode,
-                                         "live_capture": file_path in capture_timestamps
-                                     })
-            
-            for file_path in processed_files:
-                if file_path in capture_timestamps:
-                    plugin.upload_file(file_path, 
-                                     meta={
-                                         "mode": self._get_file_mode(file_path),
-                                         "capture_timestamp": capture_timestamps[file_path]
-                                     })
+                result, reused = self.infer_gated(task, items, event_description, user_text, max_tokens)
+            if result is None:
+                return
             
-            logger.info(f"Successfully processed and published results for modes: {modes}")
-            
-            timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            capture_status = "LIVE CAPTURE" if use_live_capture else "FILE PROCESSING"
-            print(f"\n[{timestamp_str}] {task.upper()} Results ({capture_status}):")
-            print("="*60)
-            print(f"Modes: {modes}")
-            print(f"Files: {[os.path.basename(f) for f in processed_files]}")
-            if event_description:
-                print(f"Event: {event_description}")
-            print("-"*60)
-            print(result)
-            print("="*60)
+            uploads = [] if reused else [(f, self._get_file_mode(f), capture_timestamps[f])
+                                         for f in processed_files if f in capture_timestamps]
+            self.publish_result(publisher, task, modes, result,
+                                names=[os.path.basename(f) for f in processed_files],
+                                timestamps=[capture_timestamps.get(f) for f in processed_files],
+                                uploads=uploads,
+                                event_description=event_description,
+                                live_capture=use_live_capture,
+                                reused=reused)
             
         except Exception as e:
             logger.error(f"Error processing files: {e}")
-            plugin.publish("gemma3n.error", str(e), 
+            publisher.publish("gemma3n.error", str(e), 
                          meta={"modes": modes, "task": task})
     
+    def infer_gated(self, task, items, event_description=None, user_text="", max_tokens=100):
+        # returns (result, reused); result is None when nothing should be published
+        if self.gate is None:
+            return self.run_inference(task, items, event_description, user_text, max_tokens), False
+        
+        changed, signatures, scores = self.gate.check(items)
+        if not changed:
+            logger.info(f"No significant change (scores: {scores}), skipping inference")
+            if self.on_unchanged == "republish":
+                return self.gate.last_result, True
+            return None, True
+        
+        result = self.run_inference(task, items, event_description, user_text, max_tokens)
+        if result is not None:
+            self.gate.commit(signatures, result)
+        return result, False
+    
+    def run_inference(self, task, items, event_description=None, user_text="", max_tokens=100):
+        if task == 'caption':
+            return self._process_captioning(items, user_text, max_tokens)
+        elif task == 'detect':
+            if not event_description:
+                logger.error("Event description is required for detection task")
+                return None
+            return self._process_detection(items, event_description, max_tokens)
+        logger.error(f"Unknown task: {task}")
+        return None
+    
+    def publish_result(self, plugin, task, modes, result, names, timestamps, uploads,
+                       event_description=None, live_capture=False, reused=False):
+        # names/timestamps are per processed input; uploads are (path, mode, capture_timestamp)
+        timestamp = int(time.time() * 1e9)  
+        
+        plugin.publish(f"gemma3n.{task}.result", result, timestamp=timestamp, 
+                     meta={
+                         "modes": modes,
+                         "files": names,
+                         "model": "gemma-3n",
+                         "event_description": event_description,
+                         "live_capture": live_capture,
+                         "reused": reused
+                     })
+        
+        if len(names) > 1:
+            for name, capture_ts in zip(names, timestamps):
+                file_mode = self._get_file_mode(name)
+                if file_mode:
+                    plugin.publish(f"gemma3n.{task}.{file_mode}", result, 
+                                 timestamp=capture_ts or timestamp,
+                                 meta={
+                                     "file": name,
+                                     "mode": file_mode,
+                                     "live_capture": capture_ts is not None
+                                 })
+        
+        for file_path, file_mode, capture_ts in uploads:
+            plugin.upload_file(file_path, 
+                             meta={
+                                 "mode": file_mode,
+                                 "capture_timestamp": capture_ts
+                             })
+        
+        logger.info(f"Successfully processed and published results for modes: {modes}")
+        
+        timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        capture_status = "LIVE CAPTURE" if live_capture else "FILE PROCESSING"
+        if reused:
+            capture_status += ", UNCHANGED"
+        print(f"\n[{timestamp_str}] {task.upper()} Results ({capture_status}):")
+        print("="*60)
+        print(f"Modes: {modes}")
+        print(f"Files: {names}")
+        if event_description:
+            print(f"Event: {event_description}")
+        print("-"*60)
+        print(result)
+        print("="*60)
+    
     def _get_file_mode(self, file_path):
         ext = pathlib.Path(file_path).suffix.lower()
         if ext in IMAGE_FILE_TYPES:
@@ -181,38 +227,186 @@ class WaggleMediaProcessor:
             return "video"
         return None
     
-    def _process_captioning(self, files, user_text, max_tokens):
-        if len(files) == 1:
-            file_path = files[0]
-            ext = pathlib.Path(file_path).suffix.lower()
+    def _process_captioning(self, items, user_text, max_tokens):
+        # items are (mode, data) pairs; data is a file path or in-memory media
+        if len(items) == 1:
+            mode, data = items[0]
             
-            if ext in IMAGE_FILE_TYPES:
-                return self.processor.process_image_captioning(file_path, user_text, max_tokens)
-            elif ext in AUDIO_FILE_TYPES:
-                return self.processor.process_audio_captioning(file_path, user_text, max_tokens)
-            elif ext in VIDEO_FILE_TYPES:
-                return self.processor.process_video_captioning(file_path, user_text, max_tokens)
+            if mode == "image":
+                return self.processor.process_image_captioning(data, user_text, max_tokens)
+            elif mode == "audio":
+                return self.processor.process_audio_captioning(data, user_text, max_tokens)
+            elif mode == "video":
+                return self.processor.process_video_captioning(data, user_text, max_tokens)
         else:
-            system_prompt = "You are an expert multimodal analyst. Provide detailed, accurate captions describing the content across all provided media types."
-            return self.processor.process_multimodal(files, system_prompt, user_text, max_tokens)
+            system_prompt = render("multimodal_caption")
+            return self._process_multimodal(items, system_prompt, user_text, max_tokens)
     
-    def _process_detection(self, files, event_description, max_tokens):
-        if len(files) == 1:
-            file_path = files[0]
-            ext = pathlib.Path(file_path).suffix.lower()
+    def _process_detection(self, items, event_description, max_tokens):
+        if len(items) == 1:
+            mode, data = items[0]
             
-            if ext in IMAGE_FILE_TYPES:
-                return self.processor.process_image_detection(file_path, event_description, max_tokens)
-            elif ext in AUDIO_FILE_TYPES:
-                return self.processor.process_audio_detection(file_path, event_description, max_tokens)
-            elif ext in VIDEO_FILE_TYPES:
-                return self.processor.process_video_detection(file_path, event_description, max_tokens)
+            if mode == "image":
+                return self.processor.process_image_detection(data, event_description, max_tokens)
+            elif mode == "audio":
+                return self.processor.process_audio_detection(data, event_description, max_tokens)
+            elif mode == "video":
+                return self.processor.process_video_detection(data, event_description, max_tokens)
         else:
-            system_prompt = f"You are an expert multimodal event detector. Analyze all provided media and determine if the following event is occurring: '{event_description}'. Respond with 'YES' if detected, 'NO' if not, followed by explanation."
-            return self.processor.process_multimodal(files, system_prompt, "", max_tokens)
+            system_prompt = render("multimodal_event", event_description=event_description)
+            return self._process_multimodal(items, system_prompt, "", max_tokens)
+    
+    def _process_multimodal(self, items, system_prompt, user_text, max_tokens):
+        if all(isinstance(data, str) for _, data in items):
+            return self.processor.process_multimodal([data for _, data in items], system_prompt, user_text, max_tokens)
+        return self.processor.process_media_items(items, system_prompt, user_text, max_tokens)
 
 
-def main():
+class LiveCapture:
+    # keeps the camera and microphone open across cycles and hands samples
+    # over in memory; nothing is written to disk until a sample is uploaded
+    
+    def __init__(self, modes, audio_duration=10, camera_device=None):
+        from waggle.data.vision import Camera
+        from waggle.data.audio import Microphone
+        self.audio_duration = audio_duration
+        self.camera = None
+        self.microphone = None
+        self.stack = ExitStack()
+        if 'image' in modes:
+            self.camera = self.stack.enter_context(Camera(camera_device) if camera_device else Camera())
+        if 'audio' in modes:
+            # pywaggle's Microphone is not a context manager and holds no
+            # stream between record() calls
+            self.microphone = Microphone()
+    
+    def capture(self):
+        samples = []
+        if self.camera is not None:
+            try:
+                sample = self.camera.snapshot()
+                samples.append(("image", to_model_image(sample.data, getattr(sample, "format", "BGR")), sample))
+            except Exception as e:
+                logger.error(f"Failed to capture live image: {e}")
+        if self.microphone is not None:
+            try:
+                sample = self.microphone.record(self.audio_duration)
+                samples.append(("audio", to_model_audio(sample.data, sample.samplerate), sample))
+            except Exception as e:
+                logger.error(f"Failed to capture live audio: {e}")
+        return samples
+    
+    def close(self):
+        self.stack.close()
+
+
+class PipelinedRunner:
+    # capture -> inference -> publish stages on their own threads, linked by
+    # bounded queues so the next capture overlaps the current inference and
+    # a slow stage applies backpressure instead of piling up samples
+    
+    SUFFIXES = {"image": ".jpg", "audio": ".ogg"}
+    
+    def __init__(self, media_processor, plugin, args, queue_size=2, publisher=None):
+        self.media = media_processor
+        self.plugin = plugin
+        self.publisher = publisher or plugin
+        self.args = args
+        self.capture_queue = queue.Queue(maxsize=queue_size)
+        self.publish_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+    
+    def run(self):
+        capture = LiveCapture(self.args.modes, self.args.audio_duration, self.args.camera_device)
+        threads = [
+            threading.Thread(target=self._capture_loop, args=(capture,), name="capture", daemon=True),
+            threading.Thread(target=self._inference_loop, name="inference", daemon=True),
+            threading.Thread(target=self._publish_loop, name="publish", daemon=True),
+        ]
+        for t in threads:
+            t.start()
+        try:
+            while any(t.is_alive() for t in threads):
+                threads[0].join(timeout=1)
+        except KeyboardInterrupt:
+            logger.info("Stopping pipeline...")
+        finally:
+            self.stop_event.set()
+            capture.close()
+    
+    def _put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+    
+    def _get(self, q):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=1)
+            except queue.Empty:
+                continue
+        return None
+    
+    def _capture_loop(self, capture):
+        next_tick = time.monotonic()
+        while not self.stop_event.is_set():
+            samples = capture.capture()
+            if samples:
+                self._put(self.capture_queue, samples)
+            else:
+                logger.error("No valid samples captured")
+            next_tick += self.args.period
+            self.stop_event.wait(max(0.0, next_tick - time.monotonic()))
+    
+    def _inference_loop(self):
+        while not self.stop_event.is_set():
+            samples = self._get(self.capture_queue)
+            if samples is None:
+                break
+            items = [(mode, data) for mode, data, _ in samples]
+            try:
+                with self.plugin.timeit("plugin.duration.processing"):
+                    result, reused = self.media.infer_gated(self.args.task, items, self.args.event_description,
+                                                            self.args.user_text, self.args.max_tokens)
+                if result is not None:
+                    self._put(self.publish_queue, (samples, result, reused, None))
+            except Exception as e:
+                logger.error(f"Error processing samples: {e}")
+                self._put(self.publish_queue, (samples, None, False, str(e)))
+    
+    def _publish_loop(self):
+        while not self.stop_event.is_set():
+            entry = self._get(self.publish_queue)
+            if entry is None:
+                break
+            samples, result, reused, error = entry
+            try:
+                if error is not None:
+                    self.publisher.publish("gemma3n.error", error,
+                                        meta={"modes": self.args.modes, "task": self.args.task})
+                    continue
+                uploads = []
+                names = []
+                for mode, _, sample in samples:
+                    path = os.path.join(TEMP_DIR, f"live_{mode}_{sample.timestamp}{self.SUFFIXES[mode]}")
+                    names.append(os.path.basename(path))
+                    if not reused:
+                        sample.save(path)
+                        uploads.append((path, mode, sample.timestamp))
+                self.media.publish_result(self.publisher, self.args.task, self.args.modes, result,
+                                          names=names,
+                                          timestamps=[sample.timestamp for _, _, sample in samples],
+                                          uploads=uploads,
+                                          event_description=self.args.event_description,
+                                          live_capture=True,
+                                          reused=reused)
+            except Exception as e:
+                logger.error(f"Error publishing results: {e}")
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Gemma3n Waggle CLI Tool - Process media and publish to Waggle ecosystem')
     parser.add_argument('task', choices=['caption', 'detect'], 
                        help='Task to perform')
@@ -234,46 +428,84 @@ def main():
                        help='Camera device ID or URL for live capture')
     parser.add_argument('--log-dir', type=str,
                        help='Directory for pywaggle run logs')
+    parser.add_argument('--no-pipeline', action='store_true',
+                       help='Run periodic live capture sequentially instead of pipelined')
+    parser.add_argument('--queue-size', type=int, default=2,
+                       help='Bounded queue size between pipeline stages')
+    parser.add_argument('--gate', action='store_true',
+                       help='Skip inference when the captured media has not changed since the last processed sample')
+    parser.add_argument('--image-change-threshold', type=float, default=None,
+                       help='Image change score (0-1) needed to run inference when --gate is set')
+    parser.add_argument('--audio-change-threshold', type=float, default=None,
+                       help='Audio change score (0-1) needed to run inference when --gate is set')
+    parser.add_argument('--on-unchanged', choices=['republish', 'suppress'], default='republish',
+                       help='Republish the previous result or publish nothing when the media is unchanged')
+    parser.add_argument('--spool-dir', type=str, default=SPOOL_DIR,
+                       help='Directory of the on-disk spool that buffers results until the broker accepts them')
+    parser.add_argument('--no-spool', action='store_true',
+                       help='Publish and upload inline instead of through the spool')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     if args.log_dir:
         os.environ['PYWAGGLE_LOG_DIR'] = args.log_dir
         logger.info(f"Pywaggle logs will be saved to: {args.log_dir}")
     
-    processor = WaggleMediaProcessor()
+    from waggle.plugin import Plugin
+    from src.gating import build_gate
     
-    def run_processing():
+    processor = WaggleMediaProcessor(gate=build_gate(args), on_unchanged=args.on_unchanged)
+    
+    def run_processing(plugin):
         try:
-            with Plugin() as plugin:
-                processor.process_and_publish(
-                    plugin=plugin,
-                    task=args.task,
-                    modes=args.modes,
-                    files=[],  
-                    event_description=args.event_description,
-                    user_text=args.user_text,
-                    max_tokens=args.max_tokens,
-                    use_live_capture=args.live_capture,
-                    audio_duration=args.audio_duration,
-                    camera_device=args.camera_device
-                )
+            processor.process_and_publish(
+                plugin=plugin,
+                task=args.task,
+                modes=args.modes,
+                files=[],  
+                event_description=args.event_description,
+                user_text=args.user_text,
+                max_tokens=args.max_tokens,
+                use_live_capture=args.live_capture,
+                audio_duration=args.audio_duration,
+                camera_device=args.camera_device,
+                publisher=publisher
+            )
         except Exception as e:
             logger.error(f"Error in processing cycle: {e}")
     
-    if args.period > 0:
-        logger.info(f"Starting periodic execution every {args.period} seconds")
-        logger.info(f"Task: {args.task}, Modes: {args.modes}, Live capture: {args.live_capture}")
-        
-        run_processing()
+    # one plugin connection for the lifetime of the process
+    with Plugin() as plugin:
+        spool = sender = None
+        publisher = plugin
+        if not args.no_spool:
+            spool = Spool(args.spool_dir)
+            sender = SpoolSender(spool, plugin).start()
+            publisher = spool.publisher()
+            logger.info(f"Spooling results in {args.spool_dir} ({spool.depth} pending from earlier runs)")
         
-        while True:
-            time.sleep(args.period)
-            run_processing()
-    else:
-        logger.info(f"Running single execution - Task: {args.task}, Modes: {args.modes}")
-        run_processing()
-
+        try:
+            if args.period > 0 and args.live_capture and not args.no_pipeline:
+                logger.info(f"Starting pipelined capture every {args.period} seconds")
+                logger.info(f"Task: {args.task}, Modes: {args.modes}, Queue size: {args.queue_size}")
+                PipelinedRunner(processor, plugin, args, queue_size=args.queue_size, publisher=publisher).run()
+            elif args.period > 0:
+                logger.info(f"Starting periodic execution every {args.period} seconds")
+                logger.info(f"Task: {args.task}, Modes: {args.modes}, Live capture: {args.live_capture}")
+                
+                run_processing(plugin)
+                
+                while True:
+                    time.sleep(args.period)
+                    run_processing(plugin)
+            else:
+                logger.info(f"Running single execution - Task: {args.task}, Modes: {args.modes}")
+                run_processing(plugin)
+        finally:
+            if sender is not None:
+                sender.stop(drain=True)
+                logger.info(f"Spool stats: {sender.stats()}")
+                spool.close()
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file